@@ -1,28 +1,39 @@
 import asyncio
-import base64
 import io
 import os
-import tempfile
 import uuid
 import json
 
-from fastapi import FastAPI, Form, HTTPException, Path, UploadFile, status
+from fastapi import FastAPI, HTTPException, Path, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+from python_multipart.multipart import MultipartParser, parse_options_header
 from models import Address, PersonEntry, Knowledge, FinalOutput, InteractiveTurnOutput, ConvoInfo
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from settings import env_settings
+from circuit import CircuitOpenError, circuit_breaker, circuit_stats
+from convo_store import ConversationStore, SpillStore
+from settings import env_settings, openai_client
+from logs import get_logger
+from metrics import CONVO_STAGE_SECONDS, convo_id_var, prompt_cache_stats, render_metrics, span
+from prompts import INTERACTIVE_TURN_PROMPT
+from scheduler import Priority, interactive, priority_var
+from collections import OrderedDict
 from typing import Literal, Any
 
+logger = get_logger(__name__)
+
 
 class MessageToUser(BaseModel):
-    type: Literal["audio", "output"]
+    type: Literal["audio", "output", "partial", "complete"]
 
 
 class AudioMessageToUser(MessageToUser):
     type: str = "audio"
     audio_message: str
+    # Started when the message is posted, so that speech is ready by the time the client polls for it
+    _speech: Any = PrivateAttr(default=None)
 
 
 class OutputMessageToUser(MessageToUser):
@@ -30,17 +41,56 @@ class OutputMessageToUser(MessageToUser):
     final_output: dict
 
 
+class PartialOutputMessageToUser(MessageToUser):
+    """A section of the final output, sent as soon as it is ready so that the client can render it."""
+
+    type: str = "partial"
+    section: str
+    content: Any
+
+
+class CompleteMessageToUser(MessageToUser):
+    """Sent after the final output, nothing follows it."""
+
+    type: str = "complete"
+
+
 class Conversation(BaseModel):
-    messages_to_user: list[MessageToUser]
-    messages_to_agent: list[str]
+    messages_to_user: list[MessageToUser] = []
+    messages_to_agent: list[str] = []
     outputs: list[FinalOutput] = []
     knowledge: Knowledge | None = None
     story_history: list[str] = []
     final_output: dict = {}
-
-
-CONVO_DB: dict[str, Conversation] = {}
+    profile_id: str | None = None
+    deadline: float | None = None
+    # Set whenever a user message is delivered, so the agent does not have to poll for it
+    _message_arrived: asyncio.Event = PrivateAttr(default_factory=asyncio.Event)
+    # Keeps the answers of one family in the order they were recorded
+    _transcription_lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+    # Speech of the most recent spoken messages, served by `/speech/{convo_id}/{speech_id}`
+    _speech_streams: OrderedDict[str, Any] = PrivateAttr(default_factory=OrderedDict)
+    # Main agent run of the conversation, cancelled when the family leaves for good
+    _agent_task: asyncio.Task | None = PrivateAttr(default=None)
+
+
+# Conversations idle for longer than `CONVO_IDLE_TTL_SECONDS` are kept on disk, see convo_store.py
+CONVO_DB: ConversationStore[Conversation] = ConversationStore(
+    Conversation,
+    SpillStore(env_settings.convo_store_path),
+    transient={"messages_to_user", "messages_to_agent"},
+)
 CONVO_ID = 0
+# Only the most recent plans and story scenes are kept in memory, older ones are spilled to disk
+MAX_RESIDENT_OUTPUTS = 3
+MAX_RESIDENT_STORY_SCENES = 20
+JANITOR_INTERVAL_SECONDS = 60
+
+# The transcription API does not accept larger files
+MAX_AUDIO_UPLOAD_BYTES = 25 * 1024 * 1024
+# Boundaries, part headers and any small form fields sent along with the audio file
+MAX_FORM_OVERHEAD_BYTES = 64 * 1024
+MAX_SPEECH_STREAMS = 4
 
 
 # Initialize FastAPI app
@@ -64,19 +114,50 @@ os.makedirs("static", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+@app.on_event("startup")
+async def start_background_jobs():
+    from tools.event_tool import run_event_cache_warmer
+    from tools.story_catalog import run_story_catalog_builder
+
+    if not env_settings.run_in_cli:
+        asyncio.create_task(run_event_cache_warmer())
+        asyncio.create_task(run_story_catalog_builder())
+        asyncio.create_task(run_conversation_janitor())
+
+
+async def run_conversation_janitor() -> None:
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL_SECONDS)
+        evict_idle_conversations()
+
+
+def evict_idle_conversations() -> None:
+    for convo_id in CONVO_DB.idle(env_settings.convo_idle_ttl_seconds):
+        logger.info("Evicting idle conversation %s", convo_id)
+        task = CONVO_DB.evict(convo_id)._agent_task
+        if task is not None and not task.done():
+            # Nobody is waiting for this plan any more
+            task.cancel()
+
+
 class StartBody(BaseModel):
     conversation_id: str | None = None
+    profile_id: str | None = None
+    # Seconds until the plan has to be ready, e.g. until bedtime
+    time_budget_seconds: float | None = None
 
 
 @app.post("/start")
 async def start(body: StartBody):
     global CONVO_DB
+    from deadline import deadline_in
+    from profiles import profile_store
 
     CONVO_ID = body.conversation_id or str(uuid.uuid4())
     outputs = []
     knowledge = None
     if CONVO_ID in CONVO_DB:
-        outputs = CONVO_DB[CONVO_ID].outputs
+        outputs = CONVO_DB.full(CONVO_ID, "outputs")
         knowledge = CONVO_DB[CONVO_ID].knowledge
         del CONVO_DB[CONVO_ID]
         # raise HTTPException(
@@ -84,48 +165,85 @@ async def start(body: StartBody):
         #     detail="Conversation ID already exists",
         # )
 
+    # Returning families are recognised by profile ID or by a previous conversation ID
+    profile_id = await profile_store.attach(body.profile_id, CONVO_ID)
+    if knowledge is None:
+        knowledge = profile_store.get(profile_id).knowledge
+
     CONVO_DB[CONVO_ID] = Conversation(
         messages_to_user=[],
         messages_to_agent=[],
-        outputs=outputs,
+        outputs=outputs[-MAX_RESIDENT_OUTPUTS:],
         knowledge=knowledge,
         final_output={},
+        profile_id=profile_id,
+        deadline=deadline_in(body.time_budget_seconds or env_settings.story_time_budget_seconds),
     )
+    if len(outputs) > MAX_RESIDENT_OUTPUTS:
+        CONVO_DB.spill_cold(CONVO_ID, "outputs", outputs[:-MAX_RESIDENT_OUTPUTS])
 
     from main_agent import main_agent
 
-    print("Starting main agent")
-    asyncio.create_task(main_agent(CONVO_ID))
-    print("CONVO_ID: ", CONVO_ID)
-    return {"conversation_id": CONVO_ID}
+    logger.info("Starting main agent for conversation %s", CONVO_ID)
+    CONVO_DB[CONVO_ID]._agent_task = asyncio.create_task(main_agent(CONVO_ID))
+    return {"conversation_id": CONVO_ID, "profile_id": profile_id}
 
 
-def add_to_output(convo_id: str, item_id: str, item: dict):
+def add_to_output(convo_id: str, item_id: str, item: Any):
     global CONVO_DB
     if convo_id not in CONVO_DB:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Conversation ID not found",
         )
-    print("Adding to output...")
+    logger.info("Adding %s to output", item_id)
     CONVO_DB[convo_id].final_output[item_id] = item
+    publish_section(convo_id, item_id, item)
     return {"message": "Item added successfully"}
 
 
+def append_output(convo_id: str, output: FinalOutput) -> None:
+    conversation = CONVO_DB[convo_id]
+    conversation.outputs.append(output)
+    if len(conversation.outputs) > MAX_RESIDENT_OUTPUTS:
+        cold = conversation.outputs[:-MAX_RESIDENT_OUTPUTS]
+        conversation.outputs = conversation.outputs[-MAX_RESIDENT_OUTPUTS:]
+        CONVO_DB.spill_cold(convo_id, "outputs", cold)
+
+
+def append_story_scene(convo_id: str, scene: str) -> None:
+    """Only the recent scenes are kept in memory, and they are all the storyteller needs to carry on."""
+    conversation = CONVO_DB[convo_id]
+    conversation.story_history.append(scene)
+    if len(conversation.story_history) > MAX_RESIDENT_STORY_SCENES:
+        cold = conversation.story_history[:-MAX_RESIDENT_STORY_SCENES]
+        conversation.story_history = conversation.story_history[-MAX_RESIDENT_STORY_SCENES:]
+        CONVO_DB.spill_cold(convo_id, "story_history", cold)
+
+
+def publish_section(convo_id: str, section: str, content: Any) -> None:
+    """Send a section of the output to the client now, instead of only with the final output."""
+    if not env_settings.run_in_cli:
+        post_message(convo_id, PartialOutputMessageToUser(section=section, content=content))
+
+
 def post_message(convo_id: str, message: MessageToUser):
     if env_settings.run_in_cli:
         print("Posting message without voice...")
         print("CONVO_ID: ", convo_id)
         print("Message: ", message.model_dump())
         return
-    print("Posting message...")
     global CONVO_DB
     if convo_id not in CONVO_DB:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Conversation ID not found",
         )
-    print("CONVO_ID: ", convo_id)
+    logger.info("Posting %s message", message.type)
+    if isinstance(message, AudioMessageToUser):
+        from audio import SpeechStream
+
+        message._speech = SpeechStream(openai_client, message.audio_message, "question")
     CONVO_DB[convo_id].messages_to_user.append(message)
     return {"message": "Message added successfully"}
 
@@ -135,24 +253,29 @@ async def wait_for_user_message(convo_id: str):
         # Run blocking input() in a separate thread
         user_input = await asyncio.to_thread(input, "Waiting for user message: ")
         return user_input
-    print("Waiting for user message...")
-    print("CONVO_ID: ", convo_id)
+    logger.info("Waiting for user message")
     global CONVO_DB
     if convo_id not in CONVO_DB:
-        print("CONVO_ID not found")
+        logger.warning("Conversation %s not found", convo_id)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Conversation ID not found",
         )
 
-    while True:
-        print("Waiting for user message...")
-        if CONVO_DB[convo_id].messages_to_agent:
-            print("User message found")
-            msg = CONVO_DB[convo_id].messages_to_agent.pop(0)
-            print("User message: ", msg)
-            return msg
-        await asyncio.sleep(5)
+    conversation = CONVO_DB[convo_id]
+    while not conversation.messages_to_agent:
+        conversation._message_arrived.clear()
+        await conversation._message_arrived.wait()
+    msg = conversation.messages_to_agent.pop(0)
+    logger.debug("User message: %s", msg)
+    return msg
+
+
+def deliver_user_message(convo_id: str, message: str) -> None:
+    """Hand a user message to the agent waiting in `wait_for_user_message`."""
+    conversation = CONVO_DB[convo_id]
+    conversation.messages_to_agent.append(message)
+    conversation._message_arrived.set()
 
 
 @app.get("/state/{convo_id}")
@@ -163,40 +286,41 @@ async def get_state(convo_id: str = Path()):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Conversation with ID {convo_id} not found",
         )
+    convo_id_var.set(convo_id)
     if CONVO_DB[convo_id].messages_to_user:
         msg: MessageToUser = CONVO_DB[convo_id].messages_to_user.pop(0)
 
         if msg.type == "audio":
-            try:
-                # Create a bytes buffer to store the audio
-                buffer = io.BytesIO()
-
-                # Generate speech and stream it to the buffer
-                with client.audio.speech.with_streaming_response.create(
-                    model="gpt-4o-mini-tts",
-                    voice="coral",
-                    input=msg.audio_message,
-                    instructions="Speak in a cheerful and positive tone.",
-                ) as response:
-                    # Stream to our buffer instead of a file
-                    for chunk in response.iter_bytes():
-                        buffer.write(chunk)
-
-                # Reset buffer position to start
-                buffer.seek(0)
-
-                # Encode the entire audio buffer to base64
-                audio_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-                # Return the base64-encoded audio
-                return {
-                    "type": "audio",
-                    "audio_base64": audio_base64,
-                    "text": msg.audio_message,
-                    "format": "mp3",  # OpenAI returns MP3 by default
-                }
-            except Exception as e:
-                return None
+            speech_id = uuid.uuid4().hex
+            speech_streams = CONVO_DB[convo_id]._speech_streams
+            if msg._speech is None:
+                from audio import SpeechStream
+
+                with interactive():
+                    msg._speech = SpeechStream(openai_client, msg.audio_message, "question")
+            speech_streams[speech_id] = msg._speech
+            while len(speech_streams) > MAX_SPEECH_STREAMS:
+                speech_streams.popitem(last=False)[1].cancel()
+            return {
+                "type": "audio",
+                "audio_url": f"/speech/{convo_id}/{speech_id}",
+                "text": msg.audio_message,
+                "format": "mp3",
+            }
+        elif msg.type == "partial":
+            # Sections are small and the client polls, so all of the pending ones are sent at once
+            sections = {msg.section: msg.content}
+            messages = CONVO_DB[convo_id].messages_to_user
+            while messages and messages[0].type == "partial":
+                section = messages.pop(0)
+                sections[section.section] = section.content
+            return {
+                "type": "partial",
+                "sections": sections,
+                "format": "json",
+            }
+        elif msg.type == "complete":
+            return {"type": "complete"}
         else:
             return {
                 "type": "output",
@@ -206,38 +330,222 @@ async def get_state(convo_id: str = Path()):
     return None
 
 
-from openai import OpenAI
+@app.get("/speech/{convo_id}/{speech_id}")
+async def get_speech(convo_id: str = Path(), speech_id: str = Path()):
+    """Speech of a spoken message, streamed sentence by sentence as soon as each one is synthesized."""
+    convo = CONVO_DB.get(convo_id)
+    speech = convo._speech_streams.get(speech_id) if convo is not None else None
+    if speech is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Speech not found")
+    return StreamingResponse(speech.iter_chunks(), media_type="audio/mpeg")
+
+
+class AudioUpload:
+    """
+    The `audio` file of a multipart form, parsed while the request body streams in.
+
+    Only the audio part is kept, in memory, and the upload is rejected as soon as it goes over
+    `MAX_AUDIO_UPLOAD_BYTES`, instead of being spooled to disk in full before the handler runs.
+    """
+
+    def __init__(self, boundary: bytes, field: str = "audio"):
+        self.field = field.encode()
+        self.data = io.BytesIO()
+        self.filename: str | None = None
+        self.content_type: str | None = None
+        self.found = False
+        self._in_field = False
+        self._headers: dict[bytes, bytes] = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+            },
+        )
 
-client = OpenAI()
+    @classmethod
+    async def read(cls, request: Request) -> "AudioUpload":
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="Expected a multipart form with an audio file"
+            )
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_AUDIO_UPLOAD_BYTES + MAX_FORM_OVERHEAD_BYTES:
+            raise _audio_too_large()
+
+        upload = cls(options[b"boundary"])
+        received = 0
+        async for chunk in request.stream():
+            # Without a Content-Length, fields other than the audio could still be sent forever
+            received += len(chunk)
+            if received > MAX_AUDIO_UPLOAD_BYTES + MAX_FORM_OVERHEAD_BYTES:
+                raise _audio_too_large()
+            upload._parser.write(chunk)
+        upload._parser.finalize()
+        if not upload.found:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail="No audio file in the form")
+        return upload
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._in_field = False
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, disposition = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._in_field = not self.found and disposition.get(b"name") == self.field
+        if self._in_field:
+            self.found = True
+            filename = disposition.get(b"filename")
+            self.filename = filename.decode("latin-1") if filename else None
+            content_type = self._headers.get(b"content-type")
+            self.content_type = content_type.decode("latin-1") if content_type else None
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if not self._in_field:
+            return
+        if self.data.tell() + end - start > MAX_AUDIO_UPLOAD_BYTES:
+            raise _audio_too_large()
+        self.data.write(data[start:end])
+
+
+def _audio_too_large() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail="Audio file is too large")
 
 
 @app.post("/message/audio/{convo_id}")
-async def send_message(convo_id: str = Path(), audio: UploadFile = Form()):
+async def send_message(request: Request, convo_id: str = Path()):
     global CONVO_DB
     if convo_id not in CONVO_DB:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Conversation ID not found",
         )
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as temp_file:
-        # Write the uploaded file content to the temporary file
-        content = await audio.read()
-        temp_file.write(content)
-        temp_file_path = temp_file.name
+    convo_id_var.set(convo_id)
+    audio = await AudioUpload.read(request)
 
-    try:
-        # Open the temporary file and send to OpenAI for transcription
-        with open(temp_file_path, "rb") as file:
-            transcription = client.audio.transcriptions.create(model="gpt-4o-transcribe", file=file)
+    from convert_mp3 import prepare_for_transcription
+
+    upload = await prepare_for_transcription(audio.data.getvalue(), audio.filename or "answer.webm", audio.content_type)
+    conversation = CONVO_DB[convo_id]
+    async with conversation._transcription_lock:
+        try:
+            with span("transcription"), interactive():
+                async with circuit_breaker("openai_transcription").guard():
+                    transcription = await openai_client.audio.transcriptions.create(
+                        model="gpt-4o-transcribe", file=upload
+                    )
+        except CircuitOpenError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Voice input is unavailable, please type"
+            )
+
+        logger.debug("Transcription: %s", transcription.text)
+        deliver_user_message(convo_id, transcription.text)
+    return {"transcription": transcription.text}
 
-        print(transcription.text)
-        # Return the transcription result
-        CONVO_DB[convo_id].messages_to_agent.append(transcription.text)
-        return {"transcription": transcription.text}
 
+@app.websocket("/ws/audio/{convo_id}")
+async def stream_audio(websocket: WebSocket, convo_id: str):
+    """
+    Voice answers streamed as raw 16 kHz mono PCM16 binary messages while the parent talks.
+
+    Partial and final transcripts are sent back as JSON, final ones also go straight to the agent.
+    A text message "end" finishes the utterance in progress without waiting for silence.
+    """
+    from voice import VoiceSession, voice_transcriber
+
+    if convo_id not in CONVO_DB:
+        await websocket.close(code=4404, reason="Conversation ID not found")
+        return
+    await websocket.accept()
+    convo_id_var.set(convo_id)
+    # The parent is talking to us, everything this connection transcribes is interactive
+    priority_var.set(Priority.INTERACTIVE)
+
+    session = VoiceSession(voice_transcriber, websocket.send_json, lambda text: deliver_user_message(convo_id, text))
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                await session.feed(message["bytes"])
+            elif message.get("text") == "end":
+                await session.flush()
+    except WebSocketDisconnect:
+        pass
     finally:
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
+        session.close()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return render_metrics()
+
+
+@app.get("/stats/timings/{convo_id}")
+async def get_convo_timings(convo_id: str = Path()):
+    """Seconds spent in every stage of the pipeline for one conversation."""
+    if convo_id not in CONVO_STAGE_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No timings recorded for this conversation",
+        )
+    return CONVO_STAGE_SECONDS[convo_id]
+
+
+@app.get("/stats/routing")
+async def get_routing_stats():
+    from routing import routing_stats
+
+    return routing_stats()
+
+
+@app.get("/stats/memory")
+async def get_memory_stats():
+    """Approximate footprint of every conversation in memory and on disk."""
+    import resource
+
+    return {
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **CONVO_DB.footprint(),
+    }
+
+
+@app.get("/stats/prompt_cache")
+async def get_prompt_cache_stats():
+    """Share of input tokens every agent got from the prompt cache."""
+    return prompt_cache_stats()
+
+
+@app.get("/stats/circuits")
+async def get_circuit_stats():
+    return circuit_stats()
+
+
+@app.get("/stats/memo")
+async def get_memo_stats():
+    from memo import memo_stats
+
+    return memo_stats()
 
 
 class InteractiveStoryRequest(BaseModel):
@@ -257,6 +565,7 @@ async def run_interactive_story_turn(convo_id: str, request: InteractiveStoryReq
             detail="Conversation ID not found",
         )
 
+    convo_id_var.set(convo_id)
     conversation = CONVO_DB[convo_id]
     story_history = conversation.story_history
     knowledge = conversation.knowledge
@@ -281,17 +590,20 @@ async def run_interactive_story_turn(convo_id: str, request: InteractiveStoryReq
         chosen_path = user_choice
 
     # Prepare input for the agent
-    input_prompt = f"Story History: {'\n\n'.join(story_history)}\n\n" f"Chosen Path: {chosen_path}"
+    input_prompt = INTERACTIVE_TURN_PROMPT.render(history="\n\n".join(story_history), chosen_path=chosen_path)
 
-    print(f"Running interactive story agent for {convo_id} with input:\n{input_prompt}")
+    logger.debug("Running interactive story agent with input:\n%s", input_prompt)
 
     # Run the agent
     try:
-        agent_result = await Runner.run(
-            interactive_story_illustrator_agent, input_prompt, context=ConvoInfo(convo_id=convo_id, existing_convo=True)
-        )
+        with interactive():
+            agent_result = await Runner.run(
+                interactive_story_illustrator_agent,
+                input_prompt,
+                context=ConvoInfo(convo_id=convo_id, existing_convo=True),
+            )
     except Exception as e:
-        print(f"Error running interactive_story_illustrator_agent: {e}")
+        logger.exception("Error running interactive_story_illustrator_agent")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Agent failed to generate story turn: {e}"
         )
@@ -306,8 +618,8 @@ async def run_interactive_story_turn(convo_id: str, request: InteractiveStoryReq
     turn_output = agent_result.final_output_as(InteractiveTurnOutput)
 
     # Update history
-    conversation.story_history.append(turn_output.scene_text)
+    append_story_scene(convo_id, turn_output.scene_text)
 
-    print(f"Interactive turn complete for {convo_id}. Scene: {turn_output.scene_text[:50]}...")
+    logger.info("Interactive turn complete. Scene: %s...", turn_output.scene_text[:50])
 
     return turn_output
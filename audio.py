@@ -1,51 +1,198 @@
 import asyncio
 import base64
+import re
 import uuid
 from pathlib import Path
 from retry import exponential_backoff
 
 from openai import AsyncOpenAI
-
+from pydantic import BaseModel
+
+from circuit import circuit_breaker
+from convert_mp3 import decode_to_pcm, encode_for_delivery, encode_pcm_for_delivery
+from deadline import finished_prefix, gather_until
+from hedging import hedged
+from metrics import span
+from settings import env_settings, openai_client
 from tools.storyboard_agent import StoryboardOutput, _get_storyboard
 
+NARRATION_SAMPLE_RATE = 24_000
+# Sentences shorter than this are synthesized together with the next one
+MIN_CHUNK_CHARS = 40
+# Sentences of one text synthesized at the same time, the first one is always requested first
+CHUNK_CONCURRENCY = 3
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+class NarrationScene(BaseModel):
+    start: float
+    end: float
+
+
+class StitchedNarration(BaseModel):
+    """A single narration track for the whole story, with the offsets of every scene in seconds."""
+
+    track: str
+    manifest: str
+    duration: float
+    scenes: list[NarrationScene]
+
+
+class NarrationOutput(BaseModel):
+    scene_paths: list[str]
+    stitched: StitchedNarration | None = None
 
-@exponential_backoff()
-async def generate_audio(client: AsyncOpenAI, prompt: str, output_path) -> None:
-    async with client.audio.speech.with_streaming_response.create(
-        model="gpt-4o-mini-tts",
-        voice="coral",
-        input=prompt,
-        instructions="Speak in a cheerful and positive tone.",
-    ) as response:
-        await response.stream_to_file(output_path)
+
+def split_sentences(text: str, min_chars: int = MIN_CHUNK_CHARS) -> list[str]:
+    """Split the text at sentence boundaries, merging short sentences so that every chunk sounds natural."""
+    chunks: list[str] = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        if chunks and len(chunks[-1]) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {sentence}"
+        elif sentence:
+            chunks.append(sentence)
+    return chunks
 
 
 @exponential_backoff()
-async def generate_audio_from_storyboard(story_board: StoryboardOutput) -> None:
-    """Generate audio from the storyboard output."""
-    from openai import AsyncOpenAI
+async def synthesize_speech(client: AsyncOpenAI, text: str, name: str = "chunk") -> bytes:
+    with span("tts", name):
+        async with circuit_breaker("openai_tts").guard():
+            response = await hedged(
+                "tts",
+                lambda: client.audio.speech.create(
+                    model="gpt-4o-mini-tts",
+                    voice="coral",
+                    input=text,
+                    instructions="Speak in a cheerful and positive tone.",
+                ),
+            )
+    return response.content
+
+
+class SpeechStream:
+    """
+    Speech for a text, synthesized sentence by sentence as pipelined tasks and read back in order.
+
+    The first sentence can be played as soon as it is ready, while the following ones are still being
+    synthesized. MP3 chunks can simply be concatenated, so the stream can be served as a single file.
+    """
+
+    def __init__(self, client: AsyncOpenAI, text: str, name: str = "chunk"):
+        self.chunks = split_sentences(text)
+        slots = asyncio.Semaphore(CHUNK_CONCURRENCY)
 
-    client = AsyncOpenAI()
-    output_dir = Path("static/sample_audio")
+        async def synthesize(chunk: str) -> bytes:
+            async with slots:
+                return await synthesize_speech(client, chunk, name)
+
+        # Tasks are created, and the semaphore is acquired, in sentence order
+        self._tasks = [asyncio.create_task(synthesize(chunk)) for chunk in self.chunks]
+
+    async def iter_chunks(self, deliver: bool = True):
+        """
+        Yield every chunk as soon as it and all chunks before it are ready.
+
+        A consumer that goes away, e.g. a client that disconnects, leaves the synthesis running, the
+        stream may be cached and read again. It is only cancelled when a sentence failed.
+        """
+        try:
+            for task in self._tasks:
+                # Shielded, a listener cancelled while it waits must not cancel the sentence for the next one
+                audio = await asyncio.shield(task)
+                yield await encode_for_delivery(audio) if deliver else audio
+        except Exception:
+            self.cancel()
+            raise
+
+    async def read(self, deliver: bool = True) -> bytes:
+        """The whole speech, for a caller that owns the stream: it is cancelled along with the caller."""
+        try:
+            return b"".join([chunk async for chunk in self.iter_chunks(deliver)])
+        except BaseException:
+            self.cancel()
+            raise
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+
+async def generate_audio(client: AsyncOpenAI, prompt: str, output_path) -> bytes:
+    """Write the speech for delivery to `output_path`, returns it as generated."""
+    speech = await SpeechStream(client, prompt, "narration").read(deliver=False)
+    Path(output_path).write_bytes(await encode_for_delivery(speech))
+    return speech
+
+
+async def generate_audio_from_storyboard(
+    story_board: StoryboardOutput, deadline: float | None = None
+) -> NarrationOutput:
+    """Generate audio from the storyboard output, with a deadline only the scenes finished before it, in order."""
+    client = openai_client
+    output_dir = Path("static/sample_audio") / uuid.uuid4().hex
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    async with asyncio.TaskGroup() as tg:
-        [
-            tg.create_task(
+    scene_audio = finished_prefix(
+        await gather_until(
+            deadline,
+            *(
                 generate_audio(
                     client,
                     prompt=scene,
                     output_path=output_dir / f"audio_{i}.mp3",
                 )
-            )
-            for i, scene in enumerate(story_board.narration)
-        ]
+                for i, scene in enumerate(story_board.narration)
+            ),
+        )
+    )
+
+    stitched = None
+    if env_settings.stitch_narration and scene_audio:
+        stitched = await stitch_narration(scene_audio, output_dir)
+    return NarrationOutput(
+        scene_paths=[str(output_dir / f"audio_{i}.mp3") for i in range(len(scene_audio))],
+        stitched=stitched,
+    )
+
+
+async def stitch_narration(scene_audio: list[bytes], output_dir: Path) -> StitchedNarration | None:
+    """
+    Join the scene narrations into one gapless track, so the client downloads a single file and seeks in it.
+
+    The scenes are decoded and encoded once as a whole, which avoids the silence MP3 encoders pad every
+    file with. Returns None when ffmpeg is not available.
+    """
+    with span("tts", "stitch"):
+        scene_pcm = await asyncio.gather(*(decode_to_pcm(audio, NARRATION_SAMPLE_RATE) for audio in scene_audio))
+        if any(pcm is None for pcm in scene_pcm):
+            return None
+        track = await encode_pcm_for_delivery(b"".join(scene_pcm), NARRATION_SAMPLE_RATE)
+        if track is None:
+            return None
+
+    track_path, manifest_path = output_dir / "narration.mp3", output_dir / "narration.json"
+    track_path.write_bytes(track)
+    scenes = narration_offsets([len(pcm) / 2 / NARRATION_SAMPLE_RATE for pcm in scene_pcm])
+    narration = StitchedNarration(
+        track=str(track_path),
+        manifest=str(manifest_path),
+        duration=scenes[-1].end if scenes else 0.0,
+        scenes=scenes,
+    )
+    manifest_path.write_text(narration.model_dump_json(indent=2))
+    return narration
+
 
-    return [str(output_dir / f"audio_{i}.mp3") for i, scene in enumerate(story_board.narration)]
+def narration_offsets(durations: list[float]) -> list[NarrationScene]:
+    scenes, start = [], 0.0
+    for duration in durations:
+        scenes.append(NarrationScene(start=round(start, 3), end=round(start + duration, 3)))
+        start += duration
+    return scenes
 
 
 async def test_1():
-    client = AsyncOpenAI()
     storyboard_output = await _get_storyboard(
         """
     **Dino Adventures in Rainbow Valley**
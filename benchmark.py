@@ -0,0 +1,233 @@
+"""
+End-to-end latency and throughput benchmark of the family evening pipeline.
+
+Simulated families drive the API the same way the frontend does: `/start`, polling `/state`, answering
+every spoken question with an audio upload, and finally one `/interactive_story` turn. The API runs
+in this process, so event loop lag and memory are measured on the server itself, while the models
+are served by the local stand-in (`stub_server.py`), which is never the real, paid API.
+
+Run it with the stand-in configured in `.env` (see `stub_server.py`):
+
+```bash
+python benchmark.py --families 1,10,100,500 --start-stub --stub-latency-scale 0.05
+```
+
+Every run is appended to a JSON history, and metrics that got more than 10% slower than in the
+previous run of the same scenario are reported as regressions.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+LAG_PROBE_INTERVAL = 0.05
+REGRESSION_THRESHOLD = 1.1
+LATENCY_METRICS = [
+    "time_to_first_question",
+    "time_to_story",
+    "time_to_first_image",
+    "full_plan",
+    "interactive_turn",
+]
+
+
+class LoopLagProbe:
+    """Measures how late the event loop wakes up a task that sleeps for a fixed interval."""
+
+    def __init__(self):
+        self.lags: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            self.lags.append(time.perf_counter() - start - LAG_PROBE_INTERVAL)
+
+    def __enter__(self) -> "LoopLagProbe":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._task.cancel()
+
+
+async def run_family(client: httpx.AsyncClient, poll_interval: float, timeout: float) -> dict[str, float]:
+    """Drive one family through the whole evening, returning the seconds each milestone took."""
+    from api import CONVO_DB
+
+    timings: dict[str, float] = {}
+    start = time.perf_counter()
+    response = await client.post("/start", json={"conversation_id": str(uuid.uuid4())})
+    response.raise_for_status()
+    convo_id = response.json()["conversation_id"]
+
+    while "full_plan" not in timings:
+        elapsed = time.perf_counter() - start
+        if elapsed > timeout:
+            raise TimeoutError(f"Family {convo_id} did not get a plan within {timeout}s")
+
+        outputs = CONVO_DB[convo_id].final_output
+        if "storyboard" in outputs:
+            timings.setdefault("time_to_story", elapsed)
+        # Catalog stories have no hero image preview, their images all arrive at once
+        if "story_images" in outputs:
+            timings.setdefault("time_to_first_image", elapsed)
+
+        message = (await client.get(f"/state/{convo_id}")).json()
+        if message is not None and message["type"] == "audio":
+            timings.setdefault("time_to_first_question", time.perf_counter() - start)
+            response = await client.post(
+                f"/message/audio/{convo_id}",
+                files={"audio": ("answer.webm", b"\x1a\x45\xdf\xa3" + bytes(16_000), "audio/webm")},
+            )
+            response.raise_for_status()
+            continue
+        if message is not None and message["type"] == "partial" and "story_hero_image" in message["sections"]:
+            timings.setdefault("time_to_first_image", time.perf_counter() - start)
+        elif message is not None and message["type"] == "output":
+            timings["full_plan"] = time.perf_counter() - start
+            break
+        # Polling without a pause would keep the event loop busy and skew its measured lag
+        await asyncio.sleep(poll_interval)
+
+    turn_start = time.perf_counter()
+    response = await client.post(f"/interactive_story/{convo_id}", json={"choice": None}, timeout=timeout)
+    response.raise_for_status()
+    timings["interactive_turn"] = time.perf_counter() - turn_start
+    return timings
+
+
+async def run_scenario(families: int, poll_interval: float, timeout: float) -> dict:
+    from api import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as client:
+        with LoopLagProbe() as probe:
+            wall_start = time.perf_counter()
+            results = await asyncio.gather(
+                *(run_family(client, poll_interval, timeout) for _ in range(families)), return_exceptions=True
+            )
+            wall_time = time.perf_counter() - wall_start
+
+    completed = [result for result in results if isinstance(result, dict)]
+    errors = [repr(result) for result in results if isinstance(result, BaseException)]
+    return {
+        "families": families,
+        "completed": len(completed),
+        "failed": len(errors),
+        "errors": errors[:5],
+        "wall_time_s": wall_time,
+        "plans_per_minute": 60 * len(completed) / wall_time,
+        "latency_s": {
+            metric: _percentiles([result[metric] for result in completed if metric in result])
+            for metric in LATENCY_METRICS
+        },
+        "loop_lag_ms": _percentiles([lag * 1000 for lag in probe.lags]),
+        "rss_mb": _rss_mb(),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _percentiles(values: list[float]) -> dict[str, float | None]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    if len(values) == 1:
+        return {"p50": values[0], "p95": values[0], "p99": values[0], "max": values[0]}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98], "max": max(values)}
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def _git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() or "unknown"
+
+
+def report_regressions(history: list[dict], run: dict) -> None:
+    """Print every p95 latency that regressed against the previous run of the same scenario."""
+    for scenario in run["scenarios"]:
+        previous = next(
+            (
+                old
+                for entry in reversed(history)
+                for old in entry["scenarios"]
+                if old["families"] == scenario["families"]
+            ),
+            None,
+        )
+        if previous is None:
+            continue
+        for metric in LATENCY_METRICS:
+            old, new = previous["latency_s"][metric]["p95"], scenario["latency_s"][metric]["p95"]
+            if old and new and new > old * REGRESSION_THRESHOLD:
+                print(f"REGRESSION {scenario['families']} families, {metric} p95: {old:.2f}s -> {new:.2f}s")
+
+
+def stub_base_url() -> str:
+    """The stand-in's address, exits when it is not configured so that the real API is never used."""
+    from settings import env_settings
+
+    if not env_settings.openai_base_url:
+        sys.exit("OPENAI_BASE_URL is not set, refusing to benchmark against the real OpenAI API.")
+    return env_settings.openai_base_url
+
+
+async def main(args: argparse.Namespace) -> None:
+    stub_base_url()
+    os.environ.setdefault("RUNWAY_API_KEY", "stub")
+
+    run = {"commit": _git_commit(), "timestamp": time.time(), "scenarios": []}
+    for families in args.families:
+        print(f"Running {families} concurrent families...")
+        scenario = await run_scenario(families, args.poll_interval, args.timeout)
+        print(json.dumps(scenario, indent=2))
+        run["scenarios"].append(scenario)
+
+    history = json.loads(args.history.read_text()) if args.history.exists() else []
+    report_regressions(history, run)
+    args.history.write_text(json.dumps(history + [run], indent=2))
+    print(f"Results appended to {args.history}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Family evening pipeline benchmark")
+    parser.add_argument("--families", type=lambda value: [int(n) for n in value.split(",")], default=[1, 10, 100, 500])
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between /state polls")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds a single family may take")
+    parser.add_argument("--history", type=Path, default=Path("benchmark_history.json"))
+    parser.add_argument("--start-stub", action="store_true", help="Start stub_server.py on OPENAI_BASE_URL's port")
+    parser.add_argument("--stub-latency-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    stub = None
+    if args.start_stub:
+        stub_port = httpx.URL(stub_base_url()).port
+        stub = subprocess.Popen(
+            [
+                sys.executable,
+                "stub_server.py",
+                f"--port={stub_port}",
+                f"--latency-scale={args.stub_latency_scale}",
+            ]
+        )
+        time.sleep(2)
+    try:
+        asyncio.run(main(args))
+    finally:
+        if stub is not None:
+            stub.terminate()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from metrics import record_cache
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    In-memory cache where every entry carries its own absolute expiry time.
+
+    Concurrent `get_or_compute` calls for the same missing key are coalesced, so the computation runs
+    once, in its own task, and every caller awaits its result. A caller that is cancelled stops waiting,
+    but does not cancel the computation for the others.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024):
+        self.name = name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._in_flight: dict[K, asyncio.Task[V]] = {}
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, expires_at: float) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: K, compute: Callable[[], Awaitable[V]], expires_at: float) -> V:
+        """Return the cached value, or compute it once for all concurrent callers. None results are not cached."""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            record_cache(self.name, hit=True)
+            return value
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.hits += 1
+            record_cache(self.name, hit=True)
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        record_cache(self.name, hit=False)
+        task = self._in_flight[key] = asyncio.create_task(self._compute(key, compute, expires_at))
+        # Mark the exception as retrieved, in case every caller stopped waiting for it
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: K, compute: Callable[[], Awaitable[V]], expires_at: float) -> V:
+        try:
+            value = await compute()
+            if value is not None:
+                self.set(key, value, expires_at)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
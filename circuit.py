@@ -0,0 +1,151 @@
+"""
+Circuit breakers for the providers the pipeline depends on.
+
+Every provider (OpenAI text, images, speech, transcription, web search and Runway) has its own breaker.
+After `FAILURE_THRESHOLD` consecutive server errors, rate limits, timeouts or connection failures the
+circuit opens, and calls fail at once with `CircuitOpenError` instead of waiting through retries. After
+`RESET_SECONDS` a single probe call is let through (half-open): its success closes the circuit, its
+failure opens it again.
+
+```python
+async with circuit_breaker("openai_images").guard():
+    result = await client.images.generate(...)
+```
+
+Callers catch `CircuitOpenError` to return a degraded result, e.g. a story without video. The breakers
+complement the per-provider slots of `scheduler.py`, which keep one slow provider from using up the
+concurrency and connections of the others.
+"""
+
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncIterator
+
+import httpx
+import openai
+import runwayml
+
+from logs import get_logger
+from metrics import CIRCUIT_REJECTIONS, CIRCUIT_STATE
+
+logger = get_logger(__name__)
+
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 30.0
+
+# Failures that say something about the provider, rather than about the request
+PROVIDER_FAILURES: tuple[type[BaseException], ...] = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    runwayml.APIConnectionError,
+    runwayml.RateLimitError,
+    runwayml.InternalServerError,
+    httpx.TransportError,
+    TimeoutError,
+)
+
+
+class CircuitState(IntEnum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, provider: str):
+        super().__init__(f"{provider} is unavailable, its circuit is open")
+        self.provider = provider
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_seconds: float = RESET_SECONDS):
+        self.name = name
+        self.failure_threshold, self.reset_seconds = failure_threshold, reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+        CIRCUIT_STATE.set(name, value=int(CircuitState.CLOSED))
+
+    @property
+    def state(self) -> CircuitState:
+        if self.opened_at is None:
+            return CircuitState.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return CircuitState.HALF_OPEN
+        return CircuitState.OPEN
+
+    def is_open(self) -> bool:
+        """Whether a call would be rejected right now."""
+        state = self.state
+        return state == CircuitState.OPEN or (state == CircuitState.HALF_OPEN and self._probing)
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """Run the block unless the circuit is open, and record how it went."""
+        probe = self._admit()
+        try:
+            yield
+        except PROVIDER_FAILURES:
+            self._record_failure(probe)
+            raise
+        except BaseException:
+            # The request was at fault, or the caller gave up, which says nothing about the provider
+            if probe:
+                self._probing = False
+            raise
+        self._record_success(probe)
+
+    def _admit(self) -> bool:
+        """Raises `CircuitOpenError` when the call may not go through, returns whether it is the probe."""
+        if self.is_open():
+            CIRCUIT_REJECTIONS.inc(self.name)
+            raise CircuitOpenError(self.name)
+        if self.state == CircuitState.HALF_OPEN:
+            self._probing = True
+            self._set_state(CircuitState.HALF_OPEN)
+            return True
+        return False
+
+    def _record_failure(self, probe: bool) -> None:
+        self.failures += 1
+        if probe:
+            self._probing = False
+        if probe or (self.opened_at is None and self.failures >= self.failure_threshold):
+            logger.warning("Opening the %s circuit after %d failures", self.name, self.failures)
+            self.opened_at = time.monotonic()
+            self._set_state(CircuitState.OPEN)
+
+    def _record_success(self, probe: bool) -> None:
+        if probe:
+            logger.warning("Closing the %s circuit, the provider is back", self.name)
+        # A call that started before the circuit opened does not close it
+        if probe or self.opened_at is None:
+            self.failures, self.opened_at, self._probing = 0, None, False
+            self._set_state(CircuitState.CLOSED)
+
+    def _set_state(self, state: CircuitState) -> None:
+        CIRCUIT_STATE.set(self.name, value=int(state))
+
+
+_BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def circuit_breaker(provider: str) -> CircuitBreaker:
+    if provider not in _BREAKERS:
+        _BREAKERS[provider] = CircuitBreaker(provider)
+    return _BREAKERS[provider]
+
+
+def circuit_stats() -> dict[str, dict]:
+    return {
+        name: {"state": breaker.state.name.lower(), "failures": breaker.failures} for name, breaker in _BREAKERS.items()
+    }
+
+
+def is_circuit_open(error: BaseException) -> bool:
+    """Whether the error, or every error of an exception group, is an open circuit."""
+    if isinstance(error, BaseExceptionGroup):
+        return all(is_circuit_open(inner) for inner in error.exceptions)
+    return isinstance(error, CircuitOpenError)
@@ -1,49 +1,179 @@
+"""
+ffmpeg based audio conversion.
+
+`prepare_for_transcription` and `encode_for_delivery` pipe audio through a bounded pool of ffmpeg
+processes over stdin and stdout, without temporary files. Both return their input unchanged when
+ffmpeg is not installed or fails, so conversion only ever makes the audio smaller, never unavailable.
+"""
+
+import asyncio
 import os
+import shutil
 import subprocess
 import argparse
+from functools import cache
 from pathlib import Path
 
+from logs import get_logger
+from metrics import span
+
+logger = get_logger(__name__)
+
+FFMPEG_CONCURRENCY = os.cpu_count() or 2
+# Silence longer than this is cut, at the start, the end and between sentences
+SILENCE_FILTER = (
+    "silenceremove=start_periods=1:start_threshold=-50dB" ":stop_periods=-1:stop_duration=0.7:stop_threshold=-50dB"
+)
+# Speech models work at 16 kHz mono, so anything more is wasted upload
+TRANSCRIPTION_ARGS = ["-vn", "-af", SILENCE_FILTER, "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k"]
+TRANSCRIPTION_FORMAT = ("ogg", "audio.ogg", "audio/ogg")
+# MP3 plays everywhere, and 32 kbps mono is plenty for a single narrating voice
+DELIVERY_ARGS = ["-vn", "-ac", "1", "-ar", "24000", "-c:a", "libmp3lame", "-b:a", "32k"]
+DELIVERY_FORMAT = "mp3"
+PCM_FORMAT = "s16le"
+
+_ffmpeg_slots = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+
+
+class FFmpegError(Exception):
+    pass
+
+
 def convert_webm_to_mp3(input_file, output_file=None, bitrate="192k"):
     """
     Convert WebM file to MP3 using ffmpeg.
-    
+
     Args:
         input_file (str): Path to the input WebM file
         output_file (str, optional): Path to the output MP3 file. If not provided, will use the same name as input with .mp3 extension
         bitrate (str, optional): Audio bitrate for the output MP3 file. Default is "192k"
-    
+
     Returns:
         str: Path to the output MP3 file
     """
     # Check if input file exists
     if not os.path.isfile(input_file):
         raise FileNotFoundError(f"Input file '{input_file}' not found")
-    
+
     # Create output file path if not provided
     if output_file is None:
         output_file = os.path.splitext(input_file)[0] + ".mp3"
-    
+
     # Ensure output directory exists
     output_dir = os.path.dirname(output_file)
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
+
     # Run ffmpeg command
     try:
         cmd = [
             "ffmpeg",
-            "-i", input_file,
+            "-i",
+            input_file,
             "-vn",  # No video
-            "-ab", bitrate,
-            "-ar", "44100",  # Audio sampling frequency
+            "-ab",
+            bitrate,
+            "-ar",
+            "44100",  # Audio sampling frequency
             "-y",  # Overwrite output files
-            output_file
+            output_file,
         ]
-        
+
         subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        print(f"Successfully converted '{input_file}' to '{output_file}'")
+        logger.info("Successfully converted '%s' to '%s'", input_file, output_file)
         return output_file
-    
+
     except subprocess.CalledProcessError as e:
-        print(f"Error converting file: {e.stderr.decode() if e.stderr else str(e)}")
+        logger.error("Error converting file: %s", e.stderr.decode() if e.stderr else str(e))
         raise
+
+
+@cache
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+async def run_ffmpeg(audio: bytes, args: list[str], output_format: str, input_args: tuple[str, ...] = ()) -> bytes:
+    """Convert the audio with ffmpeg, reading it from stdin and the result from stdout."""
+    async with _ffmpeg_slots:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            *input_args,
+            "-i",
+            "pipe:0",
+            *args,
+            "-f",
+            output_format,
+            "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await process.communicate(audio)
+        except asyncio.CancelledError:
+            # Otherwise ffmpeg keeps running, and using a CPU, after its slot is given back
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode != 0:
+        raise FFmpegError(stderr.decode(errors="replace").strip())
+    return stdout
+
+
+async def prepare_for_transcription(audio: bytes, filename: str, content_type: str | None) -> tuple[str, bytes, str]:
+    """Trim silence and downmix to 16 kHz mono Opus. Returns a (file name, audio, content type) upload."""
+    output_format, output_filename, output_content_type = TRANSCRIPTION_FORMAT
+    converted = await _convert(audio, TRANSCRIPTION_ARGS, output_format, "transcription")
+    if converted is None:
+        return filename, audio, content_type or "application/octet-stream"
+    return output_filename, converted, output_content_type
+
+
+async def encode_for_delivery(audio: bytes) -> bytes:
+    """Transcode generated speech to low bitrate MP3 for the clients."""
+    converted = await _convert(audio, DELIVERY_ARGS, DELIVERY_FORMAT, "delivery")
+    return audio if converted is None else converted
+
+
+async def decode_to_pcm(audio: bytes, sample_rate: int) -> bytes | None:
+    """Decode to raw mono PCM16 at the given rate, or None without a working ffmpeg."""
+    if not ffmpeg_available():
+        return None
+    try:
+        with span("ffmpeg", "decode"):
+            return await run_ffmpeg(audio, ["-vn", "-ac", "1", "-ar", str(sample_rate)], PCM_FORMAT)
+    except (FFmpegError, OSError) as e:
+        logger.warning("ffmpeg decoding failed: %s", e)
+        return None
+
+
+async def encode_pcm_for_delivery(pcm: bytes, sample_rate: int) -> bytes | None:
+    """Encode raw mono PCM16 the same way as `encode_for_delivery`, or None without a working ffmpeg."""
+    if not ffmpeg_available():
+        return None
+    try:
+        with span("ffmpeg", "encode"):
+            input_args = ("-f", PCM_FORMAT, "-ar", str(sample_rate), "-ac", "1")
+            return await run_ffmpeg(pcm, DELIVERY_ARGS, DELIVERY_FORMAT, input_args)
+    except (FFmpegError, OSError) as e:
+        logger.warning("ffmpeg encoding failed: %s", e)
+        return None
+
+
+async def _convert(audio: bytes, args: list[str], output_format: str, name: str) -> bytes | None:
+    if not ffmpeg_available():
+        return None
+    try:
+        with span("ffmpeg", name):
+            converted = await run_ffmpeg(audio, args, output_format)
+    except (FFmpegError, OSError) as e:
+        logger.warning("ffmpeg %s conversion failed, using the original audio: %s", name, e)
+        return None
+    # Trimming silence may leave nothing when the recording was silent, the original is kept then
+    if not converted or len(converted) >= len(audio):
+        return None
+    return converted
@@ -0,0 +1,175 @@
+"""
+Bounded memory for conversations.
+
+`ConversationStore` is the dictionary behind `api.CONVO_DB`. Conversations that have been idle for longer
+than the configured TTL are spilled to a gzip compressed record on disk and dropped from memory, and are
+loaded back transparently the next time they are looked up. Cold parts of live conversations (plans
+of previous evenings, old story scenes) are spilled the same way, so that only their recent tail stays
+in memory. `ConversationStore.full` reads such a field back in full, cold items first.
+"""
+
+import gzip
+import json
+import sqlite3
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Generic, Iterator, TypeVar
+
+from pydantic import BaseModel, TypeAdapter
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class SpillStore:
+    """SQLite table of gzip compressed JSON records, one resident state and any number of cold items per key."""
+
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spilled (key TEXT NOT NULL, kind TEXT NOT NULL, created REAL NOT NULL,"
+            " size INTEGER NOT NULL, payload BLOB NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS spilled_key ON spilled (key, kind)")
+
+    def save(self, key: str, payload: str) -> None:
+        """Replace the resident state of `key`."""
+        with self._db:
+            self._db.execute("DELETE FROM spilled WHERE key = ? AND kind = 'state'", (key,))
+            self._insert(key, "state", payload)
+
+    def load(self, key: str) -> str | None:
+        row = self._db.execute("SELECT payload FROM spilled WHERE key = ? AND kind = 'state'", (key,)).fetchone()
+        return gzip.decompress(row[0]).decode() if row is not None else None
+
+    def discard(self, key: str) -> None:
+        """Forget the resident state of `key` once it is back in memory, its cold items are kept."""
+        with self._db:
+            self._db.execute("DELETE FROM spilled WHERE key = ? AND kind = 'state'", (key,))
+
+    def delete(self, key: str) -> None:
+        """Forget everything about `key`, its resident state and its cold items."""
+        with self._db:
+            self._db.execute("DELETE FROM spilled WHERE key = ?", (key,))
+
+    def append(self, key: str, kind: str, items: list[Any]) -> None:
+        """Keep cold items of `key`, e.g. old outputs, in the order they were spilled."""
+        with self._db:
+            self._insert(key, kind, json.dumps(items))
+
+    def items(self, key: str, kind: str) -> list[Any]:
+        """Cold items of `key`, oldest first."""
+        rows = self._db.execute(
+            "SELECT payload FROM spilled WHERE key = ? AND kind = ? ORDER BY rowid", (key, kind)
+        ).fetchall()
+        return [item for (payload,) in rows for item in json.loads(gzip.decompress(payload))]
+
+    def keys(self) -> set[str]:
+        """Keys with a resident state on disk."""
+        return {key for (key,) in self._db.execute("SELECT key FROM spilled WHERE kind = 'state'").fetchall()}
+
+    def sizes(self) -> dict[str, int]:
+        """Compressed bytes on disk per key."""
+        return dict(self._db.execute("SELECT key, SUM(size) FROM spilled GROUP BY key").fetchall())
+
+    def _insert(self, key: str, kind: str, payload: str) -> None:
+        compressed = gzip.compress(payload.encode())
+        self._db.execute(
+            "INSERT INTO spilled VALUES (?, ?, ?, ?, ?)", (key, kind, time.time(), len(compressed), compressed)
+        )
+
+
+class ConversationStore(MutableMapping[str, M], Generic[M]):
+    """
+    Conversations by ID, with idle ones kept on disk instead of in memory.
+
+    Every lookup counts as activity and loads a spilled conversation back. Fields in `transient`
+    (pending messages, running streams) are not spilled. Iterating and `len` only cover the
+    conversations currently in memory.
+    """
+
+    def __init__(self, model: type[M], spill: SpillStore, transient: set[str]):
+        self.model, self.spill, self.transient = model, spill, transient
+        self._resident: dict[str, M] = {}
+        self._last_active: dict[str, float] = {}
+
+    def __getitem__(self, convo_id: str) -> M:
+        conversation = self._resident.get(convo_id)
+        if conversation is None:
+            payload = self.spill.load(convo_id)
+            if payload is None:
+                raise KeyError(convo_id)
+            logger.info("Loading spilled conversation %s", convo_id)
+            conversation = self._resident[convo_id] = self.model.model_validate_json(payload)
+            self.spill.discard(convo_id)
+        self._last_active[convo_id] = time.monotonic()
+        return conversation
+
+    def __setitem__(self, convo_id: str, conversation: M) -> None:
+        # A new conversation, the cold items of a previous one with the same ID are not part of it
+        self._resident[convo_id] = conversation
+        self._last_active[convo_id] = time.monotonic()
+        self.spill.delete(convo_id)
+
+    def __delitem__(self, convo_id: str) -> None:
+        # Looked up first, so that a spilled conversation can be deleted as well
+        self[convo_id]
+        del self._resident[convo_id]
+        del self._last_active[convo_id]
+        self.spill.delete(convo_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._resident))
+
+    def __len__(self) -> int:
+        return len(self._resident)
+
+    def idle(self, ttl_seconds: float) -> list[str]:
+        now = time.monotonic()
+        return [convo_id for convo_id, active in self._last_active.items() if now - active > ttl_seconds]
+
+    def evict(self, convo_id: str) -> M:
+        """Write the conversation to disk and drop it from memory."""
+        conversation = self._resident.pop(convo_id)
+        del self._last_active[convo_id]
+        self.spill.save(convo_id, conversation.model_dump_json(exclude=self.transient))
+        return conversation
+
+    def spill_cold(self, convo_id: str, field: str, items: list[BaseModel | str]) -> None:
+        """Keep `items`, the oldest ones of a list field, on disk. They are no longer in the field itself."""
+        self.spill.append(
+            convo_id, field, [item.model_dump(mode="json") if isinstance(item, BaseModel) else item for item in items]
+        )
+
+    def full(self, convo_id: str, field: str) -> list[Any]:
+        """Every item of a list field, the spilled ones followed by those in memory."""
+        resident = getattr(self[convo_id], field)
+        cold = TypeAdapter(self.model.model_fields[field].annotation).validate_python(self.spill.items(convo_id, field))
+        return [*cold, *resident]
+
+    def footprint(self) -> dict[str, Any]:
+        """Approximate bytes used by every conversation, in memory and on disk."""
+        now = time.monotonic()
+        disk = self.spill.sizes()
+        spilled = self.spill.keys()
+        conversations = {
+            convo_id: {
+                "resident_bytes": len(conversation.model_dump_json()),
+                "idle_seconds": round(now - self._last_active[convo_id], 1),
+                "disk_bytes": disk.get(convo_id, 0),
+            }
+            for convo_id, conversation in self._resident.items()
+        }
+        return {
+            "resident_conversations": len(conversations),
+            "resident_bytes": sum(entry["resident_bytes"] for entry in conversations.values()),
+            "spilled_conversations": len(spilled - conversations.keys()),
+            "disk_bytes": sum(disk.values()),
+            "conversations": conversations,
+        }
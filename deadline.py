@@ -0,0 +1,89 @@
+"""
+Deadline budget of a conversation.
+
+Bedtime does not wait for the pipeline. `/start` turns the family's time budget into a deadline, which
+every stage receives in `ConvoInfo.deadline`. Stages ask `quality_for(deadline)` what they can still
+afford: fewer scenes, cheaper images, no video. Media stages run with `gather_until`, so whatever is
+finished when the deadline hits is delivered, and the main agent is cut off shortly after it.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Literal, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+# Stages are expected to finish by the deadline on their own, this is how much longer the main agent may run
+DEADLINE_GRACE_SECONDS = 30.0
+
+
+class StoryQuality(BaseModel):
+    max_scenes: int
+    image_quality: Literal["auto", "medium", "low"]
+    video: bool
+
+
+# Seconds that have to be left when a stage starts for it to run at the given quality, best first
+QUALITY_TIERS: list[tuple[float, StoryQuality]] = [
+    (600, StoryQuality(max_scenes=7, image_quality="auto", video=True)),
+    (240, StoryQuality(max_scenes=5, image_quality="medium", video=False)),
+    (90, StoryQuality(max_scenes=3, image_quality="low", video=False)),
+    (0, StoryQuality(max_scenes=2, image_quality="low", video=False)),
+]
+
+
+def deadline_in(seconds: float | None) -> float | None:
+    """The deadline, as a UNIX timestamp, for a budget of `seconds` starting now."""
+    return None if seconds is None else time.time() + seconds
+
+
+def seconds_left(deadline: float | None) -> float | None:
+    """None when there is no deadline."""
+    return None if deadline is None else max(0.0, deadline - time.time())
+
+
+def quality_for(deadline: float | None) -> StoryQuality:
+    left = seconds_left(deadline)
+    for minimum, quality in QUALITY_TIERS:
+        if left is None or left >= minimum:
+            return quality
+    return QUALITY_TIERS[-1][1]
+
+
+async def gather_until(deadline: float | None, *aws: Awaitable[T]) -> list[T | None]:
+    """
+    Run the awaitables concurrently until all of them are finished or the deadline passes.
+
+    The ones still running at the deadline are cancelled and their results are None. A failure is
+    raised as soon as it happens, and cancels the others.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    left = seconds_left(deadline)
+    loop = asyncio.get_running_loop()
+    end = None if left is None else loop.time() + left
+    try:
+        pending = set(tasks)
+        while pending:
+            timeout = None if end is None else max(0.0, end - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_EXCEPTION)
+            if not done:
+                break
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+    return [task.result() if task.done() and not task.cancelled() else None for task in tasks]
+
+
+def finished_prefix(results: list[T | None]) -> list[T]:
+    """Results up to the first unfinished one, scenes after a gap would not make sense."""
+    prefix = []
+    for result in results:
+        if result is None:
+            break
+        prefix.append(result)
+    return prefix
@@ -4,7 +4,7 @@ import { IconArrowRight } from "@tabler/icons-react";
 import { FinalOutput } from "../schemas";
 
 export interface MapScreenProps {
-  event: FinalOutput["text"]["event"];
+  event: NonNullable<FinalOutput["text"]["event"]>;
   onNext: () => void;
 }
 
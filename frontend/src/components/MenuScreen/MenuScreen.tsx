@@ -25,11 +25,13 @@ export function MenuScreen({
   return (
     <div className={styles.container}>
       <div className={styles.imageSlot}>
-        <img
-          src={ROOT + "/" + imageUrl}
-          alt="Placeholder"
-          className={styles.image}
-        />
+        {imageUrl !== null && (
+          <img
+            src={ROOT + "/" + imageUrl}
+            alt="Placeholder"
+            className={styles.image}
+          />
+        )}
         <button
           className={`${styles.iconButton} ${styles.left}`}
           onClick={onRegenerate}
@@ -15,12 +15,32 @@ import { SimpleScreen } from "./SimpleScreen/SimpleScreen";
 import { MapScreen } from "./MapScreen/MapScreen";
 import { PhotoScreen } from "./PhotoScreen/PhotoScreen";
 import { v4 as uuid } from "uuid";
-import { AudioPromptSchema, FinalOutput, FinalOutputSchema } from "./schemas";
+import Markdown from "react-markdown";
+import {
+  AudioPromptSchema,
+  CompleteSchema,
+  EventSchema,
+  FinalOutput,
+  FinalOutputSchema,
+  PartialOutputSchema,
+} from "./schemas";
 import { ROOT } from "./constants";
 import faked from "./exampleResponse.json";
 
 const queryClient = new QueryClient();
 
+// Shown for a section of a partial output that was not ready by the deadline
+const NOT_READY = "This part was not ready in time tonight.";
+
+// Scenes with their narration, picture and audio all delivered, those trimmed by the deadline are left out
+function storySteps(output: FinalOutput | null): number {
+  const text = output?.text;
+  const audio = text?.story_narration?.scenes.length ?? text?.story_audio?.length ?? 0;
+  // The first image is the cover shown in the menu, the scenes start at the second one
+  const images = Math.max((text?.story_images?.image_paths.length ?? 0) - 1, 0);
+  return Math.min(text?.storyboard?.narration.length ?? 0, images, audio);
+}
+
 export function ClientRoot() {
   return (
     <QueryClientProvider client={queryClient}>
@@ -66,12 +86,16 @@ export function InnerComponent() {
                 headers: {
                   "Content-Type": "application/json",
                 },
-                body: JSON.stringify({ conversation_id: convoIdToSend }),
+                body: JSON.stringify({
+                  conversation_id: convoIdToSend,
+                  profile_id: localStorage.getItem("profileId"),
+                }),
               });
 
               if (!response.ok) throw new Error("Convo failed");
               const data = await response.json();
               console.log(data);
+              localStorage.setItem("profileId", data.profile_id);
               setConvoId(data.conversation_id);
               console.log("Convo started successfully");
             } catch (error) {
@@ -121,15 +145,22 @@ export function InnerComponent() {
 
   if (state.state === "story") {
     const step = state.step;
-    const storyText = output?.text.storyboard.narration[step];
+    const storyText = output?.text.storyboard?.narration[step];
+    // With a stitched narration every scene plays a time range of the same file, so the
+    // browser downloads it once and seeks within it using range requests
+    const narration = output?.text.story_narration;
+    const narrationScene = narration?.scenes[step];
+    const audioUrl = narrationScene
+      ? `${ROOT}/${narration.track}#t=${narrationScene.start},${narrationScene.end}`
+      : ROOT + "/" + output!.text.story_audio?.[step];
     return (
       <StoryScreen
         videoUrl={output?.text.story_video?.at(step) ?? null}
-        imageUrl={ROOT + "/" + output!.text.story_images.image_paths[step + 1]!}
-        audioUrl={ROOT + "/" + output!.text.story_audio[step]!}
+        imageUrl={ROOT + "/" + output!.text.story_images?.image_paths[step + 1]}
+        audioUrl={audioUrl}
         story={storyText!}
         onNext={() => {
-          if (step + 1 < (output?.text.storyboard.narration.length ?? 0)) {
+          if (step + 1 < storySteps(output)) {
             setAppState({ state: "story", step: step + 1 });
           } else {
             setAppState({ state: "menu" });
@@ -140,18 +171,24 @@ export function InnerComponent() {
   }
 
   if (state.state === "activities") {
+    const event = output?.text.event;
+    if (!event) {
+      return (
+        <SimpleScreen
+          text={NOT_READY}
+          onNext={() => setAppState({ state: "menu" })}
+        />
+      );
+    }
     return (
-      <MapScreen
-        event={output!.text.event}
-        onNext={() => setAppState({ state: "menu" })}
-      />
+      <MapScreen event={event} onNext={() => setAppState({ state: "menu" })} />
     );
   }
 
   if (state.state === "lesson") {
     return (
       <SimpleScreen
-        text={output!.text.lesson}
+        text={output?.text.lesson || NOT_READY}
         onNext={() => setAppState({ state: "menu" })}
       />
     );
@@ -160,7 +197,7 @@ export function InnerComponent() {
   if (state.state === "artProject") {
     return (
       <SimpleScreen
-        text={output!.text.plan_for_evening}
+        text={output?.text.plan_for_evening || NOT_READY}
         onNext={() => setAppState({ state: "menu" })}
       />
     );
@@ -169,8 +206,12 @@ export function InnerComponent() {
   if (state.state === "menu") {
     return (
       <MenuScreen
-        imageUrl={output!.text.story_images.image_paths[0]}
-        onStory={() => setAppState({ state: "story", step: 0 })}
+        imageUrl={output?.text.story_images?.image_paths[0] ?? null}
+        onStory={() => {
+          if (storySteps(output) > 0) {
+            setAppState({ state: "story", step: 0 });
+          }
+        }}
         onActivities={() => setAppState({ state: "activities" })}
         onLesson={() => setAppState({ state: "lesson" })}
         onArtProject={() => setAppState({ state: "artProject" })}
@@ -263,7 +304,10 @@ export function PromptScreen(props: PromptScreenProps) {
   const { convoId, onOutput } = props;
 
   const [prompt, setPrompt] = useState<string | null>(null);
+  // Sections of the output that are already done, shown while the rest is generated
+  const [sections, setSections] = useState<Record<string, unknown>>({});
   const recorder = useRecorder({ convoId });
+  const event = EventSchema.safeParse(sections.event);
 
   useEffect(() => {
     if (!convoId) return;
@@ -279,6 +323,8 @@ export function PromptScreen(props: PromptScreenProps) {
         console.log(data);
         const parsedAudio = AudioPromptSchema.safeParse(data);
         const parsedOutput = FinalOutputSchema.safeParse(data);
+        const parsedPartial = PartialOutputSchema.safeParse(data);
+        const parsedComplete = CompleteSchema.safeParse(data);
 
         console.log(parsedAudio);
         console.log(parsedOutput);
@@ -286,16 +332,22 @@ export function PromptScreen(props: PromptScreenProps) {
         if (parsedAudio.success) {
           setPrompt(data.text);
           try {
-            const audio = data.audio_base64;
-            const audioUrl = "data:audio/webm;base64," + audio;
-            const audioElement = new Audio(audioUrl);
+            // Speech is streamed, so playback starts once the first sentence is synthesized
+            const audioElement = new Audio(ROOT + data.audio_url);
             audioElement.play();
             console.log("Audio played successfully");
           } catch (error) {
             console.error("Audio failed", error);
           }
+        } else if (parsedPartial.success) {
+          setSections((current) => ({
+            ...current,
+            ...parsedPartial.data.sections,
+          }));
         } else if (parsedOutput.success) {
           onOutput(parsedOutput.data);
+        } else if (parsedComplete.success) {
+          clearInterval(interval);
         }
       } catch (error) {
         console.error("Audio failed", error);
@@ -318,6 +370,34 @@ export function PromptScreen(props: PromptScreenProps) {
       ) : (
         <>
           <div className={styles.message}>{prompt}</div>
+          {typeof sections.story_hero_image === "string" && (
+            <img
+              className={styles.preview}
+              src={ROOT + "/" + sections.story_hero_image}
+              alt="Tonight's story"
+            />
+          )}
+          <div className={styles.sections}>
+            {typeof sections.story === "string" && (
+              <section className={styles.section}>
+                <h3>Tonight&apos;s story</h3>
+                <Markdown>{sections.story}</Markdown>
+              </section>
+            )}
+            {typeof sections.lesson === "string" && sections.lesson && (
+              <section className={styles.section}>
+                <h3>Lesson</h3>
+                <Markdown>{sections.lesson}</Markdown>
+              </section>
+            )}
+            {event.success && event.data.name && (
+              <section className={styles.section}>
+                <h3>{event.data.name}</h3>
+                <p>{event.data.description}</p>
+                <p>{event.data.address}</p>
+              </section>
+            )}
+          </div>
           <div className={styles.recordContainer}>
             {recorder.isRecording ? (
               <button
@@ -3,38 +3,66 @@ import { z } from "zod";
 export const AudioPromptSchema = z.object({
   type: z.literal("audio"),
   text: z.string(),
-  audio_base64: z.string(),
+  audio_url: z.string(),
   format: z.literal("mp3"),
 });
 
+export const EventSchema = z.object({
+  address: z.string().nullable(),
+  description: z.string().nullable(),
+  estimated_cost: z.string().nullable(),
+  justification: z.string().nullable(),
+  name: z.string().nullable(),
+  url: z.string().nullable(),
+  url_to_book_tickets: z.string().nullable(),
+});
+
 export const FinalOutputSchema = z.object({
   type: z.literal("output"),
   format: z.literal("text"),
+  // A partial output is sent when the deadline passed first, any of its sections may be missing
   text: z.object({
-    event: z.object({
-      address: z.string().nullable(),
-      description: z.string().nullable(),
-      estimated_cost: z.string().nullable(),
-      justification: z.string().nullable(),
-      name: z.string().nullable(),
-      url: z.string().nullable(),
-      url_to_book_tickets: z.string().nullable(),
-    }),
-    storyboard: z.object({
-      narration: z.string().array(),
-      images: z.string().array(),
-    }),
-    story: z.string(),
-    story_images: z.object({
-      image_paths: z.string().array(),
-    }),
-    story_audio: z.string().array(),
-    story_video: z.string().array().optional(),
-    lesson: z.string(),
-    reasoning: z.string(),
-    plan_for_evening: z.string(),
+    partial: z.boolean().optional(),
+    event: EventSchema.nullable().optional(),
+    storyboard: z
+      .object({
+        narration: z.string().array(),
+        images: z.string().array(),
+      })
+      .optional(),
+    story: z.string().optional(),
+    story_images: z
+      .object({
+        image_paths: z.string().array(),
+      })
+      .optional(),
+    story_audio: z.string().array().optional(),
+    story_narration: z
+      .object({
+        track: z.string(),
+        duration: z.number(),
+        scenes: z.object({ start: z.number(), end: z.number() }).array(),
+      })
+      .optional(),
+    story_video: z.string().nullable().array().optional(),
+    lesson: z.string().optional(),
+    reasoning: z.string().optional(),
+    plan_for_evening: z.string().optional(),
   }),
 });
 
+// Sections of the final output, sent as soon as each of them is ready
+export const PartialOutputSchema = z.object({
+  type: z.literal("partial"),
+  format: z.literal("json"),
+  sections: z.record(z.string(), z.unknown()),
+});
+
+// Sent after the final output, nothing follows it
+export const CompleteSchema = z.object({
+  type: z.literal("complete"),
+});
+
 export type AudioPrompt = z.infer<typeof AudioPromptSchema>;
 export type FinalOutput = z.infer<typeof FinalOutputSchema>;
+export type PartialOutput = z.infer<typeof PartialOutputSchema>;
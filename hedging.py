@@ -0,0 +1,99 @@
+"""
+Hedged requests for idempotent media calls with a long latency tail.
+
+When a call takes longer than the recent p95 latency of its endpoint, a duplicate is sent and the first
+one to finish wins, the other one is cancelled. Hedges are paid for from a global budget that grows with
+every call, so at most `HEDGE_RATIO` of the calls are ever duplicated.
+"""
+
+import asyncio
+import statistics
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+from logs import get_logger
+from metrics import HEDGES
+from settings import env_settings
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Latencies kept per endpoint, and how many are needed before it is hedged at all
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# Share of calls that may be hedged, and how many unused hedges can be saved up for a burst
+HEDGE_RATIO = 0.1
+MAX_SAVED_HEDGES = 10.0
+
+
+class HedgeBudget:
+    def __init__(self, ratio: float = HEDGE_RATIO, max_saved: float = MAX_SAVED_HEDGES):
+        self.ratio, self.max_saved = ratio, max_saved
+        self.tokens = 0.0
+
+    def earn(self) -> None:
+        self.tokens = min(self.max_saved, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LatencyTracker:
+    def __init__(self):
+        self.samples: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def hedge_delay(self) -> float | None:
+        """The p95 latency, or None while there are too few samples to tell."""
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        return statistics.quantiles(self.samples, n=20)[-1]
+
+
+hedge_budget = HedgeBudget()
+_TRACKERS: dict[str, LatencyTracker] = {}
+
+
+async def hedged(endpoint: str, call: Callable[[], Awaitable[T]]) -> T:
+    """Run `call`, duplicating it once if it is slower than the endpoint's p95. `call` must be idempotent."""
+    tracker = _TRACKERS.setdefault(endpoint, LatencyTracker())
+    delay = tracker.hedge_delay() if env_settings.hedge_media_calls else None
+    hedge_budget.earn()
+
+    start = time.perf_counter()
+    primary = asyncio.create_task(call())
+    tasks = {primary}
+    try:
+        if delay is not None:
+            await asyncio.wait(tasks, timeout=delay)
+            if not primary.done():
+                if hedge_budget.spend():
+                    HEDGES.inc(endpoint, "sent")
+                    tasks.add(asyncio.create_task(call()))
+                else:
+                    HEDGES.inc(endpoint, "over_budget")
+
+        while True:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None]
+            if succeeded or done == tasks:
+                winner = succeeded[0] if succeeded else primary
+                break
+            # One of the two failed, wait for the other one
+            tasks -= done
+
+        if len(tasks) > 1 or winner is not primary:
+            HEDGES.inc(endpoint, "won" if winner is not primary else "lost")
+        if winner.exception() is None:
+            tracker.record(time.perf_counter() - start)
+        return winner.result()
+    finally:
+        for task in tasks:
+            task.cancel()
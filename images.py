@@ -1,17 +1,24 @@
 import asyncio
 import base64
-import datetime
-import time
 import uuid
 from pathlib import Path
+from typing import Callable
 from retry import exponential_backoff
 
 from agents import function_tool
 from openai import AsyncOpenAI
 from pydantic import BaseModel
 
+from circuit import circuit_breaker
+from deadline import finished_prefix, gather_until
+from hedging import hedged
+from logs import get_logger
+from metrics import span
+from settings import openai_client
 from tools.storyboard_agent import StoryboardOutput, _get_storyboard
 
+logger = get_logger(__name__)
+
 
 class StoryImageOutput(BaseModel):
     image_paths: list[str]
@@ -19,8 +26,14 @@ class StoryImageOutput(BaseModel):
 
 @exponential_backoff()
 async def generate_image(client: AsyncOpenAI, prompt: str, output_path: Path) -> None:
-    print(f"Generating image from {output_path} with prompt: {prompt}")
-    result = await client.images.generate(model="gpt-image-1", prompt=prompt, n=1, size="1024x1024")
+    logger.info("Generating image %s", output_path)
+    logger.debug("Image prompt: %s", prompt)
+    with span("image", "generate"):
+        async with circuit_breaker("openai_images").guard():
+            result = await hedged(
+                "image_generate",
+                lambda: client.images.generate(model="gpt-image-1", prompt=prompt, n=1, size="1024x1024"),
+            )
     if not result.data:
         raise ValueError("No image data returned from OpenAI API")
 
@@ -32,10 +45,20 @@ async def generate_image(client: AsyncOpenAI, prompt: str, output_path: Path) ->
 
 
 @exponential_backoff()
-async def generate_image_from_img(client: AsyncOpenAI, prompt: str, image_path: Path, output_path: Path) -> None:
+async def generate_image_from_img(
+    client: AsyncOpenAI, prompt: str, image_path: Path, output_path: Path, quality: str = "auto"
+) -> Path:
     assert image_path.exists(), f"Image {image_path} does not exist."
-    print(f"Generating image from {output_path} with prompt: {prompt}")
-    result = await client.images.edit(model="gpt-image-1", image=[open(image_path, "rb")], prompt=prompt)
+    logger.info("Generating image %s", output_path)
+    logger.debug("Image prompt: %s", prompt)
+    with span("image", "edit"):
+        # Read once, so that a hedged duplicate of the request can send the same image
+        image = (image_path.name, image_path.read_bytes(), "image/png")
+        async with circuit_breaker("openai_images").guard():
+            result = await hedged(
+                "image_edit",
+                lambda: client.images.edit(model="gpt-image-1", image=[image], prompt=prompt, quality=quality),
+            )
     if not result.data:
         raise ValueError("No image data returned from OpenAI API")
 
@@ -44,6 +67,7 @@ async def generate_image_from_img(client: AsyncOpenAI, prompt: str, image_path:
     image_bytes = base64.b64decode(image_base64)
 
     output_path.write_bytes(image_bytes)
+    return output_path
 
 
 @function_tool
@@ -55,41 +79,58 @@ async def generate_image_from_storyboard(
 
 async def _generate_image_from_storyboard(
     story_board: StoryboardOutput,
+    quality: str = "auto",
+    deadline: float | None = None,
+    on_hero_image: Callable[[str], None] | None = None,
 ) -> StoryImageOutput:
-    """Generate images from the storyboard output."""
-    client = AsyncOpenAI()
-    output_dir = Path("static/sample_images") / datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    print(f"Generating images in {output_dir}")
-    start_time = time.time()
+    """
+    Generate images from the storyboard output.
 
-    hero_image_path = output_dir / "img_0.png"
-    await generate_image_from_img(
-        client,
-        image_path=Path("static/non_existing_child.jpg"),
-        prompt=story_board.main_character_description,
-        output_path=hero_image_path,
-    )
+    With a deadline, only the hero image and the scenes finished before it, in order, are returned.
+    `on_hero_image` is called as soon as the first image is ready, while the scenes are still drawn.
+    """
+    client = openai_client
+    output_dir = Path("static/sample_images") / uuid.uuid4().hex
+    output_dir.mkdir(parents=True, exist_ok=True)
 
-    async with asyncio.TaskGroup() as tg:
-        [
-            tg.create_task(
+    logger.info("Generating images in %s", output_dir)
+
+    with span("images", "storyboard"):
+        [hero_image_path] = await gather_until(
+            deadline,
+            generate_image_from_img(
+                client,
+                image_path=Path("static/non_existing_child.jpg"),
+                prompt=story_board.main_character_description,
+                output_path=output_dir / "img_0.png",
+                quality=quality,
+            ),
+        )
+        if hero_image_path is None:
+            logger.warning("No images were ready by the deadline")
+            return StoryImageOutput(image_paths=[])
+        if on_hero_image is not None:
+            on_hero_image(str(hero_image_path))
+
+        scene_paths = await gather_until(
+            deadline,
+            *(
                 generate_image_from_img(
                     client,
                     prompt=scene,
                     image_path=hero_image_path,
                     output_path=output_dir / f"img_{i}.png",
+                    quality=quality,
                 )
-            )
-            for i, scene in enumerate(story_board.images, start=1)
-        ]
+                for i, scene in enumerate(story_board.images, start=1)
+            ),
+        )
 
-    print(f"Generated images {len(story_board.images) + 1} in {output_dir}, took: ")
-    print(f"Time taken: {(time.time() - start_time) / 60} minutes")
+    image_paths = [hero_image_path, *finished_prefix(scene_paths)]
+    logger.info("Generated %d of %d images in %s", len(image_paths), len(story_board.images) + 1, output_dir)
 
     return StoryImageOutput(
-        image_paths=[str(output_dir / f"img_{i}.png") for i in range(len(story_board.images) + 1)],
+        image_paths=[str(path) for path in image_paths],
     )
 
 
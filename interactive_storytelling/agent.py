@@ -24,10 +24,12 @@ from interactive_storytelling.models import (
     InteractiveTurnOutput,
     StorytellerContext,
 )
+from routing import routed
 
 # --- Agent Definition ---
 interactive_story_agent = Agent(
     name="interactive_story_agent",
+    model=routed("interactive_story"),
     instructions="""
         You are an interactive storyteller for children.
         Given the story so far and the user's chosen path (or an initial story context),
@@ -0,0 +1,130 @@
+"""
+Logging for the server, kept off the event loop.
+
+Records are put on an in-memory queue and written to stderr by a `QueueListener` thread, so a slow
+terminal or log collector never blocks a request. Every record carries the conversation it belongs to,
+large payloads (stories, storyboards, final outputs) are truncated, and repetitive lines are sampled.
+
+Use it like the standard library:
+
+```python
+from logs import get_logger
+
+logger = get_logger(__name__)
+logger.info("Generated %d images in %s", count, output_dir)
+```
+"""
+
+import atexit
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import convo_id_var
+from settings import env_settings
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(convo_id)s] %(message)s"
+MAX_MESSAGE_CHARS = 2000
+# Every distinct message template may be logged this many times per window, the rest are dropped
+SAMPLE_LIMIT = 5
+SAMPLE_WINDOW_SECONDS = 10.0
+# Records are dropped instead of blocking the event loop when the writer thread falls this far behind
+MAX_QUEUED_RECORDS = 10_000
+
+_listener: QueueListener | None = None
+
+
+class ConvoContextFilter(logging.Filter):
+    """Adds the conversation the current task works for, see `metrics.convo_id_var`."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.convo_id = convo_id_var.get() or "-"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `limit` records per message template and window. Warnings and errors always pass.
+
+    The first record of a new window reports how many similar records were dropped in the previous one.
+    """
+
+    def __init__(self, limit: int = SAMPLE_LIMIT, window: float = SAMPLE_WINDOW_SECONDS):
+        super().__init__()
+        self.limit, self.window = limit, window
+        # (logger name, message template) -> [window start, records seen in the window, records dropped]
+        self._windows: dict[tuple[str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.name, str(record.msg))
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.window:
+            dropped = window[2] if window is not None else 0
+            window = self._windows[key] = [now, 0, 0]
+            if dropped:
+                record.msg = f"{record.msg} (and {dropped} similar messages dropped)"
+        window[1] += 1
+        if window[1] > self.limit:
+            window[2] += 1
+            return False
+        return True
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """Formats the message on the caller's side, truncated, so the listener thread only writes strings."""
+
+    def __init__(self, log_queue: queue.Queue, max_chars: int = MAX_MESSAGE_CHARS):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            message = f"{message[: self.max_chars]}... [{len(message) - self.max_chars} more chars]"
+        record.msg, record.args = message, None
+        record.exc_info, record.exc_text, record.stack_info = None, self._format_exception(record), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def _format_exception(self, record: logging.LogRecord) -> str | None:
+        if record.exc_info:
+            return logging.Formatter().formatException(record.exc_info)
+        return None
+
+
+def configure_logging() -> None:
+    """Install the queue handler on the root logger and start the writer thread. Safe to call repeatedly."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(MAX_QUEUED_RECORDS)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = QueueListener(log_queue, stream_handler)
+
+    queue_handler = TruncatingQueueHandler(log_queue)
+    queue_handler.addFilter(ConvoContextFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(env_settings.log_level.upper())
+    # Every request to the model APIs is logged by httpx at INFO level
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    configure_logging()
+    return logging.getLogger(name)
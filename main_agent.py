@@ -1,22 +1,32 @@
 import asyncio
 import json
+from typing import Awaitable, TypeVar
 
-from agents import Agent, Runner, WebSearchTool
+from agents import Agent, RunContextWrapper, Runner, WebSearchTool, trace
 from pydantic import BaseModel
 
 from images import generate_image_from_storyboard
-from tools.event_tool import EventModel, find_events_for_child
-from tools.generate_lesson_tool import lesson_generator_agent
-from tools.onboarding_agent import onboard_user, Knowledge
+from tools.event_tool import EventModel, _find_events_for_child, find_events_for_child
+from tools.generate_lesson_tool import _generate_lesson, generate_lesson_tool
+from tools.onboarding_agent import onboard, onboard_user, Knowledge
 from tools.storyboard_agent import get_storyboard
-from tools.storytime_agent import get_story, StoryContinuationOutput
+from tools.storytime_agent import _get_story, get_story, StoryContinuationOutput
+from deadline import DEADLINE_GRACE_SECONDS, seconds_left
+from logs import get_logger
+from metrics import convo_id_var, span
 from models import FinalOutput, ConvoInfo
 from settings import env_settings
 from api import wait_for_user_message
+from routing import routed
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
 
 
 parent_assistant_agent = Agent[ConvoInfo](
     name="main_agent",
+    model=routed("main_agent"),
     instructions="""
     You are a helpful assistant that helps parents organize their children's evening activities.
     You can suggest activities, games, and educational content based on the child's age and interests.
@@ -45,57 +55,175 @@ parent_assistant_agent = Agent[ConvoInfo](
     tools=[
         onboard_user,
         find_events_for_child,
-        lesson_generator_agent.as_tool(
-            tool_name="generate_lesson_tool",
-            tool_description="Generate a lesson plan based on the user's input",
-        ),
+        generate_lesson_tool,
         WebSearchTool(),
         get_story,
     ],
 )
 
 
-async def main_agent(convo_id: str) -> None:
+class PlanSummary(BaseModel):
+    reasoning: str
+    plan_for_evening: str
+
+
+plan_writer_agent = Agent(
+    name="plan_writer_agent",
+    model=routed("main_agent"),
+    instructions="""
+    You are a helpful assistant that helps parents organize their children's evening activities.
+    You get what is known about the family, tonight's story, a lesson plan and an event for tomorrow.
+    Write a personalized plan for the evening that ties them together, with age-appropriate activities,
+    games, educational content and resources the parent can use to learn more about the child's interests.
+    Also explain the reasoning behind your suggestions.
+    """,
+    output_type=PlanSummary,
+)
+
+
+async def run_plan(context: ConvoInfo, knowledge: Knowledge | None) -> FinalOutput:
+    """
+    Build the plan under code control instead of one tool call per model turn.
+
+    Onboarding comes first, as everything depends on it. Story, lesson and event search are independent
+    and run concurrently, and a single model call writes the plan from their results.
+    """
     from api import CONVO_DB
 
-    final_plan = await Runner.run(
-        parent_assistant_agent,
-        "",
-        context=ConvoInfo(convo_id=convo_id, existing_convo=convo_id in CONVO_DB),
+    if knowledge is None:
+        knowledge = await onboard(context.convo_id)
+
+    with span("plan", "branches"):
+        story, lesson, event = await asyncio.gather(
+            _get_story(RunContextWrapper(context), knowledge, knowledge.theme or "A bedtime adventure"),
+            _published(context.convo_id, "lesson", _generate_lesson(_lesson_request(knowledge), knowledge)),
+            _published(context.convo_id, "event", _find_events_for_child(knowledge)),
+            return_exceptions=True,
+        )
+    if isinstance(story, BaseException):
+        raise story
+    if isinstance(lesson, BaseException):
+        logger.warning("Lesson generation failed: %s", lesson)
+        lesson = ""
+    if isinstance(event, BaseException):
+        logger.warning("Event search failed: %s", event)
+        event = None
+
+    summary = await Runner.run(
+        plan_writer_agent,
+        json.dumps(
+            {
+                "knowledge": knowledge.model_dump(),
+                "story": story.story,
+                "lesson": lesson,
+                "event": event.model_dump() if event is not None else None,
+            }
+        ),
+        context=context,
     )
-    print("Final plan:")
-    print("STORY")
-    print(final_plan.final_output.story)
-    print("STORY IMAGE PATHS")
-    print(final_plan.final_output.story_image_paths)
-    print("LESSON")
-    print(final_plan.final_output.lesson)
-    print("REASONING")
-    print(final_plan.final_output.reasoning)
-    print("PLAN FOR EVENING")
-    print(final_plan.final_output.plan_for_evening)
-    print("EVENT")
-    print(final_plan.final_output.event)
-    print("KNOWLEDGE")
-    print(final_plan.final_output.knowledge)
-    print("END OF PLAN")
+    return FinalOutput(
+        story=story.story,
+        story_image_paths=CONVO_DB[context.convo_id].final_output.get("story_images", {}).get("image_paths", []),
+        lesson=lesson,
+        reasoning=summary.final_output.reasoning,
+        plan_for_evening=summary.final_output.plan_for_evening,
+        knowledge=knowledge,
+        event=event,
+    )
+
+
+async def _published(convo_id: str, section: str, branch: Awaitable[T]) -> T:
+    """Add the result of the branch to the output as soon as it is ready."""
+    from api import add_to_output
+
+    result = await branch
+    add_to_output(convo_id, section, result.model_dump() if isinstance(result, BaseModel) else result)
+    return result
+
 
+def _lesson_request(knowledge: Knowledge) -> str:
+    child = knowledge.child
+    request = f"The lesson is about: {knowledge.theme}."
+    if child is not None:
+        request = f"Child is {child.age} years old and likes {', '.join(child.likes or [])}. {request}"
+    return request
+
+
+async def main_agent(convo_id: str) -> None:
+    from api import CONVO_DB, add_to_output
+    from profiles import profile_store
+
+    convo_id_var.set(convo_id)
+    agent, agent_input = parent_assistant_agent, ""
+    knowledge = CONVO_DB[convo_id].knowledge
+    onboarded_knowledge = None
+    profile = profile_store.get(CONVO_DB[convo_id].profile_id, convo_id)
+    if knowledge is not None and knowledge.is_complete() and profile is not None and not profile.stale_fields():
+        # Returning family with a fresh profile, go straight to generation
+        logger.info("Skipping onboarding for a returning family")
+        onboarded_knowledge = knowledge
+        agent = parent_assistant_agent.clone(
+            tools=[tool for tool in parent_assistant_agent.tools if tool is not onboard_user],
+        )
+        agent_input = (
+            "The family is already onboarded, do not ask them anything. Their knowledge is: "
+            + knowledge.model_dump_json()
+        )
+        add_to_output(convo_id, "knowledge", knowledge.model_dump_json())
+
+    deadline = CONVO_DB[convo_id].deadline
+    context = ConvoInfo(convo_id=convo_id, existing_convo=convo_id in CONVO_DB, deadline=deadline)
+    left = seconds_left(deadline)
+    try:
+        async with asyncio.timeout(None if left is None else left + DEADLINE_GRACE_SECONDS) as scope:
+            if env_settings.plan_execution == "parallel":
+                with trace("main_agent"):
+                    final_plan = await run_plan(context, onboarded_knowledge)
+            else:
+                final_plan = (await Runner.run(agent, agent_input, context=context)).final_output
+    except TimeoutError:
+        if not scope.expired():
+            raise
+        # Bedtime, deliver whatever the stages finished so far
+        from api import post_message, CompleteMessageToUser, OutputMessageToUser
+
+        logger.warning("Deadline passed, delivering a partial plan")
+        post_message(convo_id, OutputMessageToUser(final_output={**CONVO_DB[convo_id].final_output, "partial": True}))
+        post_message(convo_id, CompleteMessageToUser())
+        return
     if env_settings.run_in_cli:
+        # The plan is the answer shown to the user in the terminal
+        print("Final plan:")
+        print("STORY")
+        print(final_plan.story)
+        print("STORY IMAGE PATHS")
+        print(final_plan.story_image_paths)
+        print("LESSON")
+        print(final_plan.lesson)
+        print("REASONING")
+        print(final_plan.reasoning)
+        print("PLAN FOR EVENING")
+        print(final_plan.plan_for_evening)
+        print("EVENT")
+        print(final_plan.event)
+        print("KNOWLEDGE")
+        print(final_plan.knowledge)
+        print("END OF PLAN")
         return
 
     from api import post_message, CONVO_DB
-    from api import OutputMessageToUser
+    from api import CompleteMessageToUser, OutputMessageToUser, append_output
 
     final_output = {
         **CONVO_DB[convo_id].final_output,
-        **final_plan.final_output.model_dump(),
+        **final_plan.model_dump(),
     }
-    print("Final output:", final_output)
+    logger.debug("Final output: %s", final_output)
     post_message(convo_id, OutputMessageToUser(final_output=final_output))
-    CONVO_DB[convo_id].outputs.append(final_plan.final_output)
+    post_message(convo_id, CompleteMessageToUser())
+    append_output(convo_id, final_plan)
 
-    print("Final output appended to CONVO_DB for convo_id:", convo_id)
-    print("Main agent finished")
+    logger.info("Main agent finished")
 
 
 if __name__ == "__main__":
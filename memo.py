@@ -0,0 +1,142 @@
+"""
+Opt-in memoization of agent runs.
+
+Agents whose output is a pure function of their input can be registered with `memoize_agent`.
+`run_memoized` is then a drop-in replacement for `Runner.run` that serves repeated runs from a
+size-bounded on-disk cache. Runs of agents that were not registered are passed straight to `Runner.run`.
+"""
+
+import dataclasses
+import datetime
+import hashlib
+import json
+import sqlite3
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+from agents import Agent, RunResult, Runner, TResponseInputItem
+from pydantic import TypeAdapter
+
+from metrics import record_cache
+from settings import env_settings
+
+
+class MemoizedRunResult:
+    """The subset of `RunResult` used by callers, rebuilt from the cache."""
+
+    def __init__(self, final_output: Any):
+        self.final_output = final_output
+
+    def final_output_as(self, cls: type, raise_if_incorrect_type: bool = False) -> Any:
+        if raise_if_incorrect_type and not isinstance(self.final_output, cls):
+            raise TypeError(f"Final output is not of type {cls.__name__}")
+        return self.final_output
+
+
+class DiskMemoBackend:
+    """SQLite backed cache, evicting the least recently used entries above `max_bytes`."""
+
+    def __init__(self, path: Path, max_bytes: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, agent TEXT NOT NULL, expires_at REAL NOT NULL,"
+            " last_used REAL NOT NULL, size INTEGER NOT NULL, payload TEXT NOT NULL)"
+        )
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        row = self._db.execute("SELECT payload, expires_at FROM memo WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self._db:
+            if row[1] <= now:
+                self._db.execute("DELETE FROM memo WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE memo SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, agent_name: str, payload: str, ttl: datetime.timedelta) -> None:
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?, ?)",
+                (key, agent_name, now + ttl.total_seconds(), now, len(payload), payload),
+            )
+            self._db.execute("DELETE FROM memo WHERE expires_at <= ?", (now,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM memo").fetchone()[0]
+            for old_key, size in self._db.execute("SELECT key, size FROM memo ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM memo WHERE key = ?", (old_key,))
+                total -= size
+
+
+# id(agent) -> (agent, time to live). Agents are keyed by identity, since names are not unique.
+_MEMOIZED_AGENTS: dict[int, tuple[Agent, datetime.timedelta]] = {}
+_STATS: dict[str, dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+memo_backend = DiskMemoBackend(Path(env_settings.memo_cache_path), env_settings.memo_cache_max_bytes)
+
+
+def memoize_agent(agent: Agent, ttl: datetime.timedelta) -> Agent:
+    """Opt the agent in to memoization, returns the agent so it can wrap the definition."""
+    _MEMOIZED_AGENTS[id(agent)] = (agent, ttl)
+    return agent
+
+
+async def run_memoized(
+    agent: Agent, input: str | list[TResponseInputItem], **kwargs: Any
+) -> MemoizedRunResult | RunResult:
+    """Same as `Runner.run`, but served from the cache for agents registered with `memoize_agent`."""
+    registered = _MEMOIZED_AGENTS.get(id(agent))
+    if registered is None:
+        return await Runner.run(agent, input, **kwargs)
+
+    key = memo_key(agent, input)
+    output_adapter = TypeAdapter(agent.output_type or str)
+    payload = memo_backend.get(key)
+    if payload is not None:
+        _STATS[agent.name]["hits"] += 1
+        record_cache("memo", hit=True)
+        return MemoizedRunResult(output_adapter.validate_json(payload))
+
+    _STATS[agent.name]["misses"] += 1
+    record_cache("memo", hit=False)
+    result = await Runner.run(agent, input, **kwargs)
+    memo_backend.set(key, agent.name, output_adapter.dump_json(result.final_output).decode(), registered[1])
+    return result
+
+
+def memo_key(agent: Agent, input: str | list[TResponseInputItem]) -> str:
+    instructions = agent.instructions.__qualname__ if callable(agent.instructions) else agent.instructions
+    key_data = {
+        "agent": agent.name,
+        "instructions": hashlib.sha256((instructions or "").encode()).hexdigest(),
+        "model": str(agent.model),
+        "model_settings": dataclasses.asdict(agent.model_settings),
+        "output_type": repr(agent.output_type),
+        "input": _normalize_input(input),
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def memo_stats() -> dict[str, dict[str, float]]:
+    """Hits, misses and hit ratio for every memoized agent."""
+    return {
+        name: {**stats, "hit_ratio": stats["hits"] / max(stats["hits"] + stats["misses"], 1)}
+        for name, stats in _STATS.items()
+    }
+
+
+def _normalize_input(input: Any) -> Any:
+    if isinstance(input, str):
+        return " ".join(input.split())
+    if isinstance(input, dict):
+        return {key: _normalize_input(value) for key, value in input.items()}
+    if isinstance(input, list):
+        return [_normalize_input(item) for item in input]
+    return input
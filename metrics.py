@@ -0,0 +1,237 @@
+"""
+Per-stage timing spans and counters, served in the Prometheus text format at `/metrics`.
+
+Agent runs, tool calls, guardrails and model responses are timed by a tracing processor hooked into
+the agents SDK. Other stages (TTS, transcription, images, video) are timed with the `span` context manager.
+Recording a span is a couple of dictionary updates, so it is cheap enough for the hot path.
+"""
+
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from typing import Any
+
+from agents import add_trace_processor
+from agents.tracing import Span, Trace, TracingProcessor
+
+# settings may replace the default trace processors, so it has to be set up before ours is added
+import settings  # noqa: F401
+
+# Conversation the current task works for, set at the entry points and inherited by child tasks
+convo_id_var: ContextVar[str | None] = ContextVar("convo_id", default=None)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320)
+MAX_TRACKED_CONVERSATIONS = 1000
+
+LabelValues = tuple[str, ...]
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] += amount
+
+    def render(self, kind: str = "counter") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {kind}"]
+        lines += [f"{self.name}{_labels(self.labels, values)} {value}" for values, value in self.values.items()]
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *label_values: str, value: float) -> None:
+        self.values[label_values] = value
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] -= amount
+
+    def render(self, kind: str = "gauge") -> list[str]:
+        return super().render(kind)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [count per bucket..., count above the last bucket], sum
+        self.counts: dict[LabelValues, list[int]] = {}
+        self.sums: dict[LabelValues, float] = defaultdict(float)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self.counts.get(label_values)
+        if counts is None:
+            counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, counts in self.counts.items():
+            cumulative = 0
+            for bucket, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels((*self.labels, 'le'), (*values, str(bucket)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {self.sums[values]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Duration of pipeline stages", ("stage", "name"))
+STAGE_IN_FLIGHT = Gauge("stage_in_flight", "Pipeline stages currently running", ("stage",))
+STAGE_ERRORS = Counter("stage_errors_total", "Pipeline stages that failed", ("stage", "name"))
+RETRIES = Counter("retries_total", "Retried calls", ("operation",))
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ("cache", "result"))
+SCHEDULER_WAIT = Histogram(
+    "scheduler_wait_seconds", "Time model calls waited for a provider slot", ("provider", "priority")
+)
+ROUTING_DECISIONS = Counter("routing_decisions_total", "Model routing decisions", ("route", "model", "outcome"))
+HEDGES = Counter("hedged_requests_total", "Duplicate requests sent for slow calls", ("endpoint", "outcome"))
+CIRCUIT_STATE = Gauge("circuit_state", "Provider circuits, 0 closed, 1 half-open, 2 open", ("provider",))
+CIRCUIT_REJECTIONS = Counter("circuit_rejections_total", "Calls failed fast by an open circuit", ("provider",))
+PROMPT_TOKENS = Counter(
+    "prompt_tokens_total",
+    "Input tokens sent to models, all of them and the ones read from the prompt cache",
+    ("agent", "kind"),
+)
+ALL_METRICS = [
+    STAGE_SECONDS,
+    STAGE_IN_FLIGHT,
+    STAGE_ERRORS,
+    RETRIES,
+    CACHE_REQUESTS,
+    SCHEDULER_WAIT,
+    ROUTING_DECISIONS,
+    HEDGES,
+    CIRCUIT_STATE,
+    CIRCUIT_REJECTIONS,
+    PROMPT_TOKENS,
+]
+
+# convo_id -> stage -> total seconds spent, for the most recent conversations only
+CONVO_STAGE_SECONDS: OrderedDict[str, dict[str, float]] = OrderedDict()
+
+
+class span:
+    """Times a stage of the pipeline, e.g. `with span("image", "edit"): ...`. Works around awaits as well."""
+
+    def __init__(self, stage: str, name: str = ""):
+        self.stage, self.name = stage, name
+
+    def __enter__(self) -> "span":
+        self.start = time.perf_counter()
+        STAGE_IN_FLIGHT.inc(self.stage)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        record_span(self.stage, self.name, time.perf_counter() - self.start, failed=exc_type is not None)
+
+
+def record_span(stage: str, name: str, seconds: float, failed: bool = False) -> None:
+    STAGE_IN_FLIGHT.dec(stage)
+    STAGE_SECONDS.observe(seconds, stage, name)
+    if failed:
+        STAGE_ERRORS.inc(stage, name)
+
+    convo_id = convo_id_var.get()
+    if convo_id is not None:
+        stages = CONVO_STAGE_SECONDS.setdefault(convo_id, defaultdict(float))
+        stages[stage] += seconds
+        CONVO_STAGE_SECONDS.move_to_end(convo_id)
+        if len(CONVO_STAGE_SECONDS) > MAX_TRACKED_CONVERSATIONS:
+            CONVO_STAGE_SECONDS.popitem(last=False)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def record_prompt_tokens(agent: str, input_tokens: int, cached_tokens: int) -> None:
+    PROMPT_TOKENS.inc(agent, "input", amount=input_tokens)
+    PROMPT_TOKENS.inc(agent, "cached", amount=cached_tokens)
+
+
+def prompt_cache_stats() -> dict[str, dict[str, float]]:
+    agents = {agent for agent, _ in PROMPT_TOKENS.values}
+    stats = {}
+    for agent in sorted(agents):
+        input_tokens, cached_tokens = PROMPT_TOKENS.values[(agent, "input")], PROMPT_TOKENS.values[(agent, "cached")]
+        stats[agent] = {
+            "input_tokens": input_tokens,
+            "cached_tokens": cached_tokens,
+            "hit_ratio": cached_tokens / input_tokens if input_tokens else 0.0,
+        }
+    return stats
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in ALL_METRICS for line in metric.render()) + "\n"
+
+
+class MetricsTracingProcessor(TracingProcessor):
+    """Turns agents SDK spans into stage timings, and counts prompt cache hits of every agent."""
+
+    STAGES = {"agent": "agent", "function": "tool", "guardrail": "guardrail", "response": "model"}
+
+    def __init__(self):
+        self._started: dict[str, float] = {}
+        # Running agent spans, model responses are attributed to the agent they were made for
+        self._agents: dict[str, str] = {}
+
+    def on_span_start(self, span: Span[Any]) -> None:
+        if span.span_data.type == "agent":
+            self._agents[span.span_id] = span.span_data.name
+        stage = self.STAGES.get(span.span_data.type)
+        if stage is not None:
+            self._started[span.span_id] = time.perf_counter()
+            STAGE_IN_FLIGHT.inc(stage)
+
+    def on_span_end(self, span: Span[Any]) -> None:
+        if span.span_data.type == "agent":
+            self._agents.pop(span.span_id, None)
+        elif span.span_data.type == "response":
+            self._record_usage(span)
+        start = self._started.pop(span.span_id, None)
+        if start is None:
+            return
+        stage = self.STAGES[span.span_data.type]
+        record_span(stage, _span_name(span), time.perf_counter() - start, failed=span.error is not None)
+
+    def _record_usage(self, span: Span[Any]) -> None:
+        usage = getattr(span.span_data.response, "usage", None)
+        if usage is None:
+            return
+        details = getattr(usage, "input_tokens_details", None)
+        record_prompt_tokens(
+            self._agents.get(span.parent_id, "unknown"), usage.input_tokens, getattr(details, "cached_tokens", 0) or 0
+        )
+
+    def on_trace_start(self, trace: Trace) -> None:
+        pass
+
+    def on_trace_end(self, trace: Trace) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self) -> None:
+        pass
+
+
+def _span_name(span: Span[Any]) -> str:
+    data = span.span_data
+    if data.type == "response":
+        return getattr(data.response, "model", None) or ""
+    return getattr(data, "name", "") or ""
+
+
+def _labels(names: tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+add_trace_processor(MetricsTracingProcessor())
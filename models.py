@@ -6,12 +6,41 @@ class Address(BaseModel):
     country: str | None
     city: str | None
 
+    def missing_fields(self) -> list[str]:
+        return [field for field in ("country", "city") if not getattr(self, field)]
+
 
 class PersonEntry(BaseModel):
     name: str | None
     age: int | None
-    likes: list[str]
-    dislikes: list[str]
+    # None until the family is asked, an empty list when they have nothing to name
+    likes: list[str] | None
+    dislikes: list[str] | None
+
+    def missing_fields(self) -> list[str]:
+        missing = [field for field in ("name", "age") if not getattr(self, field)]
+        return missing + [field for field in ("likes", "dislikes") if getattr(self, field) is None]
+
+
+class KnowledgePatch(BaseModel):
+    """
+    Compact update to a `Knowledge` object.
+
+    Every field left as None means "no change". List fields contain only the new items to add, an empty
+    list records that the family has nothing to name, e.g. no dislikes.
+    """
+
+    country: str | None = None
+    city: str | None = None
+    parent_name: str | None = None
+    parent_age: int | None = None
+    parent_likes: list[str] | None = None
+    parent_dislikes: list[str] | None = None
+    child_name: str | None = None
+    child_age: int | None = None
+    child_likes: list[str] | None = None
+    child_dislikes: list[str] | None = None
+    theme: str | None = None
 
 
 class Knowledge(BaseModel):
@@ -20,6 +49,59 @@ class Knowledge(BaseModel):
     child: PersonEntry | None = None
     theme: str | None = None
 
+    def missing_fields(self) -> list[str]:
+        """Dotted names of every field that still has to be filled, e.g. `address.city` or `child.likes`."""
+        missing = []
+        for name, model in (("address", Address), ("parent", PersonEntry), ("child", PersonEntry)):
+            entry = getattr(self, name)
+            fields = entry.missing_fields() if entry is not None else list(model.model_fields)
+            missing.extend(f"{name}.{field}" for field in fields)
+        if not self.theme:
+            missing.append("theme")
+        return missing
+
+    def is_complete(self) -> bool:
+        return not self.missing_fields()
+
+    def apply_patch(self, patch: KnowledgePatch) -> "Knowledge":
+        """Return a copy of this knowledge with the patch merged in."""
+        address = self.address or Address(country=None, city=None)
+        address = address.model_copy(
+            update={
+                "country": patch.country or address.country,
+                "city": patch.city or address.city,
+            }
+        )
+        people = {}
+        for name in ("parent", "child"):
+            person = getattr(self, name) or PersonEntry(name=None, age=None, likes=None, dislikes=None)
+            people[name] = person.model_copy(
+                update={
+                    "name": getattr(patch, f"{name}_name") or person.name,
+                    "age": getattr(patch, f"{name}_age") or person.age,
+                    "likes": _merge_items(person.likes, getattr(patch, f"{name}_likes")),
+                    "dislikes": _merge_items(person.dislikes, getattr(patch, f"{name}_dislikes")),
+                }
+            )
+        return Knowledge(
+            address=address,
+            parent=people["parent"],
+            child=people["child"],
+            theme=patch.theme or self.theme,
+        )
+
+
+def _merge_items(current: list[str] | None, added: list[str] | None) -> list[str] | None:
+    if added is None:
+        return current
+    known = {item.strip().lower() for item in current or []}
+    merged = list(current or [])
+    for item in added or []:
+        if item.strip() and item.strip().lower() not in known:
+            known.add(item.strip().lower())
+            merged.append(item.strip())
+    return merged
+
 
 class EventModel(BaseModel):
     name: str
@@ -45,12 +127,6 @@ class InteractiveTurnOutput(BaseModel):
     options: StoryContinuationOutput | None  # Holds the *next* scene and options, or None if story ends
 
 
-class ConvoInfo(BaseModel):
-    convo_id: str
-    existing_convo: bool = False
-
-
-
 class FinalOutput(BaseModel):
     story: str
     story_image_paths: list[str]
@@ -64,6 +140,8 @@ class FinalOutput(BaseModel):
 class ConvoInfo(BaseModel):
     convo_id: str
     existing_convo: bool = False
+    # UNIX timestamp by which the plan has to be ready, see deadline.py
+    deadline: float | None = None
 
 
 class MessageToUser(BaseModel):
@@ -0,0 +1,179 @@
+import asyncio
+import datetime
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from models import Knowledge
+from settings import env_settings
+
+
+# How long a stored answer is trusted before onboarding asks the family to confirm it again.
+# Fields are matched by their dotted name, falling back to the top-level section.
+FIELD_MAX_AGE: dict[str, datetime.timedelta] = {
+    "address": datetime.timedelta(days=180),
+    "parent.name": datetime.timedelta(days=3650),
+    "child.name": datetime.timedelta(days=3650),
+    "parent.age": datetime.timedelta(days=365),
+    "child.age": datetime.timedelta(days=180),
+    "parent": datetime.timedelta(days=60),
+    "child": datetime.timedelta(days=30),
+    # The theme is chosen per evening, so it is only reused within the same evening.
+    "theme": datetime.timedelta(hours=6),
+}
+
+# A family starting a conversation every evening is recognised by any of its last year of conversations
+MAX_CONVERSATIONS_PER_PROFILE = 365
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    profile_id TEXT PRIMARY KEY,
+    updated REAL NOT NULL,
+    profile_json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profile_conversations (
+    convo_id TEXT PRIMARY KEY,
+    profile_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profile_conversations_profile ON profile_conversations (profile_id);
+"""
+
+FIELD_LABELS: dict[str, str] = {
+    "address.country": "you live in",
+    "address.city": "your city is",
+    "parent.name": "your name is",
+    "parent.age": "your age is",
+    "parent.likes": "you like",
+    "parent.dislikes": "you don't like",
+    "child.name": "your child's name is",
+    "child.age": "your child's age is",
+    "child.likes": "your child likes",
+    "child.dislikes": "your child doesn't like",
+}
+
+
+class FamilyProfile(BaseModel):
+    profile_id: str
+    knowledge: Knowledge
+    # Dotted field name -> unix timestamp of the last time the family gave or confirmed it
+    field_updated_at: dict[str, float] = {}
+    conversation_ids: list[str] = []
+
+    def stale_fields(self, now: float | None = None) -> list[str]:
+        """Dotted names of filled fields whose answer is older than its allowed age."""
+        now = now or time.time()
+        filled = set(_all_fields()) - set(self.knowledge.missing_fields())
+        return [
+            field
+            for field in _all_fields()
+            if field in filled and now - self.field_updated_at.get(field, 0.0) > _max_age(field).total_seconds()
+        ]
+
+
+class ProfileStore:
+    """
+    Family profiles persisted to SQLite, one row per profile.
+
+    Profiles are keyed by profile ID, with an index from conversation ID to profile ID,
+    so a returning client can be recognised by either of them. Lookups are indexed and run on the
+    event loop, writes run in a worker thread.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        # Writes come from worker threads, one at a time
+        self._write_lock = threading.Lock()
+        # Profiles used to be kept in a single JSON file next to the database
+        legacy_path = path.with_suffix(".json")
+        if legacy_path.exists() and self._db.execute("SELECT 1 FROM profiles LIMIT 1").fetchone() is None:
+            for raw in json.loads(legacy_path.read_text()).get("profiles", []):
+                self._write(FamilyProfile.model_validate(raw))
+
+    def get(self, profile_id: str | None = None, convo_id: str | None = None) -> FamilyProfile | None:
+        if profile_id is None and convo_id is not None:
+            row = self._db.execute(
+                "SELECT profile_id FROM profile_conversations WHERE convo_id = ?", (convo_id,)
+            ).fetchone()
+            profile_id = row[0] if row is not None else None
+        if profile_id is None:
+            return None
+        row = self._db.execute("SELECT profile_json FROM profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+        return FamilyProfile.model_validate_json(row[0]) if row is not None else None
+
+    async def attach(self, profile_id: str | None, convo_id: str) -> str:
+        """Link a conversation to a profile, creating an empty profile when needed. Returns the profile ID."""
+        profile = self.get(profile_id, convo_id)
+        if profile is None:
+            profile = FamilyProfile(profile_id=profile_id or str(uuid.uuid4()), knowledge=Knowledge())
+        # Only the most recent conversations are remembered, older ones start over as new families
+        conversation_ids = [known for known in profile.conversation_ids if known != convo_id] + [convo_id]
+        profile.conversation_ids = conversation_ids[-MAX_CONVERSATIONS_PER_PROFILE:]
+        await asyncio.to_thread(self._write, profile)
+        return profile.profile_id
+
+    async def save(self, profile_id: str, knowledge: Knowledge, confirmed_fields: list[str]) -> FamilyProfile:
+        """
+        Store the knowledge for a profile.
+
+        Fields whose value changed, and the fields the family was asked to confirm, are marked as fresh.
+        """
+        profile = self.get(profile_id) or FamilyProfile(profile_id=profile_id, knowledge=Knowledge())
+        now = time.time()
+        for field in _all_fields():
+            if field in confirmed_fields or _field_value(profile.knowledge, field) != _field_value(knowledge, field):
+                profile.field_updated_at[field] = now
+        profile.knowledge = knowledge
+        await asyncio.to_thread(self._write, profile)
+        return profile
+
+    def _write(self, profile: FamilyProfile) -> None:
+        with self._write_lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)",
+                (profile.profile_id, time.time(), profile.model_dump_json()),
+            )
+            self._db.execute("DELETE FROM profile_conversations WHERE profile_id = ?", (profile.profile_id,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO profile_conversations VALUES (?, ?)",
+                [(convo_id, profile.profile_id) for convo_id in profile.conversation_ids],
+            )
+
+
+def describe_fields(knowledge: Knowledge, fields: list[str]) -> str:
+    """Human readable summary of the given fields, used when asking a returning family to confirm them."""
+    parts = []
+    for field in fields:
+        if field not in FIELD_LABELS:
+            continue
+        value = _field_value(knowledge, field)
+        if isinstance(value, list):
+            value = ", ".join(value)
+        parts.append(f"{FIELD_LABELS[field]} {value}")
+    return "; ".join(parts)
+
+
+def _all_fields() -> list[str]:
+    return Knowledge().missing_fields()
+
+
+def _max_age(field: str) -> datetime.timedelta:
+    return FIELD_MAX_AGE.get(field) or FIELD_MAX_AGE[field.split(".")[0]]
+
+
+def _field_value(knowledge: Knowledge, field: str):
+    value = knowledge
+    for part in field.split("."):
+        value = getattr(value, part, None)
+        if value is None:
+            return None
+    return value
+
+
+profile_store = ProfileStore(Path(env_settings.profile_store_path))
@@ -0,0 +1,94 @@
+"""
+Prompt templates with a stable prefix.
+
+OpenAI reuses the computation for the longest prefix of a request it has seen recently (for requests
+over 1024 tokens), which makes the cached part cheaper and faster. A request starts with the agent's
+instructions, followed by the input, so the input should start with text that is the same for every
+request and end with whatever changes per request: knowledge of the family, the story, the theme.
+
+```python
+input_prompt = STORY_PROMPT.render(knowledge=knowledge.model_dump_json(), theme=theme)
+```
+
+A template's prefix may not contain fields, and the fields of its suffix are ordered from the most
+to the least stable. The prefixes are short, so a request is only cached once its instructions, prefix
+and the start of its suffix add up to 1024 tokens, e.g. a long story or history. The share of input
+tokens served from the cache is counted per agent in `/metrics` and in `/stats/prompt_cache`.
+"""
+
+from dataclasses import dataclass
+from string import Formatter
+from typing import Any
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    # Sent as is, it is the part of the input that can be cached
+    prefix: str
+    # `str.format` template for everything that changes per request
+    suffix: str
+
+    def __post_init__(self) -> None:
+        if self.prefix_fields():
+            raise ValueError(f"Prompt {self.name} has fields in its prefix: {', '.join(self.prefix_fields())}")
+
+    def prefix_fields(self) -> list[str]:
+        return _fields(self.prefix)
+
+    def suffix_fields(self) -> list[str]:
+        return _fields(self.suffix)
+
+    def render(self, **values: Any) -> str:
+        return self.prefix + self.suffix.format(**values)
+
+
+def _fields(template: str) -> list[str]:
+    return [field for _, field, _, _ in Formatter().parse(template) if field is not None]
+
+
+STORY_PROMPT = PromptTemplate(
+    name="story",
+    prefix="""Generate a story for the family described at the end, with the theme given at the end.
+You can name characters like parent and child, and use the theme as a base for the story.
+You can locate the story in the address provided.
+
+But DO NOT make humans the main characters of the story.
+The story should be a short children's story, with a clear beginning, middle, and end.
+The story should be engaging and suitable for children, with a positive message or moral.
+The story should be no more than 500 words long.
+The story should be written in a simple and clear language, with short sentences and paragraphs.
+The story should be imaginative and creative, with interesting characters and settings.
+The story should be appropriate for the age group of the child.
+""",
+    suffix="""
+Here is some helpful data: {knowledge}.
+
+Remember: Generate a story with the theme: {theme}.
+""",
+)
+
+STORYBOARD_PROMPT = PromptTemplate(
+    name="storyboard",
+    prefix="""Please analyze the story given at the end and identify its most impactful moments, no more than the number
+of scenes given before the story.
+For each moment, create a scene with the following structure:
+- A short, descriptive title for the scene.
+- A detailed prompt suitable for an image generation model that captures the essence of the scene.
+""",
+    suffix="""
+Number of scenes: up to {max_scenes}
+
+The story is as follows:
+{story}
+""",
+)
+
+# The history only grows between turns, so it goes before the chosen path to keep earlier turns a prefix
+INTERACTIVE_TURN_PROMPT = PromptTemplate(
+    name="interactive_turn",
+    prefix="Story History: ",
+    suffix="{history}\n\nChosen Path: {chosen_path}",
+)
+
+TEMPLATES = {template.name: template for template in (STORY_PROMPT, STORYBOARD_PROMPT, INTERACTIVE_TURN_PROMPT)}
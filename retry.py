@@ -1,7 +1,13 @@
-import time
+import asyncio
 import random
 from functools import wraps
 
+from circuit import CircuitOpenError
+from logs import get_logger
+from metrics import RETRIES
+
+logger = get_logger(__name__)
+
 
 def exponential_backoff(max_retries=5, base_delay=1, max_delay=60, jitter=True):
     """
@@ -24,10 +30,13 @@ def exponential_backoff(max_retries=5, base_delay=1, max_delay=60, jitter=True):
             while True:
                 try:
                     return await func(*args, **kwargs)
+                except CircuitOpenError:
+                    # The provider is down, waiting for it would only hold up the degraded result
+                    raise
                 except Exception as e:
                     retries += 1
                     if retries > max_retries:
-                        raise Exception(f"Failed after {max_retries} retries: {str(e)}")
+                        raise Exception(f"Failed after {max_retries} retries: {str(e)}") from e
 
                     # Calculate delay with exponential backoff
                     delay = min(base_delay * (2 ** (retries - 1)), max_delay)
@@ -36,8 +45,9 @@ def exponential_backoff(max_retries=5, base_delay=1, max_delay=60, jitter=True):
                     if jitter:
                         delay = delay * (0.5 + random.random())
 
-                    print(f"{e} occurred. Retry {retries}/{max_retries} after {delay:.2f}s delay")
-                    time.sleep(delay)
+                    RETRIES.inc(func.__name__)
+                    logger.warning("%s occurred. Retry %d/%d after %.2fs delay", e, retries, max_retries, delay)
+                    await asyncio.sleep(delay)
 
         return wrapper
 
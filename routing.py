@@ -0,0 +1,206 @@
+"""
+Model routing by latency SLO.
+
+Every agent and tool that calls a model names a route: an ordered chain of candidate models and the
+latency it should answer within. Each call goes to the first candidate that currently meets the SLO,
+judged by a moving average of its latency and error rate on that route: a model that is slow for long
+stories can still be fast enough for a checker. Server errors, rate limits and calls taking far longer
+than the SLO fall back to the next candidate in the chain. Server errors and failed connections mean the
+model itself is down, it is skipped by every route for a while.
+
+```python
+agent = Agent(name="lesson_agent", model=routed("lesson"), ...)
+```
+
+Calls go through the circuit breaker of the route's provider, and fail at once while it is open.
+Decisions are kept in memory for `/stats/routing` and counted in `/metrics`.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
+
+import openai
+from agents import Model, ModelResponse, OpenAIResponsesModel
+
+from circuit import circuit_breaker
+from logs import get_logger
+from metrics import ROUTING_DECISIONS
+from settings import openai_client
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Weight of the latest call in the moving averages
+EWMA_ALPHA = 0.2
+# A candidate is skipped while its recent error rate is above this
+MAX_ERROR_RATE = 0.5
+# After a failure or a breach, a candidate is skipped for this long before it is tried again
+COOLDOWN_SECONDS = 30.0
+# Calls running this many times over the SLO are abandoned in favour of the next candidate
+HARD_TIMEOUT_FACTOR = 3.0
+MAX_RECORDED_DECISIONS = 1000
+
+
+@dataclass(frozen=True)
+class Route:
+    candidates: tuple[str, ...]
+    slo_seconds: float
+    provider: str = "openai_text"
+
+
+ROUTES = {
+    # Long, creative outputs where quality matters more than speed
+    "main_agent": Route(("gpt-4o", "gpt-4.1", "gpt-4o-mini"), slo_seconds=30),
+    "story": Route(("gpt-4o", "gpt-4.1", "gpt-4o-mini"), slo_seconds=30),
+    "storyboard": Route(("gpt-4o", "gpt-4.1", "gpt-4o-mini"), slo_seconds=30),
+    "lesson": Route(("gpt-4o", "gpt-4.1-mini"), slo_seconds=30),
+    "art_project": Route(("gpt-4o", "gpt-4.1-mini"), slo_seconds=30),
+    "event_search": Route(("gpt-4.1", "gpt-4o"), slo_seconds=30, provider="openai_web_search"),
+    # A family is waiting for these
+    "interactive_story": Route(("gpt-4o", "gpt-4.1-mini"), slo_seconds=10),
+    "onboarding_turn": Route(("gpt-4.1-mini", "gpt-4o-mini", "gpt-4o"), slo_seconds=3),
+    # Tiny classification tasks
+    "checker": Route(("gpt-4.1-nano", "gpt-4o-mini", "gpt-4o"), slo_seconds=2),
+}
+
+
+class ModelStats:
+    def __init__(self):
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.cooldown_until = 0.0
+
+    def record(self, seconds: float | None, slo_seconds: float) -> None:
+        """Record a call, `seconds` is None for a failed one."""
+        failed = seconds is None
+        self.error_rate += EWMA_ALPHA * (failed - self.error_rate)
+        if seconds is not None:
+            self.latency = seconds if self.latency is None else self.latency + EWMA_ALPHA * (seconds - self.latency)
+        if failed or seconds > slo_seconds:
+            self.cooldown_until = time.monotonic() + COOLDOWN_SECONDS
+
+    def healthy(self, slo_seconds: float) -> bool:
+        if time.monotonic() < self.cooldown_until or self.error_rate > MAX_ERROR_RATE:
+            return False
+        return self.latency is None or self.latency <= slo_seconds
+
+
+# Keyed by (route name, model)
+_STATS: dict[tuple[str, str], ModelStats] = {}
+# Model -> time until which it is skipped by every route, after a server error or a failed connection
+_OUTAGES: dict[str, float] = {}
+DECISIONS: deque[dict[str, Any]] = deque(maxlen=MAX_RECORDED_DECISIONS)
+
+
+def choose_candidates(route_name: str) -> list[str]:
+    """Candidates in the order they should be tried: healthy ones first, in chain order."""
+    route = ROUTES[route_name]
+    stats = {model: _STATS.setdefault((route_name, model), ModelStats()) for model in route.candidates}
+    now = time.monotonic()
+    healthy = [
+        model
+        for model in route.candidates
+        if stats[model].healthy(route.slo_seconds) and now >= _OUTAGES.get(model, 0.0)
+    ]
+    # Nothing meets the SLO, try the fastest ones first
+    unhealthy = sorted(
+        (model for model in route.candidates if model not in healthy),
+        key=lambda model: stats[model].latency or 0.0,
+    )
+    return healthy + unhealthy
+
+
+async def route_call(route_name: str, call: Callable[[str], Awaitable[T]]) -> T:
+    """Run `call(model_name)` on the best candidate of the route, falling back down the chain on failure."""
+    route = ROUTES[route_name]
+    breaker = circuit_breaker(route.provider)
+    candidates = choose_candidates(route_name)
+    for attempt, model in enumerate(candidates):
+        start = time.perf_counter()
+        try:
+            # An open circuit is not caught below, the other candidates are served by the same provider.
+            # The timeout is outside the breaker: a call slower than this route's SLO says nothing about the provider.
+            async with asyncio.timeout(route.slo_seconds * HARD_TIMEOUT_FACTOR), breaker.guard():
+                result = await call(model)
+        except (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError, TimeoutError) as e:
+            _record(route_name, route, model, None, type(e).__name__, attempt)
+            if isinstance(e, (openai.APIConnectionError, openai.InternalServerError)):
+                _OUTAGES[model] = time.monotonic() + COOLDOWN_SECONDS
+            if attempt == len(candidates) - 1:
+                raise
+            logger.warning("Route %s: %s failed with %s, falling back", route_name, model, type(e).__name__)
+            continue
+        seconds = time.perf_counter() - start
+        _record(route_name, route, model, seconds, "ok" if seconds <= route.slo_seconds else "slo_breach", attempt)
+        return result
+    raise AssertionError("Routes have at least one candidate")
+
+
+def routing_stats() -> dict[str, Any]:
+    now = time.monotonic()
+    routes: dict[str, dict[str, Any]] = {}
+    for (route_name, model), stats in _STATS.items():
+        routes.setdefault(route_name, {})[model] = {
+            "latency": stats.latency,
+            "error_rate": stats.error_rate,
+            "cooling_down": now < stats.cooldown_until,
+        }
+    return {
+        "routes": routes,
+        "models_down": sorted(model for model, until in _OUTAGES.items() if now < until),
+        "decisions": list(DECISIONS),
+    }
+
+
+def _record(route_name: str, route: Route, model: str, seconds: float | None, outcome: str, attempt: int) -> None:
+    _STATS[route_name, model].record(seconds, route.slo_seconds)
+    ROUTING_DECISIONS.inc(route_name, model, outcome)
+    DECISIONS.append(
+        {
+            "time": time.time(),
+            "route": route_name,
+            "model": model,
+            "attempt": attempt,
+            "seconds": seconds,
+            "slo_seconds": route.slo_seconds,
+            "outcome": outcome,
+        }
+    )
+
+
+class RoutedModel(Model):
+    """Agents SDK model that sends every call through `route_call`."""
+
+    def __init__(self, route_name: str):
+        self.route_name = route_name
+        self._models: dict[str, OpenAIResponsesModel] = {}
+
+    def __repr__(self) -> str:
+        # Stable across processes, so that memo keys do not change between runs
+        return f"RoutedModel({self.route_name!r})"
+
+    def _model(self, name: str) -> OpenAIResponsesModel:
+        if name not in self._models:
+            self._models[name] = OpenAIResponsesModel(name, openai_client)
+        return self._models[name]
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        return await route_call(self.route_name, lambda name: self._model(name).get_response(*args, **kwargs))
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        # A stream cannot be retried once it started, so only the choice of model is routed
+        route = ROUTES[self.route_name]
+        model = choose_candidates(self.route_name)[0]
+        async with circuit_breaker(route.provider).guard():
+            async for event in self._model(model).stream_response(*args, **kwargs):
+                yield event
+
+
+def routed(route_name: str) -> RoutedModel:
+    if route_name not in ROUTES:
+        raise KeyError(f"Unknown route {route_name}")
+    return RoutedModel(route_name)
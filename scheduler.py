@@ -0,0 +1,221 @@
+"""
+Priority scheduling of outbound model calls.
+
+Every provider (text, images, speech, transcription, web search, video) has a fixed number of concurrent
+call slots and, for OpenAI, its own connection pool, so a provider that hangs cannot starve the others.
+Calls made while a family is waiting for an answer run in the `interactive` class and are always
+started before queued background work, e.g. another family's illustrations. Some slots are reserved
+for interactive calls, so that they never wait for long background calls to finish. Within a class,
+conversations share the slots fairly: a conversation with 7 queued images does not hold up the single
+image of another one.
+
+Calls through `settings.openai_client` are scheduled by `ScheduledTransport`, everything else can use
+`provider_scheduler(name).slot()` directly.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import AsyncIterator, Callable, Iterator
+
+import httpx
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+priority_var: ContextVar[Priority] = ContextVar("priority", default=Priority.BACKGROUND)
+
+# Concurrent calls per provider
+PROVIDER_CAPACITY = {
+    "openai_text": 64,
+    "openai_images": 8,
+    "openai_tts": 16,
+    "openai_transcription": 16,
+    "openai_web_search": 8,
+    "runway": 4,
+}
+# Share of every provider's slots that background calls may not use
+INTERACTIVE_RESERVE = 0.25
+
+
+@contextmanager
+def interactive() -> Iterator[None]:
+    """Run the calls made in this block, and in tasks started from it, ahead of background work."""
+    token = priority_var.set(Priority.INTERACTIVE)
+    try:
+        yield
+    finally:
+        priority_var.reset(token)
+
+
+class PriorityScheduler:
+    """
+    Slots of one provider, handed out by strict priority between classes and by start-time fair
+    queuing between conversations of the same class.
+    """
+
+    def __init__(self, name: str, capacity: int, interactive_reserve: float = INTERACTIVE_RESERVE):
+        self.name = name
+        self.capacity = capacity
+        self.background_capacity = max(1, capacity - max(1, round(capacity * interactive_reserve)))
+        self.in_use = {priority: 0 for priority in Priority}
+        # priority -> heap of (virtual finish tag, arrival order, conversation, future granting the slot)
+        self._queues: dict[Priority, list[tuple[float, int, str, asyncio.Future]]] = {p: [] for p in Priority}
+        # conversation -> finish tag of its latest queued call, dropped once nothing of it is queued
+        self._finish_tags: dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._arrivals = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority | None = None, weight: float = 1.0) -> AsyncIterator[None]:
+        release = await self.acquire(priority, weight)
+        try:
+            yield
+        finally:
+            release()
+
+    async def acquire(self, priority: Priority | None = None, weight: float = 1.0) -> Callable[[], None]:
+        """Wait for a slot, returns the function that gives it back."""
+        from metrics import SCHEDULER_WAIT, convo_id_var
+
+        priority = priority_var.get() if priority is None else priority
+        start = time.perf_counter()
+        if not any(self._queues[p] for p in Priority if p <= priority) and self._has_room(priority):
+            self.in_use[priority] += 1
+        else:
+            flow = convo_id_var.get() or "-"
+            tag = max(self._virtual_time, self._finish_tags.get(flow, 0.0)) + 1 / weight
+            self._finish_tags[flow] = tag
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queues[priority], (tag, next(self._arrivals), flow, future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted just as the caller gave up
+                    self._release(priority)
+                raise
+        SCHEDULER_WAIT.observe(time.perf_counter() - start, self.name, priority.name.lower())
+
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._release(priority)
+
+        return release
+
+    def queued(self, priority: Priority) -> int:
+        return sum(not future.done() for *_, future in self._queues[priority])
+
+    def _has_room(self, priority: Priority) -> bool:
+        if sum(self.in_use.values()) >= self.capacity:
+            return False
+        return priority == Priority.INTERACTIVE or self.in_use[Priority.BACKGROUND] < self.background_capacity
+
+    def _release(self, priority: Priority) -> None:
+        self.in_use[priority] -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self._has_room(priority):
+                tag, _, flow, future = heapq.heappop(queue)
+                if self._finish_tags.get(flow) == tag:
+                    del self._finish_tags[flow]
+                if future.done():
+                    # Cancelled while waiting
+                    continue
+                self._virtual_time = max(self._virtual_time, tag)
+                self.in_use[priority] += 1
+                future.set_result(None)
+            if queue:
+                # Lower classes only get what the higher ones leave
+                return
+
+
+_SCHEDULERS: dict[str, PriorityScheduler] = {}
+
+
+def provider_scheduler(provider: str) -> PriorityScheduler:
+    if provider not in _SCHEDULERS:
+        _SCHEDULERS[provider] = PriorityScheduler(provider, PROVIDER_CAPACITY[provider])
+    return _SCHEDULERS[provider]
+
+
+def openai_provider(path: str, body: bytes = b"") -> str:
+    if "/images/" in path:
+        return "openai_images"
+    if path.endswith("/audio/speech"):
+        return "openai_tts"
+    if path.endswith("/audio/transcriptions"):
+        return "openai_transcription"
+    if b'"web_search_preview"' in body:
+        return "openai_web_search"
+    return "openai_text"
+
+
+class ScheduledTransport(httpx.AsyncBaseTransport):
+    """
+    Holds a provider slot from sending an OpenAI request until its response body is closed.
+
+    Every provider gets a connection pool of its own, sized to its slots.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None):
+        self._shared_transport = transport
+        self._transports: dict[str, httpx.AsyncBaseTransport] = {}
+
+    def _transport(self, provider: str) -> httpx.AsyncBaseTransport:
+        if self._shared_transport is not None:
+            return self._shared_transport
+        if provider not in self._transports:
+            capacity = PROVIDER_CAPACITY[provider]
+            self._transports[provider] = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=capacity, max_keepalive_connections=capacity)
+            )
+        return self._transports[provider]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # Bodies of model requests are JSON and already in memory, uploads are streamed and never a web search
+        body = request.content if isinstance(request.stream, httpx.ByteStream) else b""
+        provider = openai_provider(request.url.path, body)
+        release = await provider_scheduler(provider).acquire()
+        try:
+            response = await self._transport(provider).handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self) -> None:
+        if self._shared_transport is not None:
+            await self._shared_transport.aclose()
+        for transport in self._transports.values():
+            await transport.aclose()
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream, self._release = stream, release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
@@ -1,7 +1,10 @@
 from typing import Self
 from pydantic import BaseModel
+from agents import set_default_openai_client, set_trace_processors
 from dotenv import dotenv_values
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from scheduler import ScheduledTransport
 
 
 class EnvSettings(BaseModel):
@@ -14,6 +17,35 @@ class EnvSettings(BaseModel):
     openai_api_key: str
     run_in_cli: bool
     preset_knowledge: bool
+    profile_store_path: str = "data/profiles.sqlite3"
+    # Semicolon separated "City, Country" entries whose events are fetched ahead of time
+    event_warm_up_locations: str = ""
+    event_index_path: str = "data/events.sqlite3"
+    # Semicolon separated themes whose stories are built ahead of time, see tools/story_catalog.py
+    story_catalog_themes: str = ""
+    story_catalog_path: str = "data/story_catalog.sqlite3"
+    # Hour of the night, local time, when the missing catalog stories are built
+    story_catalog_hour: int = 3
+    similarity_index_path: str = "data/similarity.sqlite3"
+    # Cosine similarity from which two themes or requests count as the same, see similarity.py
+    similarity_threshold: float = 0.8
+    memo_cache_path: str = "data/memo.sqlite3"
+    memo_cache_max_bytes: int = 50_000_000
+    convo_store_path: str = "data/conversations.sqlite3"
+    # Conversations nobody touched for this long are moved from memory to disk
+    convo_idle_ttl_seconds: float = 7200
+    # Set these to the address of `stub_server.py` to run against the local stand-in
+    openai_base_url: str | None = None
+    runway_base_url: str | None = None
+    log_level: str = "INFO"
+    # Join the scene narrations of a story into a single track, needs ffmpeg
+    stitch_narration: bool = True
+    # Duplicate image and speech requests that are slower than usual, see hedging.py
+    hedge_media_calls: bool = True
+    # Time from `/start` until the plan has to be ready, unless the family asks for another one
+    story_time_budget_seconds: float = 1200
+    # "agent" lets the main agent call the plan's stages as tools, "parallel" (opt-in) runs them concurrently from code
+    plan_execution: str = "agent"
 
     @classmethod
     def load(cls, env_path: str = ".env") -> Self:
@@ -22,4 +54,13 @@ class EnvSettings(BaseModel):
 
 env_settings = EnvSettings.load()
 
-openai_client = AsyncOpenAI(api_key=env_settings.openai_api_key)
+openai_client = AsyncOpenAI(
+    api_key=env_settings.openai_api_key,
+    base_url=env_settings.openai_base_url,
+    # Model calls are started in priority order, see scheduler.py
+    http_client=DefaultAsyncHttpxClient(transport=ScheduledTransport()),
+)
+set_default_openai_client(openai_client)
+if env_settings.openai_base_url:
+    # Traces would otherwise be exported to the real OpenAI backend
+    set_trace_processors([])
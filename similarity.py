@@ -0,0 +1,179 @@
+"""
+Local near-duplicate lookup of themes and requests.
+
+Families describe the same thing in different words: "a courageous small mouse" is "A brave little mouse".
+`SimilarityIndex` turns short texts into hashed vectors of words and character trigrams, after mapping
+common synonyms and plurals to one word, and finds the most similar text indexed before by cosine
+similarity. It runs in memory without any network call, and every insert is also written to SQLite,
+so the index survives restarts.
+
+```python
+match = lesson_index.nearest(request, scope="5")
+```
+
+Parts of a signature that have to match exactly, e.g. the child's age or the location, go in `scope`.
+Only entries of the same scope are compared, so a lookup stays well under a millisecond.
+"""
+
+import hashlib
+import math
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from metrics import record_cache
+from settings import env_settings
+
+DIMENSIONS = 2**18
+# Character trigrams catch spelling variants, but whole words say more about the meaning
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.3
+
+STOPWORDS = frozenset(
+    "a an and about the of to in on at for with is are be was were it its this that some very".split()
+)
+SYNONYMS = {
+    "courageous": "brave",
+    "bold": "brave",
+    "fearless": "brave",
+    "small": "little",
+    "tiny": "little",
+    "mice": "mouse",
+    "dino": "dinosaur",
+    "dinos": "dinosaur",
+    "kitten": "cat",
+    "kitty": "cat",
+    "puppy": "dog",
+    "doggy": "dog",
+    "big": "large",
+    "huge": "large",
+    "giant": "large",
+    "journey": "trip",
+    "adventure": "trip",
+    "voyage": "trip",
+    "visit": "trip",
+    "space": "cosmos",
+    "universe": "cosmos",
+    "stars": "cosmos",
+    "ocean": "sea",
+    "happy": "joyful",
+    "glad": "joyful",
+    "scared": "afraid",
+    "frightened": "afraid",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS similarity_entries (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    text TEXT NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+Vector = dict[int, float]
+
+
+def normalize(text: str) -> list[str]:
+    """Words of the text, lowercase, without stopwords, with synonyms and plurals mapped to one word."""
+    words = []
+    for word in re.findall(r"\w+", text.lower()):
+        if word in STOPWORDS:
+            continue
+        word = SYNONYMS.get(word, word)
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = SYNONYMS.get(word[:-1], word[:-1])
+        words.append(word)
+    return words
+
+
+def vectorize(text: str) -> Vector:
+    vector: Vector = {}
+    for word in normalize(text):
+        features = [(f"w:{word}", WORD_WEIGHT)]
+        padded = f"#{word}#"
+        features += [(f"t:{padded[i:i + 3]}", TRIGRAM_WEIGHT) for i in range(len(padded) - 2)]
+        for feature, weight in features:
+            bucket = _bucket(feature)
+            vector[bucket] = vector.get(bucket, 0.0) + weight
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {bucket: weight / norm for bucket, weight in vector.items()} if norm else {}
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+class SimilarityIndex:
+    """Keys indexed by a short text, looked up by the most similar text of the same scope."""
+
+    def __init__(self, name: str, path: str | Path, threshold: float | None = None):
+        self.name = name
+        self.threshold = env_settings.similarity_threshold if threshold is None else threshold
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        # scope -> key -> (vector, expires_at)
+        self._entries: dict[str, dict[str, tuple[Vector, float | None]]] = {}
+        self._load()
+
+    def add(self, key: str, text: str, scope: str = "", expires_at: float | None = None) -> None:
+        self.discard(key)
+        self._entries.setdefault(scope, {})[key] = (vectorize(text), expires_at)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO similarity_entries VALUES (?, ?, ?, ?, ?)",
+                (self.name, key, scope, text, expires_at),
+            )
+
+    def discard(self, key: str) -> None:
+        for entries in self._entries.values():
+            entries.pop(key, None)
+        with self._db:
+            self._db.execute("DELETE FROM similarity_entries WHERE name = ? AND key = ?", (self.name, key))
+
+    def nearest(self, text: str, scope: str = "", threshold: float | None = None) -> str | None:
+        """Key of the most similar unexpired entry of the scope, if it is at least `threshold` similar."""
+        threshold = self.threshold if threshold is None else threshold
+        vector = vectorize(text)
+        now = time.time()
+        best_key, best_score, expired = None, threshold, []
+        for key, (entry, expires_at) in self._entries.get(scope, {}).items():
+            if expires_at is not None and expires_at <= now:
+                expired.append(key)
+                continue
+            score = cosine(vector, entry)
+            if score >= best_score:
+                best_key, best_score = key, score
+        for key in expired:
+            self.discard(key)
+        record_cache(f"similarity_{self.name}", best_key is not None)
+        return best_key
+
+    def __contains__(self, key: str) -> bool:
+        return any(key in entries for entries in self._entries.values())
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def _load(self) -> None:
+        with self._db:
+            self._db.execute(
+                "DELETE FROM similarity_entries WHERE name = ? AND expires_at <= ?", (self.name, time.time())
+            )
+        rows = self._db.execute(
+            "SELECT key, scope, text, expires_at FROM similarity_entries WHERE name = ?", (self.name,)
+        ).fetchall()
+        for key, scope, text, expires_at in rows:
+            self._entries.setdefault(scope, {})[key] = (vectorize(text), expires_at)
+
+
+def _bucket(feature: str) -> int:
+    # Python's hash() is salted per process, the buckets have to be the same after a restart
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big") % DIMENSIONS
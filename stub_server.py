@@ -0,0 +1,443 @@
+"""
+Local stand-in for the OpenAI and Runway APIs, for offline load testing.
+
+It serves the endpoints this project uses (responses, chat completions, image generation and edits,
+speech, transcriptions, Runway image to video and tasks) and answers them by replaying recorded
+fixtures or by synthesizing outputs that follow the requested JSON schemas. Latency, 429 injection
+and payload sizes are configurable.
+
+Start it with:
+
+```bash
+python stub_server.py --port 8100 --latency-scale 0.1
+```
+
+and point the application at it in `.env`:
+
+```
+OPENAI_BASE_URL=http://localhost:8100/v1
+RUNWAY_BASE_URL=http://localhost:8100
+```
+
+With `--mode record`, requests are forwarded to the real APIs and their responses are saved as fixtures,
+which `--mode replay` serves afterwards.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Any, Literal
+
+import httpx
+from fastapi import FastAPI, Request, Response
+from pydantic import BaseModel
+
+# Median latency in milliseconds and log-normal sigma for every endpoint
+DEFAULT_LATENCIES: dict[str, tuple[float, float]] = {
+    "responses": (1500, 0.5),
+    "chat": (1500, 0.5),
+    "images": (20000, 0.4),
+    "speech": (1200, 0.4),
+    "transcriptions": (700, 0.3),
+    "runway_create": (500, 0.2),
+    "runway_task": (40000, 0.3),
+}
+
+UPSTREAMS = {"openai": "https://api.openai.com", "runway": "https://api.dev.runwayml.com"}
+
+# Boolean output fields that have to be true for the pipeline to carry on, e.g. guardrail verdicts
+TRUTHY_FIELDS = {"is_appropriate"}
+
+TRANSCRIPTS = [
+    "We are Helena and Mark from Warsaw in Poland. Mark is ten and loves physics and museums.",
+    "Helena is forty, she likes museums and does not like spiders. Mark does not like sports.",
+    "Tonight Mark wants a story about a brave little turtle visiting the Kopernik center.",
+]
+
+
+class StubConfig(BaseModel):
+    mode: Literal["synthetic", "replay", "record"] = "synthetic"
+    fixtures_dir: Path = Path("fixtures")
+    latency_scale: float = 1.0
+    latencies: dict[str, tuple[float, float]] = DEFAULT_LATENCIES
+    rate_limit_probability: float = 0.0
+    text_words: int = 120
+    array_items: int = 3
+    image_bytes: int = 1_500_000
+    audio_bytes: int = 60_000
+    call_tools: bool = True
+    seed: int | None = None
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="OpenAI and Runway stand-in")
+    rng = random.Random(config.seed)
+    transcripts = itertools.cycle(TRANSCRIPTS)
+    runway_tasks: dict[str, float] = {}
+    stats: dict[str, int] = {}
+
+    async def simulate(endpoint: str) -> Response | None:
+        """Sleep for a sampled latency, and sometimes answer with a rate limit error instead."""
+        stats[endpoint] = stats.get(endpoint, 0) + 1
+        median, sigma = config.latencies.get(endpoint, (0, 0))
+        await asyncio.sleep(rng.lognormvariate(0, sigma) * median * config.latency_scale / 1000)
+        if rng.random() < config.rate_limit_probability:
+            error = {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_exceeded", "code": None}}
+            return _json(error, status_code=429, headers={"retry-after": "1"})
+        return None
+
+    async def fixture_or(request: Request, endpoint: str, key_data: Any, synthesize) -> Response:
+        fixture_path = config.fixtures_dir / endpoint / f"{_fixture_key(key_data)}.json"
+        if config.mode == "record":
+            response = await _forward(request)
+            fixture_path.parent.mkdir(parents=True, exist_ok=True)
+            fixture_path.write_text(
+                json.dumps(
+                    {
+                        "status_code": response.status_code,
+                        "media_type": response.headers.get("content-type"),
+                        "body": base64.b64encode(response.body).decode(),
+                    }
+                )
+            )
+            return response
+        if config.mode == "replay" and fixture_path.exists():
+            fixture = json.loads(fixture_path.read_text())
+            return Response(
+                base64.b64decode(fixture["body"]),
+                status_code=fixture["status_code"],
+                media_type=fixture["media_type"],
+            )
+        return synthesize()
+
+    @app.post("/v1/responses")
+    async def responses(request: Request) -> Response:
+        body = await request.json()
+        if error := await simulate("responses"):
+            return error
+        return await fixture_or(request, "responses", body, lambda: _json(_responses_output(body, config, rng)))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> Response:
+        body = await request.json()
+        if error := await simulate("chat"):
+            return error
+        return await fixture_or(request, "chat", body, lambda: _json(_chat_output(body, config, rng)))
+
+    @app.post("/v1/images/generations")
+    @app.post("/v1/images/edits")
+    async def images(request: Request) -> Response:
+        form = await _request_fields(request)
+        if error := await simulate("images"):
+            return error
+        return await fixture_or(
+            request,
+            "images",
+            form,
+            lambda: _json({"created": int(time.time()), "data": [{"b64_json": _synthetic_png(config.image_bytes)}]}),
+        )
+
+    @app.post("/v1/audio/speech")
+    async def speech(request: Request) -> Response:
+        body = await request.json()
+        if error := await simulate("speech"):
+            return error
+        # Longer inputs produce longer audio, capped at the configured payload size
+        size = min(config.audio_bytes, 2_000 + 400 * len(body.get("input", "")))
+        return await fixture_or(
+            request, "speech", body, lambda: Response(_synthetic_mp3(size), media_type="audio/mpeg")
+        )
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(request: Request) -> Response:
+        form = await _request_fields(request)
+        if error := await simulate("transcriptions"):
+            return error
+        text = next(transcripts)
+        if form.get("response_format") == "text":
+            return await fixture_or(request, "transcriptions", form, lambda: Response(text, media_type="text/plain"))
+        return await fixture_or(request, "transcriptions", form, lambda: _json({"text": text}))
+
+    @app.post("/v1/image_to_video")
+    async def image_to_video(request: Request) -> Response:
+        if error := await simulate("runway_create"):
+            return error
+        task_id = str(uuid.uuid4())
+        median, sigma = config.latencies["runway_task"]
+        runway_tasks[task_id] = time.time() + rng.lognormvariate(0, sigma) * median * config.latency_scale / 1000
+        return _json({"id": task_id})
+
+    @app.get("/v1/tasks/{task_id}")
+    async def runway_task(task_id: str, request: Request) -> Response:
+        if task_id not in runway_tasks:
+            return _json({"error": "Task not found"}, status_code=404)
+        done = time.time() >= runway_tasks[task_id]
+        return _json(
+            {
+                "id": task_id,
+                "createdAt": "2025-01-01T00:00:00Z",
+                "status": "SUCCEEDED" if done else "RUNNING",
+                "output": [f"{request.base_url}files/videos/{task_id}.mp4"] if done else None,
+            }
+        )
+
+    @app.get("/files/videos/{name}")
+    async def video_file(name: str) -> Response:
+        return Response(b"\x00\x00\x00\x18ftypmp42" + bytes(config.image_bytes // 4), media_type="video/mp4")
+
+    @app.get("/stub/stats")
+    async def get_stats() -> dict[str, int]:
+        return stats
+
+    return app
+
+
+def _responses_output(body: dict, config: StubConfig, rng: random.Random) -> dict:
+    """Responses API answer: the next uncalled function tool, or a final message following the requested format."""
+    items = body.get("input") if isinstance(body.get("input"), list) else []
+    called = {item.get("name") for item in items if item.get("type") == "function_call"}
+    next_tool = next(
+        (
+            tool
+            for tool in body.get("tools", [])
+            if tool.get("type") == "function" and tool["name"] not in called and config.call_tools
+        ),
+        None,
+    )
+    if next_tool is not None:
+        output_item = {
+            "type": "function_call",
+            "id": f"fc_{uuid.uuid4().hex}",
+            "call_id": f"call_{uuid.uuid4().hex}",
+            "name": next_tool["name"],
+            "arguments": json.dumps(_synthesize(next_tool.get("parameters", {}), config, rng)),
+            "status": "completed",
+        }
+    else:
+        text_format = (body.get("text") or {}).get("format") or {}
+        text = (
+            json.dumps(_synthesize(text_format["schema"], config, rng))
+            if text_format.get("type") == "json_schema"
+            else _words(config.text_words, rng)
+        )
+        output_item = {
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }
+    input_tokens = len(json.dumps(body)) // 4
+    output_tokens = len(json.dumps(output_item)) // 4
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": time.time(),
+        "model": body.get("model") or "gpt-4o",
+        "status": "completed",
+        "output": [output_item],
+        "parallel_tool_calls": False,
+        "tool_choice": body.get("tool_choice") or "auto",
+        "tools": body.get("tools", []),
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+def _chat_output(body: dict, config: StubConfig, rng: random.Random) -> dict:
+    """Chat completions answer, with the same tool calling strategy as `_responses_output`."""
+    called = {
+        call["function"]["name"] for message in body.get("messages", []) for call in message.get("tool_calls") or []
+    }
+    next_tool = next(
+        (tool for tool in body.get("tools", []) if tool["function"]["name"] not in called and config.call_tools), None
+    )
+    message: dict[str, Any] = {"role": "assistant", "content": None}
+    if next_tool is not None:
+        message["tool_calls"] = [
+            {
+                "id": f"call_{uuid.uuid4().hex}",
+                "type": "function",
+                "function": {
+                    "name": next_tool["function"]["name"],
+                    "arguments": json.dumps(_synthesize(next_tool["function"].get("parameters", {}), config, rng)),
+                },
+            }
+        ]
+    else:
+        response_format = body.get("response_format") or {}
+        message["content"] = (
+            json.dumps(_synthesize(response_format["json_schema"]["schema"], config, rng))
+            if response_format.get("type") == "json_schema"
+            else _words(config.text_words, rng)
+        )
+    prompt_tokens = len(json.dumps(body)) // 4
+    completion_tokens = len(json.dumps(message)) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or "gpt-4o",
+        "choices": [
+            {"index": 0, "message": message, "finish_reason": "tool_calls" if next_tool is not None else "stop"}
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def _synthesize(schema: dict, config: StubConfig, rng: random.Random, root: dict | None = None, name: str = "") -> Any:
+    """Build a value that validates against the JSON schema."""
+    root = root or schema
+    if "$ref" in schema:
+        target = root
+        for part in schema["$ref"].removeprefix("#/").split("/"):
+            target = target[part]
+        return _synthesize(target, config, rng, root, name)
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            options = [option for option in schema[key] if option.get("type") != "null"] or schema[key]
+            return _synthesize(options[0], config, rng, root, name)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+
+    schema_type = schema.get("type", "object")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+    if schema_type == "object":
+        return {key: _synthesize(value, config, rng, root, key) for key, value in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [_synthesize(schema.get("items", {}), config, rng, root, name) for _ in range(config.array_items)]
+    if schema_type == "integer":
+        return rng.randint(3, 12)
+    if schema_type == "number":
+        return round(rng.uniform(1, 100), 2)
+    if schema_type == "boolean":
+        return name in TRUTHY_FIELDS
+    if schema_type == "null":
+        return None
+    return _words(config.text_words if name in {"", "story", "lesson", "scene_text"} else 8, rng)
+
+
+def _words(count: int, rng: random.Random) -> str:
+    vocabulary = "the brave little turtle walked to the museum and looked at the bright shining stars".split()
+    return " ".join(rng.choice(vocabulary) for _ in range(count)).capitalize() + "."
+
+
+def _synthetic_png(size: int) -> str:
+    """A valid 64x64 PNG, padded with an ancillary chunk up to roughly `size` bytes, base64 encoded."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    pixels = b"".join(b"\x00" + b"\x80\xc0\xff" * 64 for _ in range(64))
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", 64, 64, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(pixels))
+        + chunk(b"stUb", bytes(max(size - 200, 0)))
+        + chunk(b"IEND", b"")
+    )
+    return base64.b64encode(png).decode()
+
+
+def _synthetic_mp3(size: int) -> bytes:
+    """Silent MPEG-1 Layer III frames (128 kbps, 44.1 kHz), about 26 ms of audio per 417 bytes."""
+    frame = b"\xff\xfb\x90\x00" + bytes(413)
+    return frame * max(size // len(frame), 1)
+
+
+def _fixture_key(data: Any) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+async def _request_fields(request: Request) -> dict[str, Any]:
+    """Non-file fields of a JSON or multipart request, used to key fixtures."""
+    if request.headers.get("content-type", "").startswith("multipart/"):
+        form = await request.form()
+        return {key: value for key, value in form.items() if isinstance(value, str)}
+    return await request.json()
+
+
+async def _forward(request: Request) -> Response:
+    upstream = UPSTREAMS["runway" if request.headers.get("x-runway-version") else "openai"]
+    headers = {key: value for key, value in request.headers.items() if key.lower() not in {"host", "content-length"}}
+    async with httpx.AsyncClient(timeout=600) as client:
+        upstream_response = await client.request(
+            request.method, upstream + request.url.path, headers=headers, content=await request.body()
+        )
+    return Response(
+        upstream_response.content,
+        status_code=upstream_response.status_code,
+        media_type=upstream_response.headers.get("content-type"),
+    )
+
+
+def _json(data: Any, status_code: int = 200, headers: dict[str, str] | None = None) -> Response:
+    return Response(json.dumps(data), status_code=status_code, headers=headers, media_type="application/json")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--mode", choices=["synthetic", "replay", "record"], default="synthetic")
+    parser.add_argument("--fixtures-dir", type=Path, default=Path("fixtures"))
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier applied to every latency")
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="ENDPOINT=MEDIAN_MS:SIGMA",
+        help=f"Override the latency distribution of an endpoint, one of: {', '.join(DEFAULT_LATENCIES)}",
+    )
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--text-words", type=int, default=120)
+    parser.add_argument("--array-items", type=int, default=3)
+    parser.add_argument("--image-bytes", type=int, default=1_500_000)
+    parser.add_argument("--audio-bytes", type=int, default=60_000)
+    parser.add_argument("--no-tool-calls", action="store_true", help="Always answer with a final output")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    latencies = dict(DEFAULT_LATENCIES)
+    for override in args.latency:
+        endpoint, distribution = override.split("=")
+        median, sigma = distribution.split(":")
+        latencies[endpoint] = (float(median), float(sigma))
+
+    stub_config = StubConfig(
+        mode=args.mode,
+        fixtures_dir=args.fixtures_dir,
+        latency_scale=args.latency_scale,
+        latencies=latencies,
+        rate_limit_probability=args.rate_limit_probability,
+        text_words=args.text_words,
+        array_items=args.array_items,
+        image_bytes=args.image_bytes,
+        audio_bytes=args.audio_bytes,
+        call_tools=not args.no_tool_calls,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(stub_config), host=args.host, port=args.port)
@@ -0,0 +1,946 @@
+import asyncio
+import base64
+import datetime
+import time
+
+import pytest
+
+from models import Address, Knowledge, KnowledgePatch, PersonEntry
+
+
+def test_knowledge_missing_fields_for_empty_knowledge() -> None:
+    """
+    Empty knowledge reports every nested field as missing.
+    """
+    missing = Knowledge().missing_fields()
+
+    assert "address.city" in missing
+    assert "parent.likes" in missing
+    assert "child.age" in missing
+    assert "theme" in missing
+    assert not Knowledge().is_complete()
+
+
+def test_apply_patch_completes_knowledge() -> None:
+    """
+    Patches are merged locally, deduplicating list items, until nothing is missing.
+    """
+    knowledge = Knowledge().apply_patch(
+        KnowledgePatch(
+            country="Poland",
+            city="Warsaw",
+            parent_name="Helena",
+            parent_age=40,
+            parent_likes=["museums"],
+            parent_dislikes=["spiders"],
+            child_name="Mark",
+            child_age=10,
+            child_likes=["physics"],
+        )
+    )
+    assert knowledge.missing_fields() == ["child.dislikes", "theme"]
+    # "No dislikes" is an answer, it is not asked again
+    assert knowledge.apply_patch(KnowledgePatch(child_dislikes=[])).missing_fields() == ["theme"]
+
+    knowledge = knowledge.apply_patch(
+        KnowledgePatch(child_likes=["Physics", "turtles"], child_dislikes=["sports"], theme="A trusty turtle")
+    )
+
+    assert knowledge.is_complete()
+    assert knowledge.address == Address(country="Poland", city="Warsaw")
+    assert knowledge.child == PersonEntry(name="Mark", age=10, likes=["physics", "turtles"], dislikes=["sports"])
+
+
+@pytest.mark.asyncio
+async def test_profile_store_tracks_stale_fields(tmp_path) -> None:
+    """
+    Stored profiles survive a restart and only old answers are reported as stale.
+    """
+    from unittest.mock import patch
+
+    from profiles import ProfileStore
+
+    knowledge = Knowledge(
+        address=Address(country="Poland", city="Warsaw"),
+        parent=PersonEntry(name="Helena", age=40, likes=["museums"], dislikes=["spiders"]),
+        child=PersonEntry(name="Mark", age=10, likes=["physics"], dislikes=["sports"]),
+        theme="A trusty turtle",
+    )
+    store = ProfileStore(tmp_path / "profiles.sqlite3")
+    profile_id = await store.attach(None, "convo-1")
+    await store.save(profile_id, knowledge, confirmed_fields=[])
+
+    profile = ProfileStore(tmp_path / "profiles.sqlite3").get(convo_id="convo-1")
+
+    assert profile is not None and profile.knowledge == knowledge
+    assert profile.stale_fields() == []
+    assert profile.stale_fields(now=time.time() + 24 * 3600) == ["theme"]
+    assert "child.likes" in profile.stale_fields(now=time.time() + 45 * 24 * 3600)
+
+    # Only the most recent conversations of a family are remembered
+    with patch("profiles.MAX_CONVERSATIONS_PER_PROFILE", 2):
+        for convo_id in ("convo-2", "convo-3"):
+            assert await store.attach(profile_id, convo_id) == profile_id
+    assert store.get(profile_id).conversation_ids == ["convo-2", "convo-3"]
+    assert store.get(convo_id="convo-1") is None
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_coalesces_concurrent_lookups() -> None:
+    """
+    Concurrent lookups of the same key run the computation once, and expired entries are computed again.
+    """
+    from cache import TTLCache
+
+    cache: TTLCache[str, str] = TTLCache("test")
+    calls = 0
+
+    async def compute() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*(cache.get_or_compute("key", compute, time.time() + 60) for _ in range(5)))
+    assert results == ["result"] * 5
+    assert calls == 1
+    assert (cache.hits, cache.misses) == (4, 1)
+
+    await cache.get_or_compute("expired", compute, time.time() - 1)
+    await cache.get_or_compute("expired", compute, time.time() - 1)
+    assert calls == 3
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_keeps_computing_when_the_first_caller_is_cancelled() -> None:
+    from cache import TTLCache
+
+    cache: TTLCache[str, str] = TTLCache("test")
+
+    async def compute() -> str:
+        await asyncio.sleep(0.02)
+        return "result"
+
+    first = asyncio.create_task(cache.get_or_compute("key", compute, time.time() + 60))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(cache.get_or_compute("key", compute, time.time() + 60))
+    await asyncio.sleep(0.005)
+    first.cancel()
+
+    assert await second == "result"
+    assert first.cancelled()
+    assert cache.get("key") == "result"
+
+
+@pytest.mark.asyncio
+async def test_event_warm_up_caches_popular_queries_and_indexes_locations(monkeypatch) -> None:
+    from settings import env_settings
+    from tools import event_tool
+
+    cached, searched = [], []
+
+    async def cached_search(query):
+        cached.append(query)
+
+    async def search_events(query):
+        searched.append(query)
+
+    popular = event_tool.EventQuery(location="warsaw, poland", date="", age_band="9-12", likes=("lego",), dislikes=())
+    rare = [popular.model_copy(update={"likes": (f"hobby {i}",)}) for i in range(event_tool.WARM_UP_POPULAR_QUERIES)]
+    monkeypatch.setattr(event_tool, "popular_queries", event_tool.Counter({popular: 3, **dict.fromkeys(rare, 1)}))
+    monkeypatch.setattr(event_tool, "_cached_search", cached_search)
+    monkeypatch.setattr(event_tool, "_search_events", search_events)
+    monkeypatch.setattr(env_settings, "event_warm_up_locations", "Krakow, Poland")
+    await event_tool.warm_up_event_cache()
+
+    assert len(cached) == event_tool.WARM_UP_POPULAR_QUERIES and cached[0].likes == ("lego",)
+    # Queries asked for once are forgotten, the counter does not grow with every query ever seen
+    assert event_tool.popular_queries == event_tool.Counter({popular: 1})
+    assert len(searched) == len(event_tool.AGE_BANDS)
+    assert {query.location for query in searched} == {"krakow, poland"}
+
+
+def test_event_index_ranks_by_likes_and_drops_dislikes(tmp_path) -> None:
+    """
+    Local events are filtered by location, date and age, ranked by likes, and dislikes are excluded.
+    """
+    from models import EventModel
+    from tools.event_index import EventIndex, IndexedEvent
+    from tools.event_tool import EventQuery
+
+    index = EventIndex(tmp_path / "events.sqlite3")
+    for name, description, min_age in [
+        ("Planetarium show", "Stars and physics for kids", 6),
+        ("Football camp", "Sports and physics of the ball", 6),
+        ("Toddler physics", "Physics for the youngest", 0),
+    ]:
+        event = EventModel(name=name, description=description, justification="")
+        index.add(
+            IndexedEvent(
+                event=event,
+                location="warsaw, poland",
+                start_date="2026-10-01",
+                end_date="2026-10-31",
+                min_age=min_age,
+                max_age=min_age + 3,
+            ),
+            source="test",
+        )
+
+    query = EventQuery(
+        location="warsaw, poland", date="2026-10-20", age_band="9-12", likes=("physics",), dislikes=("sports",)
+    )
+
+    assert [event.name for event in index.search(query)] == ["Planetarium show"]
+    assert index.best_match(query.model_copy(update={"date": "2026-11-02"})) is None
+
+
+@pytest.mark.asyncio
+async def test_run_memoized_serves_repeated_runs_from_cache(tmp_path) -> None:
+    """
+    Registered agents are run once per normalized input and their structured output is rehydrated.
+    """
+    from unittest.mock import AsyncMock, MagicMock, patch
+
+    from agents import Agent
+    from pydantic import BaseModel
+
+    import memo
+
+    class Verdict(BaseModel):
+        ok: bool
+
+    agent = memo.memoize_agent(Agent(name="checker", output_type=Verdict), ttl=datetime.timedelta(days=1))
+    backend = memo.DiskMemoBackend(tmp_path / "memo.sqlite3", max_bytes=1_000_000)
+    run = AsyncMock(return_value=MagicMock(final_output=Verdict(ok=True)))
+
+    with patch("memo.Runner.run", run), patch("memo.memo_backend", backend):
+        await memo.run_memoized(agent, "Is  this fine?")
+        cached = await memo.run_memoized(agent, "Is this fine?  ")
+
+    assert run.call_count == 1
+    assert cached.final_output_as(Verdict) == Verdict(ok=True)
+    assert memo.memo_stats()["checker"]["hit_ratio"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_stub_server_answers_structured_runs_and_media_calls() -> None:
+    """
+    The local stand-in calls tools, follows the output schema and serves media endpoints.
+    """
+    import httpx
+    from agents import Agent, OpenAIResponsesModel, RunConfig, Runner, function_tool
+    from openai import AsyncOpenAI
+
+    from stub_server import StubConfig, create_app
+    from tools.onboarding_agent import OnboardingTurn
+
+    tool_calls = []
+
+    @function_tool
+    async def remember(theme: str) -> str:
+        tool_calls.append(theme)
+        return "remembered"
+
+    app = create_app(StubConfig(latency_scale=0, image_bytes=10_000, seed=1))
+    client = AsyncOpenAI(
+        api_key="stub",
+        base_url="http://stub/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=app)),
+    )
+    agent = Agent(
+        name="stub_check", output_type=OnboardingTurn, model=OpenAIResponsesModel("gpt-4o", client), tools=[remember]
+    )
+
+    result = await Runner.run(agent, "Hello", run_config=RunConfig(tracing_disabled=True))
+    image = await client.images.generate(model="gpt-image-1", prompt="A turtle")
+    transcription = await client.audio.transcriptions.create(model="gpt-4o-transcribe", file=("a.webm", b"audio"))
+
+    assert len(tool_calls) == 1
+    assert isinstance(result.final_output, OnboardingTurn)
+    assert base64.b64decode(image.data[0].b64_json).startswith(b"\x89PNG")
+    assert transcription.text
+
+
+def test_metrics_render_spans_per_stage():
+    from metrics import CONVO_STAGE_SECONDS, convo_id_var, render_metrics, span
+
+    convo_id_var.set("metrics-test")
+    with span("tts", "question"):
+        pass
+    with pytest.raises(ValueError):
+        with span("image", "edit"):
+            raise ValueError("boom")
+
+    rendered = render_metrics()
+    assert 'stage_duration_seconds_count{stage="tts",name="question"} 1' in rendered
+    assert 'stage_errors_total{stage="image",name="edit"} 1' in rendered
+    assert 'stage_in_flight{stage="tts"} 0' in rendered
+    assert set(CONVO_STAGE_SECONDS["metrics-test"]) == {"tts", "image"}
+
+
+def test_logging_samples_repetitive_lines_and_truncates_payloads():
+    import logging
+    import queue
+
+    from logs import MAX_MESSAGE_CHARS, SamplingFilter, TruncatingQueueHandler
+
+    sampler = SamplingFilter(limit=2, window=60)
+    records = [logging.LogRecord("api", logging.INFO, "", 0, "Polling %s", ("convo",), None) for _ in range(5)]
+    assert [sampler.filter(record) for record in records] == [True, True, False, False, False]
+    warning = logging.LogRecord("api", logging.WARNING, "", 0, "Polling %s", ("convo",), None)
+    assert sampler.filter(warning)
+
+    handler = TruncatingQueueHandler(queue.Queue())
+    record = logging.LogRecord("api", logging.DEBUG, "", 0, "Story: %s", ("x" * 10 * MAX_MESSAGE_CHARS,), None)
+    prepared = handler.prepare(record)
+    assert len(prepared.msg) < MAX_MESSAGE_CHARS + 100
+    assert prepared.args is None
+
+
+@pytest.mark.asyncio
+async def test_audio_answer_is_transcribed_in_memory_and_wakes_the_agent() -> None:
+    from unittest.mock import patch
+
+    import httpx
+    from openai import AsyncOpenAI
+
+    import api
+    from stub_server import StubConfig, create_app
+
+    stub_client = AsyncOpenAI(
+        api_key="stub",
+        base_url="http://stub/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(StubConfig(latency_scale=0)))),
+    )
+    api.CONVO_DB["upload-test"] = api.Conversation(messages_to_user=[], messages_to_agent=[])
+    waiting = asyncio.create_task(api.wait_for_user_message("upload-test"))
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+        with patch("api.openai_client", stub_client):
+            response = await client.post("/message/audio/upload-test", files={"audio": ("a.webm", b"audio")})
+        with patch("api.MAX_AUDIO_UPLOAD_BYTES", 10):
+            too_large = await client.post("/message/audio/upload-test", files={"audio": ("a.webm", bytes(100))})
+        no_audio = await client.post("/message/audio/upload-test", files={"note": ("a.txt", b"hello")})
+
+    assert response.status_code == 200
+    assert await asyncio.wait_for(waiting, timeout=1) == response.json()["transcription"]
+    assert too_large.status_code == 413
+    assert no_audio.status_code == 422
+    del api.CONVO_DB["upload-test"]
+
+
+@pytest.mark.asyncio
+async def test_voice_session_finalizes_utterance_after_silence() -> None:
+    import math
+    from array import array
+
+    from voice import END_SILENCE_MS, SAMPLE_RATE, StubTranscriber, VoiceSession
+
+    def tone(ms: int, amplitude: int) -> bytes:
+        samples = SAMPLE_RATE * ms // 1000
+        return array("h", (int(amplitude * math.sin(i / 5)) for i in range(samples))).tobytes()
+
+    sent, finals = [], []
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    session = VoiceSession(StubTranscriber(), send, finals.append)
+    # Chunk boundaries do not line up with the detector's frames
+    audio = tone(300, 0) + tone(2500, 8000) + tone(END_SILENCE_MS + 100, 0)
+    for start in range(0, len(audio), 1234):
+        await session.feed(audio[start : start + 1234])
+        # Let partial transcriptions run, as waiting for the next WebSocket message would
+        await asyncio.sleep(0)
+
+    assert len(finals) == 1
+    # The utterance spans the speech, the pre-roll before it and the silence that ended it
+    assert 2500 <= int(finals[0].split()[0]) <= 2500 + 200 + END_SILENCE_MS + 20
+    assert sent[-1] == {"type": "final", "text": finals[0]}
+    assert any(message["type"] == "partial" for message in sent)
+
+
+@pytest.mark.asyncio
+async def test_audio_conversion_shrinks_or_falls_back_to_the_original() -> None:
+    from unittest.mock import patch
+
+    import convert_mp3
+    from voice import SAMPLE_RATE, pcm_to_wav
+
+    wav = pcm_to_wav(bytes(SAMPLE_RATE * 2 * 3), SAMPLE_RATE)
+    with patch("convert_mp3.ffmpeg_available", return_value=False):
+        upload = await convert_mp3.prepare_for_transcription(wav, "a.wav", None)
+        assert upload == ("a.wav", wav, "application/octet-stream")
+        assert await convert_mp3.encode_for_delivery(wav) == wav
+
+    if convert_mp3.ffmpeg_available():
+        assert len(await convert_mp3.encode_for_delivery(wav)) < len(wav) / 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_conversion_kills_ffmpeg() -> None:
+    import sys
+    from unittest.mock import patch
+
+    import convert_mp3
+
+    processes = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def slow_ffmpeg(*args, **kwargs):
+        processes.append(await create_subprocess_exec(sys.executable, "-c", "import time; time.sleep(30)", **kwargs))
+        return processes[-1]
+
+    with patch("convert_mp3.asyncio.create_subprocess_exec", slow_ffmpeg):
+        conversion = asyncio.create_task(convert_mp3.run_ffmpeg(b"audio", [], "mp3"))
+        await asyncio.sleep(0.2)
+        conversion.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await conversion
+
+    assert processes[0].returncode is not None
+
+
+def test_narration_offsets_are_contiguous() -> None:
+    from audio import narration_offsets
+
+    scenes = narration_offsets([1.5, 2.25, 0.5])
+
+    assert [(scene.start, scene.end) for scene in scenes] == [(0.0, 1.5), (1.5, 3.75), (3.75, 4.25)]
+
+
+def test_split_sentences_merges_short_ones() -> None:
+    from audio import split_sentences
+
+    text = "Hi! What is your name? And how old is your child, and what do they like to do in the evening?"
+
+    assert split_sentences(text, min_chars=20) == [
+        "Hi! What is your name?",
+        "And how old is your child, and what do they like to do in the evening?",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_spoken_question_is_streamed_sentence_by_sentence() -> None:
+    from unittest.mock import patch
+
+    import httpx
+    from openai import AsyncOpenAI
+
+    import api
+    from stub_server import StubConfig, create_app
+
+    stub_client = AsyncOpenAI(
+        api_key="stub",
+        base_url="http://stub/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(StubConfig(latency_scale=0)))),
+    )
+    api.CONVO_DB["speech-test"] = api.Conversation(messages_to_user=[], messages_to_agent=[])
+    with patch("api.openai_client", stub_client), patch("api.env_settings.run_in_cli", False):
+        api.post_message(
+            "speech-test",
+            api.AudioMessageToUser(audio_message="Tell me about your family. What does your child like to do?"),
+        )
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://api") as client:
+        state = (await client.get("/state/speech-test")).json()
+        speech = await client.get(state["audio_url"])
+
+    assert state["type"] == "audio"
+    assert speech.headers["content-type"] == "audio/mpeg"
+    assert len(speech.content) > 0
+    del api.CONVO_DB["speech-test"]
+
+
+@pytest.mark.asyncio
+async def test_speech_keeps_synthesizing_when_a_listener_goes_away() -> None:
+    from unittest.mock import patch
+
+    import audio
+
+    text = " ".join(f"Sentence number {i} of the question is long enough to be spoken on its own." for i in range(3))
+    first, *rest = audio.split_sentences(text)
+    later_sentences = asyncio.Event()
+
+    async def synthesize(client, chunk: str, name: str = "chunk") -> bytes:
+        if chunk != first:
+            await later_sentences.wait()
+        return chunk.encode()
+
+    async def listen(speech: audio.SpeechStream) -> list[bytes]:
+        return [chunk async for chunk in speech.iter_chunks(deliver=False)]
+
+    with patch("audio.synthesize_speech", synthesize):
+        speech = audio.SpeechStream(None, text)
+        listener = speech.iter_chunks(deliver=False)
+        assert await anext(listener) == first.encode()
+        await listener.aclose()
+        # A listener cancelled while it waits for a sentence, e.g. a request whose client disconnected
+        waiting = asyncio.create_task(listen(speech))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        later_sentences.set()
+        assert await listen(speech) == [first.encode(), *(sentence.encode() for sentence in rest)]
+        assert await speech.read(deliver=False) == "".join([first, *rest]).encode()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_puts_interactive_first_and_shares_fairly() -> None:
+    from metrics import convo_id_var
+    from scheduler import Priority, PriorityScheduler
+
+    scheduler = PriorityScheduler("test", capacity=2, interactive_reserve=0.5)
+    started = []
+
+    async def call(convo_id: str, name: str, priority: Priority, hold: asyncio.Event) -> None:
+        convo_id_var.set(convo_id)
+        async with scheduler.slot(priority):
+            started.append(name)
+            await hold.wait()
+
+    hold, done = asyncio.Event(), asyncio.Event()
+    done.set()
+    first = asyncio.create_task(call("a", "a1", Priority.BACKGROUND, hold))
+    await asyncio.sleep(0)
+    queued = [
+        asyncio.create_task(call(convo_id, name, Priority.BACKGROUND, done))
+        for convo_id, name in [("a", "a2"), ("a", "a3"), ("b", "b1")]
+    ]
+    await asyncio.sleep(0)
+    # The reserved slot lets the interactive call start while background calls are queued
+    await asyncio.wait_for(call("c", "c1", Priority.INTERACTIVE, done), timeout=1)
+    assert started == ["a1", "c1"]
+
+    hold.set()
+    await asyncio.gather(first, *queued)
+    assert started[2:] == ["a2", "b1", "a3"]
+
+
+@pytest.mark.asyncio
+async def test_route_call_falls_back_on_server_errors() -> None:
+    import httpx
+    import openai
+
+    import routing
+
+    routing.ROUTES["test_route"] = routing.Route(("broken-model", "good-model"), slo_seconds=1)
+    calls = []
+
+    async def call(model: str) -> str:
+        calls.append(model)
+        if model == "broken-model":
+            request = httpx.Request("POST", "http://stub/v1/responses")
+            raise openai.InternalServerError("boom", response=httpx.Response(500, request=request), body=None)
+        return f"answer from {model}"
+
+    assert await routing.route_call("test_route", call) == "answer from good-model"
+    # The failing model is cooling down, so the next call goes straight to the fallback
+    assert await routing.route_call("test_route", call) == "answer from good-model"
+    assert calls == ["broken-model", "good-model", "good-model"]
+    assert [decision["outcome"] for decision in list(routing.DECISIONS)[-3:]] == ["InternalServerError", "ok", "ok"]
+    # A server error means the model is down, other routes skip it too
+    routing.ROUTES["other_route"] = routing.Route(("broken-model", "good-model"), slo_seconds=1)
+    assert routing.choose_candidates("other_route") == ["good-model", "broken-model"]
+    del routing.ROUTES["test_route"], routing.ROUTES["other_route"]
+
+
+@pytest.mark.asyncio
+async def test_route_timeouts_do_not_open_the_provider_circuit() -> None:
+    from unittest.mock import patch
+
+    import routing
+    from circuit import circuit_breaker
+
+    routing.ROUTES["timeout_route"] = routing.Route(("slow-model",), slo_seconds=0.01)
+    breaker = circuit_breaker("openai_text")
+    failures = breaker.failures
+
+    with patch("routing.HARD_TIMEOUT_FACTOR", 5), pytest.raises(TimeoutError):
+        await routing.route_call("timeout_route", lambda model: asyncio.sleep(1))
+    # Too slow for this route, which is no reason to stop other routes from calling the provider
+    assert breaker.failures == failures
+    del routing.ROUTES["timeout_route"]
+
+
+@pytest.mark.asyncio
+async def test_route_stats_are_kept_per_route() -> None:
+    from unittest.mock import patch
+
+    import routing
+
+    routing.ROUTES["slow_route"] = routing.Route(("shared-model", "other-model"), slo_seconds=30)
+    routing.ROUTES["fast_route"] = routing.Route(("shared-model", "other-model"), slo_seconds=2)
+    # A story taking 20 s is fine for its own route, and says nothing about short checker calls
+    with patch("routing.time.perf_counter", side_effect=[0.0, 20.0]):
+        await routing.route_call("slow_route", lambda model: asyncio.sleep(0, model))
+    assert routing.choose_candidates("fast_route") == ["shared-model", "other-model"]
+
+    routing.ROUTES["fast_route"] = routing.Route(("breached-model", "other-model"), slo_seconds=2)
+    with patch("routing.time.perf_counter", side_effect=[0.0, 5.0]):
+        await routing.route_call("fast_route", lambda model: asyncio.sleep(0, model))
+    routing.ROUTES["slow_route"] = routing.Route(("breached-model", "other-model"), slo_seconds=30)
+    assert routing.choose_candidates("fast_route") == ["other-model", "breached-model"]
+    assert routing.choose_candidates("slow_route") == ["breached-model", "other-model"]
+    del routing.ROUTES["slow_route"], routing.ROUTES["fast_route"]
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_takes_the_faster_duplicate() -> None:
+    import hedging
+
+    tracker = hedging._TRACKERS.setdefault("test_endpoint", hedging.LatencyTracker())
+    for _ in range(hedging.MIN_SAMPLES):
+        tracker.record(0.01)
+    hedging.hedge_budget.tokens = 1.0
+    started, cancelled = [], []
+
+    async def call() -> str:
+        attempt = len(started)
+        started.append(attempt)
+        try:
+            await asyncio.sleep(10 if attempt == 0 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return f"attempt {attempt}"
+
+    assert await asyncio.wait_for(hedging.hedged("test_endpoint", call), timeout=1) == "attempt 1"
+    await asyncio.sleep(0)
+    assert cancelled == [0]
+    # The budget is spent, so the next slow call is not duplicated
+    started.clear()
+    with pytest.raises(TimeoutError):
+        await asyncio.wait_for(hedging.hedged("test_endpoint", call), timeout=0.1)
+    assert started == [0]
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_while_open_and_probes_to_close() -> None:
+    from circuit import CircuitBreaker, CircuitOpenError, CircuitState
+
+    breaker = CircuitBreaker("test_provider", failure_threshold=2, reset_seconds=0.05)
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            async with breaker.guard():
+                raise TimeoutError
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError):
+        async with breaker.guard():
+            pytest.fail("An open circuit does not run the call")
+
+    await asyncio.sleep(0.05)
+    assert breaker.state == CircuitState.HALF_OPEN
+    async with breaker.guard():
+        # Only one probe goes through while half-open
+        with pytest.raises(CircuitOpenError):
+            async with breaker.guard():
+                pass
+    assert breaker.state == CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_gather_until_returns_what_finished_by_the_deadline() -> None:
+    import time
+
+    from deadline import finished_prefix, gather_until, quality_for
+
+    async def scene(seconds: float, name: str) -> str:
+        await asyncio.sleep(seconds)
+        return name
+
+    results = await gather_until(time.time() + 0.1, scene(0, "a"), scene(0.01, "b"), scene(5, "c"), scene(0, "d"))
+    assert results == ["a", "b", None, "d"]
+    # A gap ends the story, the scene after it would not make sense on its own
+    assert finished_prefix(results) == ["a", "b"]
+
+    assert quality_for(None).video
+    assert quality_for(time.time() + 120).max_scenes < quality_for(time.time() + 3600).max_scenes
+    assert not quality_for(time.time() - 10).video
+
+
+@pytest.mark.asyncio
+async def test_videos_finished_by_the_deadline_are_kept() -> None:
+    from pathlib import Path
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock, patch
+
+    import video
+
+    statuses = {"done": "SUCCEEDED", "broken": "FAILED", "slow": "RUNNING"}
+    client = SimpleNamespace(
+        tasks=SimpleNamespace(
+            retrieve=AsyncMock(
+                side_effect=lambda id: SimpleNamespace(status=statuses[id], output=[f"http://videos/{id}.mp4"])
+            )
+        )
+    )
+    task_ids = iter(statuses)
+    with (
+        patch("video.get_client_runway", return_value=client),
+        patch("video.generate_video", AsyncMock(side_effect=lambda image, client: next(task_ids))),
+        patch("video.POLL_SECONDS", 0.01),
+    ):
+        videos = await video.generate_videos([Path(__file__)] * 3, max_wait=0.1)
+
+    # The failed video is not polled until the deadline
+    assert videos == ["http://videos/done.mp4", None, None]
+    assert [call.kwargs["id"] for call in client.tasks.retrieve.call_args_list].count("broken") == 1
+
+
+@pytest.mark.asyncio
+async def test_plan_runs_story_lesson_and_events_concurrently() -> None:
+    from types import SimpleNamespace
+    from unittest.mock import patch
+
+    import api
+    import main_agent
+    from models import ConvoInfo
+    from tools.storytime_agent import StoryOutput
+
+    async def branch(result):
+        await asyncio.sleep(0.2)
+        return result
+
+    async def write_plan(agent, input, context):
+        return SimpleNamespace(final_output=main_agent.PlanSummary(reasoning="why", plan_for_evening="plan"))
+
+    knowledge = Knowledge(
+        address=Address(country="Poland", city="Warsaw"),
+        parent=PersonEntry(name="Helena", age=40, likes=["museums"], dislikes=[]),
+        child=PersonEntry(name="Mark", age=10, likes=["physics"], dislikes=[]),
+        theme="A turtle in space",
+    )
+    api.CONVO_DB["plan-test"] = api.Conversation(
+        messages_to_user=[], messages_to_agent=[], final_output={"story_images": {"image_paths": ["img_0.png"]}}
+    )
+    with (
+        patch("main_agent._get_story", lambda *args: branch(StoryOutput(story="Once upon a time", theme="space"))),
+        patch("main_agent._generate_lesson", lambda request, knowledge: branch("Lesson")),
+        patch("main_agent._find_events_for_child", lambda knowledge: branch(None)),
+        patch("main_agent.Runner.run", write_plan),
+    ):
+        start = time.perf_counter()
+        plan = await main_agent.run_plan(ConvoInfo(convo_id="plan-test"), knowledge)
+
+    assert time.perf_counter() - start < 0.5
+    assert (plan.story, plan.lesson, plan.plan_for_evening) == ("Once upon a time", "Lesson", "plan")
+    assert plan.story_image_paths == ["img_0.png"]
+    del api.CONVO_DB["plan-test"]
+
+
+@pytest.mark.asyncio
+async def test_output_sections_are_sent_before_the_final_output() -> None:
+    import api
+
+    api.CONVO_DB["partial-test"] = api.Conversation(messages_to_user=[], messages_to_agent=[])
+    api.add_to_output("partial-test", "story", "Once upon a time")
+    api.publish_section("partial-test", "story_hero_image", "static/sample_images/img_0.png")
+    api.post_message("partial-test", api.OutputMessageToUser(final_output={"story": "Once upon a time"}))
+    api.post_message("partial-test", api.CompleteMessageToUser())
+
+    partial = await api.get_state("partial-test")
+    assert partial["type"] == "partial"
+    assert partial["sections"] == {"story": "Once upon a time", "story_hero_image": "static/sample_images/img_0.png"}
+    assert (await api.get_state("partial-test"))["type"] == "output"
+    assert await api.get_state("partial-test") == {"type": "complete"}
+    assert await api.get_state("partial-test") is None
+    del api.CONVO_DB["partial-test"]
+
+
+def test_idle_conversations_are_spilled_and_loaded_back(tmp_path) -> None:
+    import api
+    from convo_store import ConversationStore, SpillStore
+
+    store = ConversationStore(api.Conversation, SpillStore(tmp_path / "conversations.sqlite3"), {"messages_to_user"})
+    store["family"] = api.Conversation(
+        story_history=["Once upon a time"], messages_to_user=[api.CompleteMessageToUser()]
+    )
+    store.spill_cold("family", "story_history", ["An older scene"])
+
+    assert store.idle(ttl_seconds=3600) == []
+    assert store.idle(ttl_seconds=-1) == ["family"]
+    store.evict("family")
+    assert len(store) == 0
+    assert store.footprint()["spilled_conversations"] == 1
+
+    restored = store["family"]
+    assert restored.story_history == ["Once upon a time"]
+    assert restored.messages_to_user == []
+    assert store.footprint()["conversations"]["family"]["disk_bytes"] > 0
+    assert store.footprint()["spilled_conversations"] == 0
+    with pytest.raises(KeyError):
+        store["unknown"]
+
+
+def test_spilled_items_are_read_back_and_deleted_with_the_conversation(tmp_path) -> None:
+    import api
+    from convo_store import ConversationStore, SpillStore
+    from models import FinalOutput, Knowledge
+
+    def plan(evening: int) -> FinalOutput:
+        return FinalOutput(
+            story=f"Story {evening}",
+            story_image_paths=[],
+            lesson="",
+            reasoning="",
+            plan_for_evening=f"Evening {evening}",
+            knowledge=Knowledge(),
+            event=None,
+        )
+
+    store = ConversationStore(api.Conversation, SpillStore(tmp_path / "conversations.sqlite3"), set())
+    store["family"] = api.Conversation(outputs=[plan(3)], story_history=["Scene 3"])
+    store.spill_cold("family", "outputs", [plan(1)])
+    store.spill_cold("family", "outputs", [plan(2)])
+    store.spill_cold("family", "story_history", ["Scene 1", "Scene 2"])
+    store.evict("family")
+
+    assert [output.story for output in store.full("family", "outputs")] == ["Story 1", "Story 2", "Story 3"]
+    assert store.full("family", "story_history") == ["Scene 1", "Scene 2", "Scene 3"]
+
+    del store["family"]
+    assert store.spill.sizes() == {}
+    assert store.footprint()["spilled_conversations"] == 0
+    # A new conversation with the same ID starts without the old cold items
+    store["family"] = api.Conversation()
+    assert store.full("family", "outputs") == []
+
+
+# Any change to a prompt prefix starts every cached prefix over, update these on purpose
+PROMPT_PREFIX_SHA256 = {
+    "story": "2fd6b4f992a2a622",
+    "storyboard": "8f9e2272a95bc6a8",
+    "interactive_turn": "75e03e75f7ac39ba",
+}
+
+
+def test_prompt_templates_keep_a_static_prefix() -> None:
+    import hashlib
+
+    from prompts import TEMPLATES, PromptTemplate
+
+    prefix_hashes = {
+        name: hashlib.sha256(template.prefix.encode()).hexdigest()[:16] for name, template in TEMPLATES.items()
+    }
+    assert prefix_hashes == PROMPT_PREFIX_SHA256
+    for template in TEMPLATES.values():
+        assert template.prefix and template.prefix_fields() == []
+        first = template.render(**{field: f"first {field}" for field in template.suffix_fields()})
+        second = template.render(**{field: f"second {field} " * 50 for field in template.suffix_fields()})
+        assert first.startswith(template.prefix) and second.startswith(template.prefix)
+    with pytest.raises(ValueError):
+        PromptTemplate(name="unstable", prefix="Write about {theme}.", suffix="")
+
+
+def test_cached_prompt_tokens_are_counted_per_agent() -> None:
+    from types import SimpleNamespace
+
+    from agents.tracing import agent_span, response_span, trace
+
+    from metrics import prompt_cache_stats
+
+    usage = SimpleNamespace(input_tokens=2000, input_tokens_details=SimpleNamespace(cached_tokens=1536))
+    with trace("prompt-cache-test"), agent_span(name="cache_test_agent"):
+        with response_span() as response:
+            response.span_data.response = SimpleNamespace(model="gpt-4o", usage=usage)
+
+    assert prompt_cache_stats()["cache_test_agent"] == {
+        "input_tokens": 2000,
+        "cached_tokens": 1536,
+        "hit_ratio": 0.768,
+    }
+
+
+@pytest.mark.asyncio
+async def test_story_catalog_builds_missing_bundles_and_serves_them(tmp_path, monkeypatch) -> None:
+    from audio import NarrationOutput
+    from images import StoryImageOutput
+    from settings import env_settings
+    from tools import story_catalog
+    from tools.storyboard_agent import StoryboardOutput
+
+    running, most_running = 0, 0
+
+    async def build_bundle(theme: str, low: int, high: int) -> story_catalog.StoryBundle:
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return story_catalog.StoryBundle(
+            theme=theme,
+            age_band=f"{low}-{high}",
+            story=f"A tale about {theme} and a cat.",
+            storyboard=StoryboardOutput(images=["a mouse"], narration=["Once"], main_character_description="mouse"),
+            images=StoryImageOutput(image_paths=["static/hero.png", "static/scene.png"]),
+            narration=NarrationOutput(scene_paths=["static/scene.mp3"]),
+        )
+
+    catalog = story_catalog.StoryCatalog(tmp_path / "catalog.sqlite3")
+    monkeypatch.setattr(story_catalog, "build_bundle", build_bundle)
+    monkeypatch.setattr(env_settings, "story_catalog_themes", "A brave little mouse; dinosaurs")
+    assert await story_catalog.build_catalog(catalog) == 2 * len(story_catalog.AGE_BANDS)
+    assert most_running == story_catalog.BUILD_CONCURRENCY
+    assert await story_catalog.build_catalog(catalog) == 0
+
+    child = PersonEntry(name="Ala", age=4, likes=[], dislikes=[])
+    bundle = catalog.find("a courageous small mouse", Knowledge(child=child))
+    assert bundle is not None and bundle.age_band == "3-5"
+    assert story_catalog.personalize(bundle, Knowledge(child=child)).story.startswith("A story for Ala\n\n")
+    assert catalog.find("a brave little mouse", Knowledge(child=child.model_copy(update={"age": 15}))) is None
+    assert catalog.find("dinosaurs", Knowledge(child=child.model_copy(update={"dislikes": ["Cat"]}))) is None
+
+
+@pytest.mark.asyncio
+async def test_lessons_are_reused_for_the_same_theme_only(tmp_path) -> None:
+    from types import SimpleNamespace
+    from unittest.mock import patch
+
+    from models import Knowledge, PersonEntry
+    from similarity import SimilarityIndex
+    from tools import generate_lesson_tool
+
+    likes = "dinosaurs trains lego drawing swimming football painting".split()
+    inputs = []
+
+    async def run_memoized(agent, input):
+        inputs.append(input)
+        return SimpleNamespace(final_output=f"Lesson for {input}")
+
+    def knowledge(theme: str) -> Knowledge:
+        return Knowledge(child=PersonEntry(name="Mia", age=5, likes=likes, dislikes=[]), theme=theme)
+
+    with (
+        patch("tools.generate_lesson_tool.run_memoized", run_memoized),
+        patch("tools.generate_lesson_tool.lesson_index", SimilarityIndex("lessons", tmp_path / "s.sqlite3")),
+    ):
+        await generate_lesson_tool._generate_lesson("Dinosaurs", knowledge("dinosaurs"))
+        await generate_lesson_tool._generate_lesson("Dinos!", knowledge("dinos"))
+        # The likes are the same, but they must not make different themes look alike
+        await generate_lesson_tool._generate_lesson("Volcanoes", knowledge("volcanoes"))
+        await generate_lesson_tool._generate_lesson("Space", knowledge("space"))
+        await generate_lesson_tool._generate_lesson("Sea", knowledge("sea"))
+
+    assert inputs == ["Dinosaurs", "Dinosaurs", "Volcanoes", "Space", "Sea"]
+
+
+def test_similarity_index_finds_rephrased_themes_and_persists(tmp_path) -> None:
+    from similarity import SimilarityIndex
+
+    index = SimilarityIndex("themes", tmp_path / "similarity.sqlite3", threshold=0.8)
+    index.add("mouse", "A brave little mouse", scope="3-5")
+    index.add("dinosaurs", "Dinosaurs", scope="3-5")
+    index.add("expired", "A brave little mouse", scope="6-8", expires_at=time.time() - 1)
+
+    assert index.nearest("a courageous small mouse", scope="3-5") == "mouse"
+    assert index.nearest("dinos", scope="3-5") == "dinosaurs"
+    assert index.nearest("a brave little cat", scope="3-5") is None
+    assert index.nearest("a brave little mouse", scope="6-8") is None
+
+    reloaded = SimilarityIndex("themes", tmp_path / "similarity.sqlite3", threshold=0.8)
+    assert len(reloaded) == 2
+    assert reloaded.nearest("Brave tiny mice!", scope="3-5") == "mouse"
@@ -0,0 +1,170 @@
+"""
+Local catalog of events, stored in SQLite with an FTS5 index over names, descriptions and tags.
+
+It is filled with the results of previous web searches and with curated feeds, and is consulted
+before any live web search. To ingest a curated feed (one JSON object per line), run:
+
+```bash
+python -m tools.event_index feed.jsonl
+```
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from metrics import record_cache
+from models import EventModel
+from settings import env_settings
+
+if TYPE_CHECKING:
+    from tools.event_tool import EventQuery
+
+# Fewer matching local events than this means the local recall is too low and the web is searched
+MIN_LOCAL_MATCHES = 1
+MAX_CANDIDATES = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    location TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    min_age INTEGER NOT NULL,
+    max_age INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    event_json TEXT NOT NULL,
+    UNIQUE (location, start_date, name)
+);
+CREATE INDEX IF NOT EXISTS events_lookup ON events (location, start_date, end_date);
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5 (name, description, tags);
+"""
+
+
+class IndexedEvent(BaseModel):
+    """An event together with when, where and for whom it is happening."""
+
+    event: EventModel
+    location: str
+    start_date: str
+    end_date: str
+    min_age: int = 0
+    max_age: int = 17
+    tags: list[str] = []
+
+
+class EventIndex:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Queries take well under a millisecond, so the connection is used directly from the event loop
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def add(self, indexed: IndexedEvent, source: str) -> bool:
+        """Insert an event, returns False if the same event is already indexed."""
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO events (location, start_date, end_date, min_age, max_age, name, source, event_json)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    indexed.location.lower(),
+                    indexed.start_date,
+                    indexed.end_date,
+                    indexed.min_age,
+                    indexed.max_age,
+                    indexed.event.name,
+                    source,
+                    indexed.event.model_dump_json(),
+                ),
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._db.execute(
+                "INSERT INTO events_fts (rowid, name, description, tags) VALUES (?, ?, ?, ?)",
+                (cursor.lastrowid, indexed.event.name, indexed.event.description, " ".join(indexed.tags)),
+            )
+        return True
+
+    def add_search_result(self, event: EventModel, query: EventQuery) -> None:
+        min_age, max_age = query.age_range
+        self.add(
+            IndexedEvent(
+                event=event,
+                location=query.location,
+                start_date=query.date,
+                end_date=query.date,
+                min_age=min_age,
+                max_age=max_age,
+                tags=list(query.likes),
+            ),
+            source="web_search",
+        )
+
+    def search(self, query: EventQuery) -> list[EventModel]:
+        """
+        Events happening at the query's location and date that suit the child's age band.
+
+        Events matching the family's likes are ranked with BM25, and events matching their dislikes are dropped.
+        """
+        min_age, max_age = query.age_range
+        filters = "e.location = ? AND e.start_date <= ? AND e.end_date >= ? AND e.min_age <= ? AND e.max_age >= ?"
+        params: list = [query.location, query.date, query.date, max_age, min_age]
+
+        match = " OR ".join(_fts_term(like) for like in query.likes)
+        if match and query.dislikes:
+            match = f"({match}) NOT ({' OR '.join(_fts_term(dislike) for dislike in query.dislikes)})"
+        if match:
+            rows = self._db.execute(
+                "SELECT e.event_json FROM events_fts JOIN events e ON e.id = events_fts.rowid"
+                f" WHERE events_fts MATCH ? AND {filters} ORDER BY bm25(events_fts) LIMIT ?",
+                [match, *params, MAX_CANDIDATES],
+            ).fetchall()
+        else:
+            rows = self._db.execute(
+                f"SELECT e.event_json FROM events e WHERE {filters} LIMIT ?", [*params, MAX_CANDIDATES]
+            ).fetchall()
+        events = [EventModel.model_validate_json(row[0]) for row in rows]
+        if not match and query.dislikes:
+            events = [event for event in events if not _mentions_any(event, query.dislikes)]
+        return events
+
+    def best_match(self, query: EventQuery) -> EventModel | None:
+        """Best local event, or None when local recall is too low and the web should be searched instead."""
+        events = self.search(query)
+        record_cache("event_index", hit=len(events) >= MIN_LOCAL_MATCHES)
+        if len(events) < MIN_LOCAL_MATCHES:
+            return None
+        return events[0]
+
+    def ingest_feed(self, path: Path) -> int:
+        """Ingest a curated feed with one `IndexedEvent` JSON object per line. Returns the number of new events."""
+        added = 0
+        for line in path.read_text().splitlines():
+            if line.strip():
+                added += self.add(IndexedEvent.model_validate_json(line), source=f"feed:{path.name}")
+        return added
+
+
+def _fts_term(term: str) -> str:
+    # Quote every term so that user provided text can never be parsed as FTS5 query syntax
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _mentions_any(event: EventModel, words: tuple[str, ...]) -> bool:
+    text = f"{event.name} {event.description}".lower()
+    return any(word in text for word in words)
+
+
+event_index = EventIndex(Path(env_settings.event_index_path))
+
+
+if __name__ == "__main__":
+    for feed in sys.argv[1:]:
+        print(f"Ingested {event_index.ingest_feed(Path(feed))} new events from {feed}")
@@ -1,59 +1,220 @@
 import asyncio
 import datetime
+from collections import Counter
+from typing import Awaitable, Callable
 
-from agents import function_tool
-from pydantic import BaseModel
+from agents import RunContextWrapper, function_tool
+from pydantic import BaseModel, ConfigDict
 
-from settings import openai_client
-from models import Knowledge, EventModel
+from cache import TTLCache
+from logs import get_logger
+from settings import env_settings, openai_client
+from similarity import SimilarityIndex
+from tools.event_index import event_index
+from models import ConvoInfo, Knowledge, EventModel, Address, PersonEntry
+from routing import route_call
+
+AGE_BANDS = [(0, 2), (3, 5), (6, 8), (9, 12), (13, 17)]
+WARM_UP_CONCURRENCY = 4
+WARM_UP_POPULAR_QUERIES = 20
+
+logger = get_logger(__name__)
+
+
+class EventQuery(BaseModel):
+    """Everything the event search depends on, normalized so that similar families share results."""
+
+    model_config = ConfigDict(frozen=True)
+
+    location: str
+    date: str
+    age_band: str
+    likes: tuple[str, ...]
+    dislikes: tuple[str, ...]
+
+    @classmethod
+    def from_knowledge(cls, knowledge: Knowledge, date: datetime.date) -> "EventQuery":
+        # Collect likes and dislikes safely, handling potential None values and empty lists
+        child_likes = knowledge.child.likes if knowledge.child and knowledge.child.likes else []
+        parent_likes = knowledge.parent.likes if knowledge.parent and knowledge.parent.likes else []
+        child_dislikes = knowledge.child.dislikes if knowledge.child and knowledge.child.dislikes else []
+        parent_dislikes = knowledge.parent.dislikes if knowledge.parent and knowledge.parent.dislikes else []
+        return cls(
+            location=_normalize_location(knowledge.address),
+            date=date.strftime("%Y-%m-%d"),
+            age_band=_age_band(knowledge.child.age if knowledge.child else None),
+            likes=_normalize_interests(child_likes + parent_likes),
+            dislikes=_normalize_interests(child_dislikes + parent_dislikes),
+        )
+
+    @property
+    def age_range(self) -> tuple[int, int]:
+        if self.age_band in {f"{low}-{high}" for low, high in AGE_BANDS}:
+            low, high = self.age_band.split("-")
+            return int(low), int(high)
+        return AGE_BANDS[0][0], AGE_BANDS[-1][1]
+
+    def to_prompt(self) -> str:
+        query = f"What events are happening on {self.date} in {self.location} suitable for a {self.age_band}-year-old child?"
+        # Append interests to query if they exist
+        if self.likes:
+            query += f" The child and parents are interested in topics like: {', '.join(self.likes)}."
+        # Append dislikes to query if they exist
+        if self.dislikes:
+            query += f" Please avoid events related to topics like: {', '.join(self.dislikes)}."
+        return query
+
+
+event_cache: TTLCache[EventQuery, EventModel] = TTLCache("events")
+# How often each query (without its date) was asked for, used to warm up the cache for the next day
+popular_queries: Counter[EventQuery] = Counter()
+# Queries searched for today, by their likes
+event_query_index = SimilarityIndex("event_queries", env_settings.similarity_index_path)
 
 
 @function_tool
-async def find_events_for_child(knowledge: Knowledge) -> EventModel | None:
+async def find_events_for_child(wrapper: RunContextWrapper[ConvoInfo], knowledge: Knowledge) -> EventModel | None:
     """
     Searches for events happening tomorrow suitable for a child of a given age,
     optionally filtered by location, using OpenAI's web search tool, considering interests and dislikes.
     """
-    tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-    # Construct the detailed query based on knowledge
-    base_query = f"What events are happening on {tomorrow} in {knowledge.address} suitable for a {knowledge.child.age}-year-old child?"
+    from api import add_to_output
+
+    event = await _find_events_for_child(knowledge)
+    add_to_output(wrapper.context.convo_id, "event", event.model_dump() if event is not None else None)
+    return event
+
 
-    # Collect likes and dislikes safely, handling potential None values and empty lists
-    child_likes = knowledge.child.likes if knowledge.child and knowledge.child.likes else []
-    parent_likes = knowledge.parent.likes if knowledge.parent and knowledge.parent.likes else []
-    all_likes = list(set(child_likes + parent_likes))  # Use set to remove duplicates
+async def _find_events_for_child(knowledge: Knowledge) -> EventModel | None:
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    query = EventQuery.from_knowledge(knowledge, tomorrow)
+    popular_queries[query.model_copy(update={"date": ""})] += 1
+    query = _similar_query(query)
 
-    child_dislikes = knowledge.child.dislikes if knowledge.child and knowledge.child.dislikes else []
-    parent_dislikes = knowledge.parent.dislikes if knowledge.parent and knowledge.parent.dislikes else []
-    all_dislikes = list(set(child_dislikes + parent_dislikes))  # Use set to remove duplicates
+    # The local catalog answers most requests in milliseconds, the web is only searched when it has nothing
+    local_event = event_index.best_match(query)
+    if local_event is not None:
+        return local_event
+    return await _cached_search(query)
 
-    # Append interests to query if they exist
-    if all_likes:
-        likes_str = ", ".join(all_likes)
-        base_query += f" The child and parents are interested in topics like: {likes_str}."
 
-    # Append dislikes to query if they exist
-    if all_dislikes:
-        dislikes_str = ", ".join(all_dislikes)
-        base_query += f" Please avoid events related to topics like: {dislikes_str}."
+def _similar_query(query: EventQuery) -> EventQuery:
+    """
+    An earlier query for the same place, day, age band and dislikes whose likes are near-identical,
+    e.g. "dinos, legos" for "lego, dinosaurs", so that both are answered by the same search.
+    """
+    if not query.likes:
+        return query
+    scope = "|".join([query.location, query.date, query.age_band, *query.dislikes])
+    similar = event_query_index.nearest(" ".join(query.likes), scope=scope)
+    if similar is not None:
+        return EventQuery.model_validate_json(similar)
+    event_query_index.add(query.model_dump_json(), " ".join(query.likes), scope=scope, expires_at=_next_midnight())
+    return query
+
 
-    query = base_query  # Final query string
+async def _cached_search(query: EventQuery) -> EventModel | None:
+    # Results are only valid for "tomorrow", which changes at midnight
+    return await event_cache.get_or_compute(query, lambda: _search_events(query), expires_at=_next_midnight())
 
+
+async def _search_events(query: EventQuery) -> EventModel | None:
     try:
-        search_results = await openai_client.responses.parse(
-            model="gpt-4.1",
-            tools=[{"type": "web_search_preview"}],
-            input=query,
-            text_format=EventModel,
+        search_results = await route_call(
+            "event_search",
+            lambda model: openai_client.responses.parse(
+                model=model,
+                tools=[{"type": "web_search_preview"}],
+                input=query.to_prompt(),
+                text_format=EventModel,
+            ),
         )
+        if search_results.output_parsed is not None:
+            event_index.add_search_result(search_results.output_parsed, query)
         return search_results.output_parsed
 
     except Exception as e:
-        print(f"An error occurred during the search: {e}")
+        logger.warning("An error occurred during the search: %s", e)
         return None
 
 
+async def warm_up_event_cache() -> None:
+    """
+    Pre-populate the cache for tomorrow with the most popular queries seen so far, and the local
+    event index with events of the configured locations for every age band.
+
+    Families always have interests, so a query without any would never be looked up in the cache.
+    The events found for the configured locations are only added to the index, which matches them
+    against the interests of every family.
+    """
+    tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+    popular = [query for query, _ in popular_queries.most_common(WARM_UP_POPULAR_QUERIES)]
+    # Only the queries warmed up are kept, with their counts halved so that new favourites can catch up.
+    # Otherwise every query ever asked for would stay in memory.
+    kept = {query: popular_queries[query] // 2 for query in popular}
+    popular_queries.clear()
+    popular_queries.update({query: count for query, count in kept.items() if count})
+    locations = [
+        EventQuery(location=location.lower(), date="", age_band=f"{low}-{high}", likes=(), dislikes=())
+        for location in filter(None, (loc.strip() for loc in env_settings.event_warm_up_locations.split(";")))
+        for low, high in AGE_BANDS
+    ]
+
+    semaphore = asyncio.Semaphore(WARM_UP_CONCURRENCY)
+
+    async def warm_up(query: EventQuery, search: Callable[[EventQuery], Awaitable[EventModel | None]]) -> None:
+        async with semaphore:
+            await search(query.model_copy(update={"date": tomorrow}))
+
+    logger.info(
+        "Warming up event cache with %d popular queries and %d location queries for %s",
+        len(popular),
+        len(locations),
+        tomorrow,
+    )
+    await asyncio.gather(
+        *(warm_up(query, _cached_search) for query in dict.fromkeys(popular)),
+        *(warm_up(query, _search_events) for query in locations),
+    )
+
+
+async def run_event_cache_warmer() -> None:
+    """Warm up the cache on startup and again shortly after every day rollover."""
+    while True:
+        await warm_up_event_cache()
+        await asyncio.sleep(_next_midnight() - datetime.datetime.now().timestamp() + 60)
+
+
+def _next_midnight() -> float:
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+
+
+def _age_band(age: int | None) -> str:
+    for low, high in AGE_BANDS:
+        if age is not None and low <= age <= high:
+            return f"{low}-{high}"
+    return "any age"
+
+
+def _normalize_location(address: Address | None) -> str:
+    if address is None:
+        return "unknown location"
+    return ", ".join(part.strip().lower() for part in (address.city, address.country) if part)
+
+
+def _normalize_interests(items: list[str]) -> tuple[str, ...]:
+    return tuple(sorted({item.strip().lower() for item in items if item.strip()}))
+
+
 if __name__ == "__main__":
     # Run it with python -m tools.event_tool
-    result = asyncio.run(find_events_for_child())
+    result = asyncio.run(
+        _find_events_for_child(
+            Knowledge(
+                address=Address(city="Warsaw", country="Poland"),
+                child=PersonEntry(name="Mark", age=10, likes=["physics", "museums"], dislikes=["sports"]),
+            )
+        )
+    )
     print(result)
@@ -1,21 +1,29 @@
 import asyncio
+import datetime
 
-from agents import Agent, Runner
+from agents import Agent
 
-art_project_generator_agent = Agent(
-    name="art_project_generator_agent",
-    instructions="""
+from memo import memoize_agent, run_memoized
+from routing import routed
+
+art_project_generator_agent = memoize_agent(
+    Agent(
+        name="art_project_generator_agent",
+        model=routed("art_project"),
+        instructions="""
     You are responsible for generating an art project based on a provided user provided theme.
     It also ensures the project is age-appropriate.
     Provide a list of materials needed for the project.
     """,
-    output_type=str,
-    input_guardrails=[],
+        output_type=str,
+        input_guardrails=[],
+    ),
+    ttl=datetime.timedelta(days=30),
 )
 
 
 async def get_art_project(context: dict, theme: str):
-    story_result = await Runner.run(
+    story_result = await run_memoized(
         art_project_generator_agent,
         input=f"Generate an art project for a child with age={context['age']} on a following theme={theme}",
     )
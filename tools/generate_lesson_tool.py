@@ -1,20 +1,64 @@
 import asyncio
+import datetime
+import time
 
-from agents import Agent, Runner, WebSearchTool
+from agents import Agent, RunContextWrapper, Runner, WebSearchTool, function_tool
 
-lesson_generator_agent = Agent(
-    name="lesson_agent",
-    instructions="""
+from memo import memoize_agent, run_memoized
+from models import ConvoInfo, Knowledge
+from routing import routed
+from settings import env_settings
+from similarity import SimilarityIndex
+
+# Lessons use web search results, so they are only reused for a day
+LESSON_TTL = datetime.timedelta(days=1)
+
+lesson_generator_agent = memoize_agent(
+    Agent(
+        name="lesson_agent",
+        model=routed("lesson"),
+        instructions="""
     This agent is responsible for generating a lesson plan based on the user's input.
     It takes into account the age of the child and the subject matter.
     It also ensures that the lesson is engaging and age-appropriate.
     It also includes interactive elements to enhance learning.
     Search the web for the latest information on the topic.
     """,
-    output_type=str,
-    input_guardrails=[],
-    tools=[WebSearchTool()],
+        output_type=str,
+        input_guardrails=[],
+        tools=[WebSearchTool()],
+    ),
+    ttl=LESSON_TTL,
 )
+# Requests of earlier lessons, by the age and likes of the child and the theme
+lesson_index = SimilarityIndex("lessons", env_settings.similarity_index_path)
+
+
+@function_tool
+async def generate_lesson_tool(wrapper: RunContextWrapper[ConvoInfo], input: str) -> str:
+    """Generate a lesson plan based on the user's input"""
+    from api import add_to_output
+
+    lesson = await _generate_lesson(input)
+    add_to_output(wrapper.context.convo_id, "lesson", lesson)
+    return lesson
+
+
+async def _generate_lesson(input: str, knowledge: Knowledge | None = None) -> str:
+    """With the family's knowledge, the lesson of a near-identical earlier request is reused."""
+    if knowledge is None or knowledge.child is None or not knowledge.theme:
+        return (await run_memoized(lesson_generator_agent, input)).final_output
+
+    # Only the theme is compared. Likes have to match exactly, a long list of them would outweigh the theme
+    likes = ",".join(sorted({like.strip().lower() for like in knowledge.child.likes or []}))
+    scope, topic = f"{knowledge.child.age}:{likes}", knowledge.theme
+    similar_input = lesson_index.nearest(topic, scope=scope)
+    if similar_input is not None:
+        input = similar_input
+    else:
+        lesson_index.add(input, topic, scope=scope, expires_at=time.time() + LESSON_TTL.total_seconds())
+    lesson = await run_memoized(lesson_generator_agent, input)
+    return lesson.final_output
 
 
 if __name__ == "__main__":
@@ -3,13 +3,15 @@ from __future__ import annotations
 import asyncio
 from pydantic import BaseModel
 from api import AudioMessageToUser, CONVO_DB
-from models import Address, PersonEntry, Knowledge, ConvoInfo
+from logs import get_logger
+from models import Address, PersonEntry, Knowledge, KnowledgePatch, ConvoInfo
 
+from routing import routed
+from scheduler import interactive
 from settings import env_settings
 
 from agents import (
     Agent,
-    ItemHelpers,
     Runner,
     TResponseInputItem,
     function_tool,
@@ -17,36 +19,42 @@ from agents import (
 )
 
 
-class FollowUpQuestion(BaseModel):
+MAX_ONBOARDING_TURNS = 12
+FIRST_QUESTION = "Tell me something about yourselves."
+
+logger = get_logger(__name__)
+
+
+class OnboardingTurn(BaseModel):
+    patch: KnowledgePatch
     follow_up: str | None
 
 
-follow_up_question_generator = Agent(
-    name="question_generator",
+onboarding_turn_agent = Agent(
+    name="onboarding_turn_agent",
+    model=routed("onboarding_turn"),
     instructions=(
         "You want to generate a good initial state for generating stories for a child. We need information about both parent and a child. "
-        "For each person, we need some information about likes, dislikes, age. We do not want to have "
-        "any holes in the structure, so make sure every field is there, including address, parent information and child information. Ask only one question at once. Do not mix personal details with interests - ask separate questions for them. "
-        "There is single child. If you have no follow up question return nothing in the structure. When you ask for address, be specific that you are interested only in city and country, without specific address."
+        "For each person, we need some information about name, likes, dislikes, age. There is single child. "
+        "You get the current state, the list of fields that are still missing, the last question and the answer to it. "
+        "First, return a patch with only the information that the answer adds to the state - leave every other field null. "
+        "List fields in the patch contain only new items. "
+        "If the answer says there is nothing to name, e.g. no dislikes, return an empty list for that field. "
+        "Then, return a follow up question about the remaining missing fields. Ask only one question at once. "
+        "Do not mix personal details with interests - ask separate questions for them. "
+        "When you ask for address, be specific that you are interested only in city and country, without specific address. "
+        "If nothing is missing after applying the patch, return no follow up question."
     ),
-    output_type=FollowUpQuestion,
-)
-
-initial_knowledge_builder = Agent(
-    name="initial_knowledge_builder",
-    instructions=("Based on description, possibly of a parent and a child, create a initial knowledge base."),
-    output_type=Knowledge,
-)
-
-knowledge_updater = Agent(
-    name="knowledge_updater",
-    instructions=("Based on a question, current state, question and answer update the state."),
-    output_type=Knowledge,
+    output_type=OnboardingTurn,
 )
 
 
 @function_tool
 async def onboard_user(wrapper: RunContextWrapper[ConvoInfo]) -> Knowledge:
+    return await onboard(wrapper.context.convo_id)
+
+
+async def onboard(convo_id: str) -> Knowledge:
     if env_settings.preset_knowledge:
         return Knowledge(
             address=Address(
@@ -68,91 +76,101 @@ async def onboard_user(wrapper: RunContextWrapper[ConvoInfo]) -> Knowledge:
             theme="Mark wants to visit Kopernik center in Warsaw with his trusty turtle.",
         )
 
-    # Add imports locally
-    from api import wait_for_user_message, post_message
+    # The family is waiting for every question and its answer
+    with interactive():
+        return await _onboard_user(convo_id)
 
-    # if wrapper.context.existing_convo:
-    #     return CONVO_DB[wrapper.context.convo_id].knowledge
 
-    if not env_settings.run_in_cli:
-        post_message(
-            wrapper.context.convo_id,
-            AudioMessageToUser(audio_message="Tell me something about yourselves."),
-        )
-    print("Tell me something about yourselves:")
-    initial_description = await wait_for_user_message(wrapper.context.convo_id)
-    # Ensure initial_description is not None
-    if initial_description is None:
-        print("Warning: Received None for initial_description. Defaulting to empty string.")
-        initial_description = ""
-
-    print("initial_description: ", initial_description)
-    initial_result = await Runner.run(
-        initial_knowledge_builder,
-        [{"content": initial_description, "role": "system"}],
-    )
-    current_knowledge = Knowledge.model_validate_json(ItemHelpers.text_message_outputs(initial_result.new_items))
-
-    print("initial: ", current_knowledge)
+async def _onboard_user(convo_id: str) -> Knowledge:
+    # Add imports locally
+    from api import wait_for_user_message, post_message
+    from profiles import profile_store
+
+    profile = profile_store.get(CONVO_DB[convo_id].profile_id, convo_id)
+    current_knowledge = CONVO_DB[convo_id].knowledge or Knowledge()
+    stale_fields = profile.stale_fields() if profile is not None else []
+    if "theme" in stale_fields:
+        # Yesterday's theme is not tonight's theme, ask for a new one
+        current_knowledge = current_knowledge.model_copy(update={"theme": None})
+        stale_fields.remove("theme")
+    asked_fields = stale_fields + current_knowledge.missing_fields()
+
+    # Returning family with a fresh and complete profile, nothing to ask
+    if not asked_fields:
+        logger.info("Reusing stored knowledge")
+        return await _finish_onboarding(convo_id, current_knowledge, asked_fields)
+
+    question = _first_question(current_knowledge, stale_fields)
+    for _ in range(MAX_ONBOARDING_TURNS):
+        post_message(convo_id, AudioMessageToUser(audio_message=question))
+        answer = await wait_for_user_message(convo_id)
+        # Ensure answer is not None
+        if answer is None:
+            logger.warning("Received None for answer. Defaulting to empty string.")
+            answer = ""
+        logger.debug("Answer: %s", answer)
 
-    while True:
-        input_items: list[TResponseInputItem] = [
+        turn_input_items: list[TResponseInputItem] = [
             {
                 "content": "Current state is: " + current_knowledge.model_dump_json(),
                 "role": "system",
-            }
+            },
+            {"content": "Missing fields are: " + ", ".join(current_knowledge.missing_fields()), "role": "system"},
+            {"content": "Question is: " + question, "role": "system"},
+            {"content": "Answer to a question is: " + answer, "role": "user"},
         ]
-
-        story_outline_result = await Runner.run(
-            follow_up_question_generator,
-            input_items,
+        if stale_fields:
+            turn_input_items.insert(
+                2, {"content": "Fields the family was asked to confirm: " + ", ".join(stale_fields), "role": "system"}
+            )
+            stale_fields = []
+        turn_result = await Runner.run(
+            onboarding_turn_agent,
+            turn_input_items,
         )
+        turn = turn_result.final_output_as(OnboardingTurn)
 
-        latest_outline = ItemHelpers.text_message_outputs(story_outline_result.new_items)
+        current_knowledge = current_knowledge.apply_patch(turn.patch)
+        logger.debug("Knowledge: %s", current_knowledge)
 
-        structured = FollowUpQuestion.model_validate_json(latest_outline)
-        print(structured)
-
-        if structured.follow_up is None or structured.follow_up == "":
+        # Completeness is checked locally, so the loop ends without another model call
+        if current_knowledge.is_complete() or not turn.follow_up:
             break
+        question = turn.follow_up
 
-        post_message(
-            wrapper.context.convo_id,
-            AudioMessageToUser(audio_message=structured.follow_up),
-        )
-        answer = await wait_for_user_message(wrapper.context.convo_id)
-        # Ensure answer is not None
-        if answer is None:
-            print("Warning: Received None for answer. Defaulting to empty string.")
-            answer = ""
-        print("answer: ", answer)
+    return await _finish_onboarding(convo_id, current_knowledge, asked_fields)
 
-        updater_input_items: list[TResponseInputItem] = [
-            {
-                "content": "Current state is: " + current_knowledge.model_dump_json(),
-                "role": "system",
-            },
-            {"content": "Question is: " + structured.follow_up, "role": "system"},
-            {"content": "Answer to a question is: " + answer, "role": "user"},
-        ]
 
-        updated_result = await Runner.run(
-            knowledge_updater,
-            updater_input_items,
-        )
+def _first_question(knowledge: Knowledge, stale_fields: list[str]) -> str:
+    from profiles import describe_fields
+
+    if len(knowledge.missing_fields()) == len(Knowledge().missing_fields()):
+        return FIRST_QUESTION
 
-        current_knowledge = Knowledge.model_validate_json(ItemHelpers.text_message_outputs(updated_result.new_items))
-        print(current_knowledge)
+    question = "Welcome back!"
+    if stale_fields:
+        question += f" Last time you told me that {describe_fields(knowledge, stale_fields)}. Is that still right?"
+    if not knowledge.theme:
+        question += " What should tonight's story be about?"
+    elif not stale_fields:
+        question += " Tell me something more about yourselves."
+    return question
 
-    CONVO_DB[wrapper.context.convo_id].knowledge = current_knowledge
+
+async def _finish_onboarding(convo_id: str, knowledge: Knowledge, confirmed_fields: list[str]) -> Knowledge:
     from api import add_to_output
+    from profiles import profile_store
+
+    CONVO_DB[convo_id].knowledge = knowledge
+    profile_id = CONVO_DB[convo_id].profile_id or await profile_store.attach(None, convo_id)
+    await profile_store.save(profile_id, knowledge, confirmed_fields)
 
     add_to_output(
-        wrapper.context.convo_id,
+        convo_id,
         "knowledge",
-        current_knowledge.model_dump_json(),
+        knowledge.model_dump_json(),
     )
-    return current_knowledge
+    return knowledge
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+"""
+Catalog of complete stories built ahead of time for popular themes.
+
+Many families ask for the same themes: dinosaurs, brave little mice, a trip to the science center. For
+every configured theme and age band, a bundle (story, storyboard, illustrations and narration) is built
+off-peak, and `get_story` serves the bundle of a similar theme, see similarity.py, in milliseconds
+instead of generating a story live.
+Bundles are kept in SQLite, their media files stay in `static/` like those of generated stories.
+
+Bundles are built every night at `story_catalog_hour`. To build the missing ones right away, run:
+
+```bash
+python -m tools.story_catalog
+```
+"""
+
+import asyncio
+import datetime
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from audio import NarrationOutput
+from deadline import quality_for
+from images import StoryImageOutput
+from logs import get_logger
+from metrics import record_cache
+from models import Knowledge, PersonEntry
+from settings import env_settings
+from similarity import SimilarityIndex
+from tools.storyboard_agent import StoryboardOutput, _build_storyboard
+
+logger = get_logger(__name__)
+
+# Stories are written for an age band, there are none for toddlers or teenagers
+AGE_BANDS = [(3, 5), (6, 8), (9, 12)]
+# Bundles built at the same time, each of them runs a story, a storyboard and a few images and narrations
+BUILD_CONCURRENCY = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bundles (
+    theme TEXT NOT NULL,
+    age_band TEXT NOT NULL,
+    created REAL NOT NULL,
+    bundle_json TEXT NOT NULL,
+    PRIMARY KEY (theme, age_band)
+);
+"""
+
+
+class StoryBundle(BaseModel):
+    theme: str
+    age_band: str
+    story: str
+    storyboard: StoryboardOutput
+    images: StoryImageOutput
+    narration: NarrationOutput
+
+
+class StoryCatalog:
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        # Themes of every age band, so that "a courageous small mouse" finds "A brave little mouse"
+        self.themes = SimilarityIndex("story_themes", path)
+        for theme, age_band in self._db.execute("SELECT theme, age_band FROM bundles").fetchall():
+            if f"{age_band}:{theme}" not in self.themes:
+                self.themes.add(f"{age_band}:{theme}", theme, scope=age_band)
+
+    def add(self, bundle: StoryBundle) -> None:
+        theme = normalize_theme(bundle.theme)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO bundles VALUES (?, ?, ?, ?)",
+                (theme, bundle.age_band, time.time(), bundle.model_dump_json()),
+            )
+        self.themes.add(f"{bundle.age_band}:{theme}", bundle.theme, scope=bundle.age_band)
+
+    def has(self, theme: str, age_band: str) -> bool:
+        return self._get(normalize_theme(theme), age_band) is not None
+
+    def find(self, theme: str, knowledge: Knowledge) -> StoryBundle | None:
+        """A bundle for a similar theme and the child's age, unless it mentions something the family dislikes."""
+        age_band = _age_band(knowledge.child.age if knowledge.child else None)
+        match = self.themes.nearest(theme, scope=age_band) if age_band is not None else None
+        bundle = self._get(match.split(":", 1)[1], age_band) if match is not None else None
+        if bundle is not None and _mentions_dislikes(bundle, knowledge):
+            bundle = None
+        record_cache("story_catalog", bundle is not None)
+        return bundle
+
+    def _get(self, theme: str, age_band: str) -> StoryBundle | None:
+        row = self._db.execute(
+            "SELECT bundle_json FROM bundles WHERE theme = ? AND age_band = ?", (theme, age_band)
+        ).fetchone()
+        return StoryBundle.model_validate_json(row[0]) if row is not None else None
+
+
+def normalize_theme(theme: str) -> str:
+    return " ".join(re.findall(r"\w+", theme.lower()))
+
+
+def personalize(bundle: StoryBundle, knowledge: Knowledge) -> StoryBundle:
+    """Dedicate the story to the child. The narration is recorded already, so the text itself is left as is."""
+    name = knowledge.child.name if knowledge.child else None
+    if not name:
+        return bundle
+    return bundle.model_copy(update={"story": f"A story for {name}\n\n{bundle.story}"})
+
+
+def _age_band(age: int | None) -> str | None:
+    for low, high in AGE_BANDS:
+        if age is not None and low <= age <= high:
+            return f"{low}-{high}"
+    return None
+
+
+def _mentions_dislikes(bundle: StoryBundle, knowledge: Knowledge) -> bool:
+    dislikes = [
+        dislike.lower()
+        for person in (knowledge.child, knowledge.parent)
+        if person is not None
+        for dislike in person.dislikes or []
+        if dislike.strip()
+    ]
+    story = bundle.story.lower()
+    return any(dislike in story for dislike in dislikes)
+
+
+async def build_bundle(theme: str, low: int, high: int) -> StoryBundle | None:
+    """Generate a story for an anonymous child of the age band, None when some of its media failed."""
+    from tools.storytime_agent import _complete_scenes, _illustrate, _narrate, _write_story
+
+    knowledge = Knowledge(child=PersonEntry(name=None, age=(low + high) // 2, likes=[], dislikes=[]), theme=theme)
+    story = await _write_story(knowledge, theme)
+    storyboard = await _build_storyboard(story, quality_for(None).max_scenes)
+    narration, images = _complete_scenes(
+        *await asyncio.gather(
+            _narrate(storyboard, None),
+            _illustrate(storyboard, None, on_hero_image=lambda path: None),
+        )
+    )
+    if not narration.scene_paths or not images.image_paths:
+        logger.warning("Not adding the %s story for ages %d-%d to the catalog, it has no media", theme, low, high)
+        return None
+    return StoryBundle(
+        theme=theme, age_band=f"{low}-{high}", story=story, storyboard=storyboard, images=images, narration=narration
+    )
+
+
+async def build_catalog(catalog: StoryCatalog | None = None) -> int:
+    """Build the bundles missing for the configured themes, returns how many were added."""
+    catalog = catalog or story_catalog
+    themes = [theme.strip() for theme in env_settings.story_catalog_themes.split(";") if theme.strip()]
+    missing = [
+        (theme, low, high) for theme in themes for low, high in AGE_BANDS if not catalog.has(theme, f"{low}-{high}")
+    ]
+    logger.info("Building %d catalog stories for %d themes", len(missing), len(themes))
+    semaphore = asyncio.Semaphore(BUILD_CONCURRENCY)
+
+    async def build(theme: str, low: int, high: int) -> bool:
+        async with semaphore:
+            try:
+                bundle = await build_bundle(theme, low, high)
+            except Exception as e:
+                logger.warning("Failed to build the %s story for ages %d-%d: %s", theme, low, high, e)
+                return False
+            if bundle is None:
+                return False
+            catalog.add(bundle)
+            return True
+
+    return sum(await asyncio.gather(*(build(*entry) for entry in missing)))
+
+
+async def run_story_catalog_builder() -> None:
+    """Build the missing bundles every night, when the providers are quiet."""
+    while True:
+        await asyncio.sleep(_next_build_time() - datetime.datetime.now().timestamp())
+        await build_catalog()
+
+
+def _next_build_time() -> float:
+    now = datetime.datetime.now()
+    build_time = now.replace(hour=env_settings.story_catalog_hour, minute=0, second=0, microsecond=0)
+    if build_time <= now:
+        build_time += datetime.timedelta(days=1)
+    return build_time.timestamp()
+
+
+story_catalog = StoryCatalog(env_settings.story_catalog_path)
+
+
+if __name__ == "__main__":
+    print(f"Added {asyncio.run(build_catalog())} stories to the catalog")
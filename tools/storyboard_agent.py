@@ -1,8 +1,16 @@
 import asyncio
+import datetime
 
-from agents import Agent, Runner, function_tool, RunContextWrapper
+from agents import Agent, function_tool, RunContextWrapper
 from pydantic import BaseModel
+from deadline import quality_for
+from logs import get_logger
+from memo import memoize_agent, run_memoized
 from models import ConvoInfo
+from prompts import STORYBOARD_PROMPT
+from routing import routed
+
+logger = get_logger(__name__)
 
 
 class Scene(BaseModel):
@@ -16,15 +24,19 @@ class ScenesOutput(BaseModel):
     main_character_description: str
 
 
-storyboard_assistant_agent = Agent(
-    name="story_agent",
-    instructions="""You are a creative designer specializing in children's illustrated storybooks. Your task is to take a given story and prepare it for illustration.
+storyboard_assistant_agent = memoize_agent(
+    Agent(
+        name="story_agent",
+        model=routed("storyboard"),
+        instructions="""You are a creative designer specializing in children's illustrated storybooks. Your task is to take a given story and prepare it for illustration.
 First, provide a detailed visual description of the main character suitable for a children's book illustration.
 Second, identify up to 7 key moments from the story (including the setup and the final scene) that would make compelling illustrations.
 For each moment, create a scene consisting of:
 1. A short, engaging title suitable for a page in a children's book.
 2. A detailed prompt for an image generation model, describing the scene visually in a style appropriate for children (e.g., whimsical, colorful, simple).""",
-    output_type=ScenesOutput,
+        output_type=ScenesOutput,
+    ),
+    ttl=datetime.timedelta(days=30),
 )
 
 
@@ -40,33 +52,8 @@ async def get_storyboard(wrapper: RunContextWrapper[ConvoInfo], story: str) -> S
 
 
 async def _get_storyboard(wrapper: RunContextWrapper[ConvoInfo], story: str) -> StoryboardOutput:
-    input_prompt = f"""
-The story is as follows:
-{story}
-
-Please analyze the story and identify up to 7 of its most impactful moments.
-For each moment, create a scene with the following structure:
-- A short, descriptive title for the scene.
-- A detailed prompt suitable for an image generation model that captures the essence of the scene.
-"""
-
-    # Ensure the entire workflow is a single trace
-    # 1. Generate an outline
-    storyboard_result = await Runner.run(
-        storyboard_assistant_agent,
-        input_prompt,
-    )
-    print("Storyboard generated")
-    for scene in storyboard_result.final_output.scene:
-        print(f"Scene Title: {scene.title}")
-        print(f"Scene Narration: {scene.narration}")
-        print(f"Scene Prompt: {scene.prompt}")
-
-    output = StoryboardOutput(
-        images=[scene.prompt for scene in storyboard_result.final_output.scene],
-        narration=[scene.narration for scene in storyboard_result.final_output.scene],
-        main_character_description=storyboard_result.final_output.main_character_description,
-    )
+    # Every scene is illustrated and narrated, so close to the deadline there are fewer of them
+    output = await _build_storyboard(story, quality_for(wrapper.context.deadline).max_scenes)
     from api import add_to_output
 
     add_to_output(
@@ -77,6 +64,27 @@ For each moment, create a scene with the following structure:
     return output
 
 
+async def _build_storyboard(story: str, max_scenes: int) -> StoryboardOutput:
+    input_prompt = STORYBOARD_PROMPT.render(max_scenes=max_scenes, story=story)
+
+    # Ensure the entire workflow is a single trace
+    # 1. Generate an outline
+    storyboard_result = await run_memoized(
+        storyboard_assistant_agent,
+        input_prompt,
+    )
+    scenes = storyboard_result.final_output.scene[:max_scenes]
+    logger.info("Storyboard generated with %d scenes", len(scenes))
+    for scene in scenes:
+        logger.debug("Scene %s. Narration: %s. Prompt: %s", scene.title, scene.narration, scene.prompt)
+
+    return StoryboardOutput(
+        images=[scene.prompt for scene in scenes],
+        narration=[scene.narration for scene in scenes],
+        main_character_description=storyboard_result.final_output.main_character_description,
+    )
+
+
 if __name__ == "__main__":
     asyncio.run(
         _get_storyboard(
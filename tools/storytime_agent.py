@@ -1,6 +1,8 @@
 import asyncio
+import datetime
 import json
 from pathlib import Path
+from typing import Callable
 
 from pydantic import BaseModel
 
@@ -17,10 +19,20 @@ from tools.onboarding_agent import Knowledge, PersonEntry, Address
 from models import StoryContinuationOutput, InteractiveTurnOutput
 from api import post_message
 from models import ConvoInfo
-from tools.storyboard_agent import _get_storyboard
-from images import _generate_image_from_storyboard
-from audio import generate_audio_from_storyboard
+from tools.storyboard_agent import StoryboardOutput, _get_storyboard
+from tools.story_catalog import StoryBundle, personalize, story_catalog
+from images import StoryImageOutput, _generate_image_from_storyboard
+from audio import NarrationOutput, generate_audio_from_storyboard
+from circuit import is_circuit_open
+from deadline import quality_for, seconds_left
 from video import generate_videos
+from memo import memoize_agent, run_memoized
+from logs import get_logger
+from metrics import span
+from prompts import STORY_PROMPT
+from routing import routed
+
+logger = get_logger(__name__)
 
 
 class ViolentStoryOutput(BaseModel):
@@ -28,10 +40,14 @@ class ViolentStoryOutput(BaseModel):
     is_violent_story: bool
 
 
-guardrail_agent = Agent(
-    name="Guardrail check",
-    instructions="Check if the user is asking you to do generate a violent story.",
-    output_type=ViolentStoryOutput,
+guardrail_agent = memoize_agent(
+    Agent(
+        name="Guardrail check",
+        model=routed("checker"),
+        instructions="Check if the user is asking you to do generate a violent story.",
+        output_type=ViolentStoryOutput,
+    ),
+    ttl=datetime.timedelta(days=30),
 )
 
 
@@ -44,7 +60,7 @@ async def violent_story_guardrail(
     """This is an input guardrail function, which happens to call an agent to check if the input
     is a violent story request.
     """
-    result = await Runner.run(guardrail_agent, input, context=context.context)
+    result = await run_memoized(guardrail_agent, input, context=context.context)
     final_output = result.final_output_as(ViolentStoryOutput)
 
     return GuardrailFunctionOutput(
@@ -55,6 +71,7 @@ async def violent_story_guardrail(
 
 story_agent = Agent(
     name="story_agent",
+    model=routed("story"),
     instructions="Write a short story based on the given outline.",
     output_type=str,
     input_guardrails=[violent_story_guardrail],
@@ -63,6 +80,7 @@ story_agent = Agent(
 
 storytime_agent = Agent(
     name="storytime_agent",
+    model=routed("story"),
     instructions="""
     This agent is responsible for generating a children story based on the user's input.
     """,
@@ -80,59 +98,46 @@ async def get_story(wrapper: RunContextWrapper[ConvoInfo], knowledge: Knowledge,
 
 
 async def _get_story(wrapper: RunContextWrapper[ConvoInfo], knowledge: Knowledge, theme: str) -> StoryOutput:
-    input_prompt = f"""
-    Here is some helpful data: {knowledge.model_dump_json()}.
-    You can name characters like parent and child, and use the theme as a base for the story.
-    You can locate the story in the address provided.
-
-    But DO NOT use make humans the main characters of the story.
-    The story should be a short children's story, with a clear beginning, middle, and end.
-    The story should be engaging and suitable for children, with a positive message or moral.
-    The story should be no more than 500 words long.
-    The story should be written in a simple and clear language, with short sentences and paragraphs.
-    The story should be imaginative and creative, with interesting characters and settings.
-    The story should be appropriate for the age group of the child.
-
-    Remember: Generate a story with the theme: {theme}.
-"""
-
-    print("Generating story outline...")
-    # Ensure the entire workflow is a single trace
-    # 1. Generate an outline
-    outline_result = await Runner.run(
-        story_outline_agent,
-        input_prompt,
-    )
-    print("Outline generated")
-    # 4. Write the story
-    story_result = await Runner.run(
-        story_agent,
-        outline_result.final_output,
-    )
-    print(f"Story: {story_result.final_output}")
-
-    storyboard_output = await _get_storyboard(wrapper, story_result.final_output)
-    print("Storyboard generated: " + storyboard_output.model_dump_json())
-
-    print("Generating audio...")
-    audio_output = await generate_audio_from_storyboard(storyboard_output)
-
-    print("Generating images...")
-    images_output = await _generate_image_from_storyboard(
-        storyboard_output,
+    # Popular themes are served from stories built off-peak
+    bundle = story_catalog.find(theme, knowledge)
+    if bundle is not None:
+        logger.info("Serving the %s story for ages %s from the catalog", bundle.theme, bundle.age_band)
+        return _serve_bundle(wrapper.context.convo_id, personalize(bundle, knowledge))
+
+    story = await _write_story(knowledge, theme)
+    from api import add_to_output, publish_section
+
+    # The family can start reading while the story is illustrated and narrated
+    add_to_output(wrapper.context.convo_id, "story", story)
+
+    storyboard_output = await _get_storyboard(wrapper, story)
+    logger.debug("Storyboard generated: %s", storyboard_output)
+
+    # Narration and illustrations are independent, both have to be finished by the deadline
+    deadline = wrapper.context.deadline
+    audio_output, images_output = await asyncio.gather(
+        _narrate(storyboard_output, deadline),
+        _illustrate(
+            storyboard_output,
+            deadline,
+            on_hero_image=lambda path: publish_section(wrapper.context.convo_id, "story_hero_image", path),
+        ),
     )
+    audio_output, images_output = _complete_scenes(audio_output, images_output)
 
-    print("Generating video...")
+    logger.info("Generating video")
     video_output = []
     try:
-        video_output = generate_videos([Path(p) for p in images_output.image_paths])
+        if images_output.image_paths and quality_for(deadline).video:
+            with span("video"):
+                video_output = await generate_videos(
+                    [Path(p) for p in images_output.image_paths], max_wait=seconds_left(deadline)
+                )
+        else:
+            logger.info("Skipping video, there is not enough time left")
     except Exception as e:
-        print(f"Error generating video: {e}")
-    print(images_output)
-    print(audio_output)
-    print(video_output)
-
-    from api import add_to_output
+        logger.warning("Error generating video: %s", e)
+    logger.debug("Images: %s, audio: %s, video: %s", images_output, audio_output, video_output)
 
     add_to_output(
         wrapper.context.convo_id,
@@ -142,8 +147,14 @@ async def _get_story(wrapper: RunContextWrapper[ConvoInfo], knowledge: Knowledge
     add_to_output(
         wrapper.context.convo_id,
         "story_audio",
-        audio_output,
+        audio_output.scene_paths,
     )
+    if audio_output.stitched is not None:
+        add_to_output(
+            wrapper.context.convo_id,
+            "story_narration",
+            audio_output.stitched.model_dump(),
+        )
     add_to_output(
         wrapper.context.convo_id,
         "story_video",
@@ -151,19 +162,105 @@ async def _get_story(wrapper: RunContextWrapper[ConvoInfo], knowledge: Knowledge
     )
 
     return StoryOutput(
-        story=story_result.final_output,
+        story=story,
         theme=theme,
     )
 
 
-story_outline_agent = Agent(
-    name="story_outline_agent",
-    instructions="Generate a very short children story outline based on the user's input.",
+async def _write_story(knowledge: Knowledge, theme: str) -> str:
+    input_prompt = STORY_PROMPT.render(knowledge=knowledge.model_dump_json(), theme=theme)
+
+    logger.info("Generating story outline")
+    # Ensure the entire workflow is a single trace
+    # 1. Generate an outline
+    outline_result = await run_memoized(
+        story_outline_agent,
+        input_prompt,
+    )
+    logger.info("Outline generated")
+    # 4. Write the story
+    story_result = await Runner.run(
+        story_agent,
+        outline_result.final_output,
+    )
+    logger.debug("Story: %s", story_result.final_output)
+    return story_result.final_output
+
+
+def _serve_bundle(convo_id: str, bundle: StoryBundle) -> StoryOutput:
+    """Send a catalog story the same way as a generated one, it has no video."""
+    from api import add_to_output
+
+    add_to_output(convo_id, "story", bundle.story)
+    add_to_output(convo_id, "storyboard", bundle.storyboard.model_dump())
+    add_to_output(convo_id, "story_images", bundle.images.model_dump())
+    add_to_output(convo_id, "story_audio", bundle.narration.scene_paths)
+    if bundle.narration.stitched is not None:
+        add_to_output(convo_id, "story_narration", bundle.narration.stitched.model_dump())
+    add_to_output(convo_id, "story_video", [])
+    return StoryOutput(story=bundle.story, theme=bundle.theme)
+
+
+async def _narrate(storyboard_output: StoryboardOutput, deadline: float | None) -> NarrationOutput:
+    # While a provider's circuit is open, the story is delivered without what that provider makes
+    logger.info("Generating audio")
+    try:
+        return await generate_audio_from_storyboard(storyboard_output, deadline)
+    except Exception as e:
+        if not is_circuit_open(e):
+            raise
+        logger.warning("Speech is unavailable, the story has no narration")
+        return NarrationOutput(scene_paths=[])
+
+
+async def _illustrate(
+    storyboard_output: StoryboardOutput, deadline: float | None, on_hero_image: Callable[[str], None]
+) -> StoryImageOutput:
+    logger.info("Generating images")
+    try:
+        return await _generate_image_from_storyboard(
+            storyboard_output,
+            quality=quality_for(deadline).image_quality,
+            deadline=deadline,
+            on_hero_image=on_hero_image,
+        )
+    except Exception as e:
+        if not is_circuit_open(e):
+            raise
+        logger.warning("Images are unavailable, the story has no illustrations")
+        return StoryImageOutput(image_paths=[])
+
+
+def _complete_scenes(
+    audio_output: NarrationOutput, images_output: StoryImageOutput
+) -> tuple[NarrationOutput, StoryImageOutput]:
+    """Keep only the scenes that have both narration and an illustration, unless one of them is missing altogether."""
+    if not audio_output.scene_paths or not images_output.image_paths:
+        return audio_output, images_output
+    # The first image is the hero, every following one belongs to the narration of the same scene
+    scenes = min(len(audio_output.scene_paths), len(images_output.image_paths) - 1)
+    stitched = audio_output.stitched
+    if stitched is not None:
+        stitched = stitched.model_copy(update={"scenes": stitched.scenes[:scenes]})
+    return (
+        NarrationOutput(scene_paths=audio_output.scene_paths[:scenes], stitched=stitched),
+        StoryImageOutput(image_paths=images_output.image_paths[: scenes + 1]),
+    )
+
+
+story_outline_agent = memoize_agent(
+    Agent(
+        name="story_outline_agent",
+        model=routed("story"),
+        instructions="Generate a very short children story outline based on the user's input.",
+    ),
+    ttl=datetime.timedelta(days=7),
 )
 
 # --- Interactive Story Components ---
 story_continuation_agent = Agent(
     name="story_continuation_agent",
+    model=routed("interactive_story"),
     instructions="""
 You are an interactive storyteller for children.
 Given the story so far and the user's chosen path (or an initial topic), generate the next short scene (1-2 paragraphs) of the story.
@@ -188,6 +285,7 @@ from images import generate_image_from_storyboard
 
 interactive_story_illustrator_agent = Agent(
     name="interactive_story_illustrator_agent",
+    model=routed("interactive_story"),
     instructions="""
 You are an interactive storyteller and illustrator for children.
 
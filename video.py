@@ -1,105 +1,113 @@
+import asyncio
 import base64
 import os
-import time
 from pathlib import Path
-from typing import cast
+from runwayml import AsyncRunwayML
 
-from runwayml import RunwayML
+from circuit import CircuitOpenError, circuit_breaker
+from logs import get_logger
+from scheduler import provider_scheduler
+from settings import env_settings
 
+logger = get_logger(__name__)
 
-def get_client_runway() -> RunwayML:
+POLL_SECONDS = 10
+# Videos are an extra, the story is delivered without them after this long
+MAX_WAIT_SECONDS = 600
+
+
+def get_client_runway() -> AsyncRunwayML:
     api_key = os.getenv("RUNWAY_API_KEY")
     if not api_key:
         raise EnvironmentError("RUNWAY_API_KEY environment variable is not set.")
-    return RunwayML(api_key=api_key)
+    return AsyncRunwayML(api_key=api_key, base_url=env_settings.runway_base_url)
 
 
-def generate_video(input_image_path: Path, client: RunwayML):
-    """Encodes an image and submits a request to generate video."""
-    try:
-        with open(input_image_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
-
-        prompt_image = f"data:image/webp;base64,{encoded_image}"
+async def generate_video(input_image_path: Path, client: AsyncRunwayML) -> str:
+    """Encodes an image and submits a request to generate video, returns the task ID."""
+    encoded_image = base64.b64encode(input_image_path.read_bytes()).decode("utf-8")
+    prompt_image = f"data:image/webp;base64,{encoded_image}"
 
-        task = client.image_to_video.create(
+    async with circuit_breaker("runway").guard(), provider_scheduler("runway").slot():
+        task = await client.image_to_video.create(
             model="gen4_turbo",
             prompt_image=prompt_image,
             prompt_text="Follow a main character in a fairytale world.",
             ratio="1280:720",
         )
 
-        print(f"Task created with ID: {task.id}")
-        return task.id
+    logger.info("Task created with ID: %s", task.id)
+    return task.id
 
-    except Exception as e:
-        print(f"Error generating video: {e}")
-        return None
 
-
-def check_task_status(task_id, client: RunwayML):
-    """Polls task status with a timeout mechanism and returns output URLs."""
+async def check_task_status(task_id: str, client: AsyncRunwayML) -> list[str] | None:
+    """Returns the output URLs of a finished task, an empty list when it failed, None while it is still running."""
     try:
-        task = client.tasks.retrieve(id=task_id)
-        if task is None or task.status is None:
-            print(f"Task {task_id} not found or status is None.")
-            return None
-        elif task.status == "SUCCEEDED":
-            assert task.output, "Task output is None"
-            print("Task completed!")
-            return [output for output in task.output]
-
-        elif task.status == "FAILED":
-            print("Task failed.")
-            return None
-
-        else:
-            assert False, f"Unexpected task status: {task.status}"
-
+        async with circuit_breaker("runway").guard(), provider_scheduler("runway").slot():
+            task = await client.tasks.retrieve(id=task_id)
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        print(f"Error checking task status: {e}")
+        logger.warning("Error checking task status: %s", e)
         return None
 
+    if task.status == "SUCCEEDED":
+        assert task.output, "Task output is None"
+        logger.info("Task %s completed", task_id)
+        return list(task.output)
+    if task.status == "FAILED":
+        logger.warning("Task %s failed", task_id)
+        return []
+    return None
 
-def generate_videos(images: list[Path]) -> list[str]:
-    print("Starting video generation...")
+
+async def generate_videos(images: list[Path], max_wait: float | None = None) -> list[str | None]:
+    """
+    URL of a video for every image, in order, None for a video that failed.
+
+    Once `max_wait` is over, the videos finished so far are returned and the unfinished ones are None.
+    """
+    logger.info("Starting video generation for %d images", len(images))
     client = get_client_runway()
-    task_ids: dict[str, str | None] = {}
 
     for img in images:
         assert img.exists(), f"Image {img} does not exist."
+    task_ids: dict[str, list[str] | None] = {
+        task_id: None for task_id in await asyncio.gather(*(generate_video(img, client) for img in images))
+    }
 
-        task_id = generate_video(img, client)  # Get task ID
-        assert task_id, f"Failed to create task for {img}"
-        print(f"Task ID: {task_id}")
-        task_ids[task_id] = None  # Mark tsk as not ready
-
-    while not all(task_ids.values()):
-        print("Waiting for tasks to complete...")
-        time.sleep(10)
-
-        for task_id, url in task_ids.items():
-            if url is not None:
-                continue
-
-            url_candidate = check_task_status(task_id, client)
-            if url_candidate:
-                task_ids[task_id] = url_candidate
-                print(f"Task {task_id} is ready.")
-            else:
-                print(f"Task {task_id} is not ready yet.")
-
-    list_of_videos = list(task_ids.values())
+    try:
+        async with asyncio.timeout(MAX_WAIT_SECONDS if max_wait is None else min(max_wait, MAX_WAIT_SECONDS)):
+            while any(url is None for url in task_ids.values()):
+                logger.info("Waiting for tasks to complete")
+                await asyncio.sleep(POLL_SECONDS)
+
+                pending = [task_id for task_id, url in task_ids.items() if url is None]
+                for task_id, url_candidate in zip(
+                    pending, await asyncio.gather(*(check_task_status(task_id, client) for task_id in pending))
+                ):
+                    if url_candidate is not None:
+                        task_ids[task_id] = url_candidate
+                        logger.info("Task %s is finished", task_id)
+                    else:
+                        logger.info("Task %s is not ready yet", task_id)
+    except TimeoutError:
+        pending = [task_id for task_id, url in task_ids.items() if url is None]
+        logger.warning("Stopped waiting for %d of %d videos", len(pending), len(task_ids))
+
+    list_of_videos = [urls[0] if urls else None for urls in task_ids.values()]
     for idx, video in enumerate(list_of_videos, start=1):
-        print(f"Video {idx}: {video}")
+        logger.info("Video %d: %s", idx, video)
 
-    return cast(list[str], list_of_videos)
+    return list_of_videos
 
 
 if __name__ == "__main__":
-    generate_videos(
-        images=[
-            Path("sample_images/1fe76004-b7dd-438d-a82b-26687f79eba1/img_0.png"),
-            Path("sample_images/1fe76004-b7dd-438d-a82b-26687f79eba1/img_1.png"),
-        ]
+    asyncio.run(
+        generate_videos(
+            images=[
+                Path("sample_images/1fe76004-b7dd-438d-a82b-26687f79eba1/img_0.png"),
+                Path("sample_images/1fe76004-b7dd-438d-a82b-26687f79eba1/img_1.png"),
+            ]
+        )
     )
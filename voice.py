@@ -0,0 +1,198 @@
+"""
+Streaming voice input, used by the `/ws/audio/{convo_id}` WebSocket.
+
+The client sends raw 16 kHz mono PCM16 audio in chunks of any size while the parent is talking.
+An energy based voice activity detector finds where an utterance ends. While speech goes on, the
+utterance so far is transcribed every couple of seconds and sent back as a partial transcript.
+Once the speaker has been quiet for `END_SILENCE_MS`, the whole utterance is transcribed one last
+time and handed to the agent, without a separate upload.
+"""
+
+import asyncio
+import io
+import math
+import wave
+from array import array
+from collections import deque
+from typing import Awaitable, Callable, Protocol
+
+from circuit import CircuitOpenError, circuit_breaker
+from convert_mp3 import prepare_for_transcription
+from logs import get_logger
+from metrics import span
+from settings import openai_client
+
+logger = get_logger(__name__)
+
+SAMPLE_RATE = 16_000
+SAMPLE_WIDTH = 2
+FRAME_MS = 20
+# RMS of a PCM16 frame above which the frame counts as speech
+SPEECH_THRESHOLD = 500
+MIN_SPEECH_MS = 100
+END_SILENCE_MS = 700
+# Audio kept from before the detected onset, so the first syllable is not cut off
+PRE_ROLL_MS = 200
+PARTIAL_EVERY_MS = 2000
+MAX_UTTERANCE_MS = 60_000
+
+
+class Transcriber(Protocol):
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> str: ...
+
+
+class OpenAITranscriber:
+    def __init__(self, model: str = "gpt-4o-transcribe"):
+        self.model = model
+
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> str:
+        upload = await prepare_for_transcription(pcm_to_wav(pcm, sample_rate), "utterance.wav", "audio/wav")
+        with span("transcription", "stream"):
+            async with circuit_breaker("openai_transcription").guard():
+                transcription = await openai_client.audio.transcriptions.create(model=self.model, file=upload)
+        return transcription.text
+
+
+class StubTranscriber:
+    """Local stand-in that describes the audio instead of transcribing it."""
+
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> str:
+        return f"{len(pcm) * 1000 // (sample_rate * SAMPLE_WIDTH)} ms of speech"
+
+
+class VoiceActivityDetector:
+    """Tells where speech starts and ends in a stream of fixed size PCM16 frames."""
+
+    def __init__(self, threshold: float = SPEECH_THRESHOLD):
+        self.threshold = threshold
+        self.in_speech = False
+        self._speech_frames = 0
+        self._silent_frames = 0
+
+    def push(self, frame: bytes) -> str | None:
+        """Returns "start" on the frame speech is detected, "end" on the frame it is over, None otherwise."""
+        if frame_energy(frame) >= self.threshold:
+            self._speech_frames += 1
+            self._silent_frames = 0
+            if not self.in_speech and self._speech_frames >= MIN_SPEECH_MS // FRAME_MS:
+                self.in_speech = True
+                return "start"
+            return None
+
+        self._speech_frames = 0
+        if self.in_speech:
+            self._silent_frames += 1
+            if self._silent_frames >= END_SILENCE_MS // FRAME_MS:
+                self.in_speech = False
+                self._silent_frames = 0
+                return "end"
+        return None
+
+
+class VoiceSession:
+    """
+    Endpointing and transcription for one WebSocket connection.
+
+    `send` receives partial and final transcript messages for the client,
+    `on_final` receives the text of every finished utterance.
+    """
+
+    def __init__(
+        self,
+        transcriber: Transcriber,
+        send: Callable[[dict], Awaitable[None]],
+        on_final: Callable[[str], None],
+        sample_rate: int = SAMPLE_RATE,
+    ):
+        self.transcriber, self.send, self.on_final, self.sample_rate = transcriber, send, on_final, sample_rate
+        self.frame_bytes = sample_rate * SAMPLE_WIDTH * FRAME_MS // 1000
+        self.vad = VoiceActivityDetector()
+        self._pending = bytearray()
+        self._pre_roll: deque[bytes] = deque(maxlen=PRE_ROLL_MS // FRAME_MS)
+        self._utterance = bytearray()
+        self._partial_at = 0
+        self._partial_task: asyncio.Task | None = None
+
+    async def feed(self, chunk: bytes) -> None:
+        self._pending += chunk
+        while len(self._pending) >= self.frame_bytes:
+            frame = bytes(self._pending[: self.frame_bytes])
+            del self._pending[: self.frame_bytes]
+
+            transition = self.vad.push(frame)
+            if transition == "start":
+                self._utterance = bytearray(b"".join(self._pre_roll))
+                self._partial_at = 0
+            if not self.vad.in_speech and transition != "end":
+                self._pre_roll.append(frame)
+                continue
+
+            self._utterance += frame
+            if transition == "end" or self._ms(len(self._utterance)) >= MAX_UTTERANCE_MS:
+                self.vad.in_speech = False
+                await self.flush()
+            elif self._ms(len(self._utterance) - self._partial_at) >= PARTIAL_EVERY_MS:
+                self._start_partial()
+
+    async def flush(self) -> None:
+        """Finish the utterance in progress, e.g. when the client says it stopped recording."""
+        self._cancel_partial()
+        utterance, self._utterance = bytes(self._utterance), bytearray()
+        self._pre_roll.clear()
+        if not utterance:
+            return
+        try:
+            text = await self.transcriber.transcribe(utterance, self.sample_rate)
+        except CircuitOpenError:
+            # Nothing goes to the agent, the client asks the parent to type instead
+            await self.send({"type": "unavailable", "text": "Voice input is unavailable right now"})
+            return
+        logger.debug("Streamed utterance of %d ms: %s", self._ms(len(utterance)), text)
+        await self.send({"type": "final", "text": text})
+        self.on_final(text)
+
+    def close(self) -> None:
+        """Drop the utterance in progress, the client is gone."""
+        self._cancel_partial()
+        self._utterance = bytearray()
+
+    def _start_partial(self) -> None:
+        # Only one partial transcription at a time, a newer one will cover the skipped audio
+        if self._partial_task is not None and not self._partial_task.done():
+            return
+        self._partial_at = len(self._utterance)
+        self._partial_task = asyncio.create_task(self._send_partial(bytes(self._utterance)))
+
+    async def _send_partial(self, utterance: bytes) -> None:
+        try:
+            text = await self.transcriber.transcribe(utterance, self.sample_rate)
+            await self.send({"type": "partial", "text": text})
+        except Exception as e:
+            # Partials are best effort, the final transcript is what counts
+            logger.warning("Partial transcription failed: %s", e)
+
+    def _cancel_partial(self) -> None:
+        if self._partial_task is not None:
+            self._partial_task.cancel()
+            self._partial_task = None
+
+    def _ms(self, size: int) -> int:
+        return size * 1000 // (self.sample_rate * SAMPLE_WIDTH)
+
+
+def frame_energy(frame: bytes) -> float:
+    samples = array("h", frame)
+    return math.sqrt(sum(sample * sample for sample in samples) / len(samples)) if samples else 0.0
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+voice_transcriber: Transcriber = OpenAITranscriber()